@@ -0,0 +1,139 @@
+"""Бенчмарк загрузки корпуса (слов и предложений) одного чата.
+
+Целевой чат содержит 1000 сообщений, рядом лежат 10 000 других чатов.
+Сравниваются старые вложенные подзапросы через messages и выборка по chat_id.
+
+Запуск из корня репозитория: python -m bench.bench_cache_load
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.dedup import content_hash  # noqa: E402
+from storage.memory import BotMemory  # noqa: E402
+
+TARGET_CHAT = -1
+LEGACY_QUERIES = (
+    "SELECT word_id FROM words WHERE sentence_id IN (SELECT id FROM sentences WHERE message_id IN "
+    "(SELECT id FROM messages WHERE chat_id = ?))",
+    "SELECT content FROM sentences WHERE message_id IN (SELECT id FROM messages WHERE chat_id = ?)",
+)
+CHAT_ID_QUERIES = (
+    "SELECT word_id FROM words WHERE chat_id = ?",
+    "SELECT content FROM sentences WHERE chat_id = ?",
+)
+VOCABULARY = ("уголь", "кот", "печка", "дым", "искра", "зола", "жар", "тепло", "ночь", "снег",
+              "hello", "world", "fire", "coal", "smoke", "cat", "warm", "night", "snow", "spark")
+
+
+def populate(path: str, other_chats: int, other_messages: int, target_messages: int):
+    """Заполнение базы синтетическими сообщениями напрямую через sqlite3."""
+    db = sqlite3.connect(path)
+    db.executemany("INSERT INTO vocab (id, text) VALUES (?, ?)", enumerate(VOCABULARY, 1))
+    vocab_ids = {word: word_id for word_id, word in enumerate(VOCABULARY, 1)}
+    message_id = sentence_id = word_id = 0
+    messages, sentences, words = [], [], []
+
+    def add(chat_id: int, index: int):
+        nonlocal message_id, sentence_id, word_id
+        message_id += 1
+        parts = []
+        for s in range(2):
+            sentence = " ".join(VOCABULARY[(index * 7 + s * 3 + w) % len(VOCABULARY)] for w in range(6))
+            parts.append(sentence)
+            sentence_id += 1
+            sentences.append((sentence_id, message_id, chat_id, sentence))
+            for word in sentence.split():
+                word_id += 1
+                words.append((word_id, sentence_id, chat_id, vocab_ids[word]))
+        content = f"{'. '.join(parts)} #{index}"
+        messages.append((message_id, chat_id, "text", content, content_hash("text", content)))
+
+    # Сообщения чатов перемешаны, как при реальной переписке
+    for index in range(max(other_messages, target_messages)):
+        for chat_id in range(1, other_chats + 1):
+            if index < other_messages:
+                add(chat_id, index)
+        if index < target_messages:
+            add(TARGET_CHAT, index)
+        if len(words) > 200_000:
+            flush(db, messages, sentences, words)
+    flush(db, messages, sentences, words)
+    db.execute("ANALYZE")
+    db.commit()
+    db.close()
+
+
+def flush(db, messages, sentences, words):
+    db.executemany("INSERT INTO messages (id, chat_id, type, content, hash) VALUES (?, ?, ?, ?, ?)", messages)
+    db.executemany("INSERT INTO sentences (id, message_id, chat_id, content) VALUES (?, ?, ?, ?)", sentences)
+    db.executemany("INSERT INTO words (id, sentence_id, chat_id, word_id) VALUES (?, ?, ?, ?)", words)
+    db.commit()
+    messages.clear()
+    sentences.clear()
+    words.clear()
+
+
+async def run_queries(memory: BotMemory, queries) -> float:
+    started = time.perf_counter()
+    for query in queries:
+        cursor = await memory.db.execute(query, (TARGET_CHAT,))
+        await cursor.fetchall()
+    return time.perf_counter() - started
+
+
+async def measure(memory: BotMemory, repeats: int):
+    legacy, current, corpus_load = [], [], []
+    for _ in range(repeats):
+        legacy.append(await run_queries(memory, LEGACY_QUERIES))
+        current.append(await run_queries(memory, CHAT_ID_QUERIES))
+
+        memory.corpus.drop(TARGET_CHAT)
+        started = time.perf_counter()
+        corpus = await memory.get_corpus(TARGET_CHAT)
+        corpus_load.append(time.perf_counter() - started)
+    return legacy, current, corpus_load, corpus.word_count
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--other-chats", type=int, default=10_000)
+    parser.add_argument("--other-messages", type=int, default=10, help="сообщений в каждом другом чате")
+    parser.add_argument("--target-messages", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        memory = BotMemory(path)
+        await memory.init_db()
+        await memory.close_db()
+
+        started = time.perf_counter()
+        populate(path, args.other_chats, args.other_messages, args.target_messages)
+        print(f"База заполнена за {time.perf_counter() - started:.1f} с: "
+              f"{args.other_chats} чатов по {args.other_messages} сообщений + целевой чат "
+              f"с {args.target_messages} сообщениями")
+
+        memory = BotMemory(path)
+        await memory.init_db()
+        legacy, current, corpus_load, words = await measure(memory, args.repeats)
+        await memory.close_db()
+
+    print(f"Слов в кэше целевого чата: {words}")
+    for name, samples in (("через messages (старый запрос)", legacy), ("по chat_id", current),
+                          ("полная загрузка корпуса", corpus_load)):
+        print(f"{name:32} медиана {statistics.median(samples) * 1000:8.2f} мс, "
+              f"мин {min(samples) * 1000:8.2f} мс")
+    print(f"Ускорение: x{statistics.median(legacy) / statistics.median(current):.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
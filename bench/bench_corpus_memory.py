@@ -0,0 +1,97 @@
+"""Бенчмарк памяти кэша корпусов: списки строк против компактного ChatCorpus.
+
+Старая раскладка повторяет кэш TextModifier до перехода на ChatCorpus: по
+отдельному объекту str на каждое вхождение слова и на каждое предложение.
+Память считается через tracemalloc для 1k, 10k и 100k чатов.
+
+Запуск из корня репозитория: python -m bench.bench_corpus_memory
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.corpus import CorpusCache  # noqa: E402
+from storage.vocab import Vocabulary  # noqa: E402
+
+
+def make_words(size: int):
+    return [f"слово{i}" for i in range(size)]
+
+
+def chat_sentences(rng: random.Random, words, cum_weights, messages: int):
+    """Предложения одного чата: 1–3 на сообщение, 3–10 слов с частотами по Ципфу."""
+    for _ in range(messages):
+        for _ in range(rng.randint(1, 3)):
+            yield rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 10))
+
+
+def build_legacy(chats: int, messages: int, seed: int, words, weights):
+    rng = random.Random(seed)
+    word_cache, sentence_cache = {}, {}
+    for chat_id in range(chats):
+        chat_words, chat_sentences_list = [], []
+        for sentence in chat_sentences(rng, words, weights, messages):
+            # Строки из базы приходят отдельными объектами на каждую строку выборки
+            chat_sentences_list.append(" ".join(sentence))
+            chat_words.extend("".join(word) for word in sentence)
+        word_cache[chat_id] = chat_words
+        sentence_cache[chat_id] = chat_sentences_list
+    return word_cache, sentence_cache
+
+
+def build_compact(chats: int, messages: int, seed: int, words, weights):
+    rng = random.Random(seed)
+    vocab = Vocabulary()
+    vocab.register(enumerate(words, 1))
+    cache = CorpusCache(vocab, chats)
+    sentence_id = message_id = 0
+    for chat_id in range(chats):
+        sentences = []
+        for sentence in chat_sentences(rng, words, weights, messages):
+            sentence_id += 1
+            sentences.append((sentence_id, [vocab.ids[word] for word in sentence]))
+        cache.load(chat_id, range(message_id + 1, message_id + messages + 1), sentences)
+        message_id += messages
+    return cache
+
+
+def measure(build, *args) -> float:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build(*args)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    gc.collect()
+    return current / 1024 / 1024, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--messages", type=int, default=5, help="сообщений в каждом чате")
+    parser.add_argument("--vocabulary", type=int, default=5_000, help="размер словаря")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    words = make_words(args.vocabulary)
+    # Накопленные веса считаются один раз, иначе choices пересчитывает их на каждый вызов
+    weights = list(accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    print(f"{'чатов':>8} {'списки строк, МиБ':>18} {'ChatCorpus, МиБ':>16} {'выигрыш':>8}")
+    for chats in args.chats:
+        legacy, _ = measure(build_legacy, chats, args.messages, args.seed, words, weights)
+        compact, _ = measure(build_compact, chats, args.messages, args.seed, words, weights)
+        print(f"{chats:>8} {legacy:>18.1f} {compact:>16.1f} {legacy / compact:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Бенчмарк влияния логирования на задержку обработки сообщений в группах.
+
+Сценарий bench_throughput прогоняется при разных уровнях лога и трёх
+способах вывода: синхронный StreamHandler (форматирование и запись прямо
+в цикле событий, как при logging.basicConfig), очередь LogPipeline без
+ограничения частоты и очередь с прореживанием DEBUG-записей. Лог пишется
+во временный файл; каждый прогон — в отдельном процессе.
+
+Выводятся апдейтов в секунду, p50/p95/p99 времени feed_update и число
+строк, попавших в лог.
+
+Запуск из корня репозитория: python -m bench.bench_logging
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.bench_throughput import run_scenario  # noqa: E402
+from bench.fakes import make_updates  # noqa: E402
+
+MODES = ("sync", "queue", "sampled")
+
+
+def run_configuration(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Прогон сценария с заданным уровнем и способом вывода лога."""
+    from config import LOG_DEBUG_RATE, LOG_FORMAT
+    from utils.logging_setup import setup_logging
+
+    with open(params["log_path"], "w", encoding="utf-8") as stream:
+        if params["mode"] == "sync":
+            handler = logging.StreamHandler(stream)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            root = logging.getLogger()
+            root.handlers[:] = [handler]
+            root.setLevel(params["level"])
+            logging.getLogger("aiosqlite").setLevel(logging.INFO)
+            result = run_scenario(params)
+        else:
+            logs = setup_logging(params["level"], stream=stream,
+                                 debug_rate=LOG_DEBUG_RATE if params["mode"] == "sampled" else 0)
+            try:
+                result = run_scenario(params)
+            finally:
+                logs.stop()
+    with open(params["log_path"], encoding="utf-8") as file:
+        result["lines"] = sum(1 for _ in file)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=5000, help="апдейтов в сценарии")
+    parser.add_argument("--chats", type=int, default=100, help="число чатов")
+    parser.add_argument("--levels", default="DEBUG,INFO,WARNING", help="уровни лога через запятую")
+    parser.add_argument("--modes", default=",".join(MODES), help="способы вывода через запятую: " + ", ".join(MODES))
+    parser.add_argument("--frequency", type=int, default=50, help="частота ответов чатов")
+    parser.add_argument("--intelligence", type=int, default=50, help="интеллект чатов")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных feed_update")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушки Bot API (сек)")
+    parser.add_argument("--backend", choices=("sqlite", "memory"), default="sqlite", help="хранилище бота")
+    args = parser.parse_args()
+
+    updates = make_updates(args.updates, args.chats, stickers=0.1, duplicates=0.05)
+    print(f"Чатов: {args.chats}, частота: {args.frequency}, интеллект: {args.intelligence}, "
+          f"хранилище: {args.backend}")
+    print(f"{'уровень':>8} {'вывод':>8} {'апд/с':>8} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'строк':>8}")
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        for level in args.levels.split(","):
+            for mode in args.modes.split(","):
+                params = {"updates": updates, "frequency": args.frequency, "intelligence": args.intelligence,
+                          "concurrency": args.concurrency, "latency": args.latency, "backend": args.backend,
+                          "level": level, "mode": mode, "log_path": os.path.join(tmp, f"{level}.{mode}.log")}
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(run_configuration, params).result()
+                print(f"{level:>8} {mode:>8} {result['rate']:>8.0f} {result['p50']:>8.2f} {result['p95']:>8.2f} "
+                      f"{result['p99']:>8.2f} {result['lines']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Сквозной бенчмарк пропускной способности обработки сообщений в группах.
+
+Апдейты подаются в group_router через Dispatcher.feed_update с заданным
+числом одновременных обработчиков, Bot API заменён сессией без сети с
+настраиваемой задержкой. Трафик синтетический (тексты, стикеры и повторы
+по многим чатам) или записанный (--file, JSONL).
+
+Каждый сценарий — число чатов и пара частота:интеллект — выполняется в
+отдельном процессе со своей временной базой, чтобы кэши и RSS сценариев
+не смешивались. Перед замером чаты регистрируются и получают настройки
+сценария. Лимиты отправки планировщика и очередь фоновых этапов не
+ограничиваются: замеряется вся работа бота, а не ограничения Telegram и
+сброс нагрузки.
+
+Выводятся апдейтов в секунду (до опустошения фоновых этапов и очереди
+записи), p50/p95/p99 времени feed_update, запросов к базе и вызовов Bot
+API на апдейт и RSS процесса после сценария.
+
+Запуск из корня репозитория: python -m bench.bench_throughput
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fakes import FAKE_TOKEN, FakeSession, load_updates, make_updates  # noqa: E402
+
+UNLIMITED = 1e9  # Лимит отправки, который никогда не срабатывает
+
+
+class CountingConnection:
+    """Обёртка соединения aiosqlite, считающая обращения к потоку базы."""
+
+    def __init__(self, db):
+        self.db = db
+        self.calls = 0
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+    def execute(self, *args, **kwargs):
+        self.calls += 1
+        return self.db.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.calls += 1
+        return self.db.executemany(*args, **kwargs)
+
+    def commit(self):
+        self.calls += 1
+        return self.db.commit()
+
+
+def rss_mib() -> float:
+    """Текущий RSS процесса; без /proc — пиковый."""
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_scenario(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Сценарий в отдельном процессе: модули бота импортируются уже с нужным хранилищем."""
+    import config
+    config.STORAGE_BACKEND = params["backend"]
+    return asyncio.run(_run_scenario(params))
+
+
+async def _run_scenario(params: Dict[str, Any]) -> Dict[str, Any]:
+    import logging
+    from aiogram import Bot, Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from aiogram.types import Update
+    from handlers.group_handlers import group_router
+    from storage.memory import memory
+    from utils.pipeline import pipeline
+    from utils.sender import sender
+
+    logging.basicConfig(level=logging.ERROR)
+    updates = params["updates"]
+    with tempfile.TemporaryDirectory() as tmp:
+        memory.db_path = os.path.join(tmp, "bench.db")
+        await memory.init_db()
+        chats = {update.get("message", {}).get("chat", {}).get("id") for update in updates} - {None}
+        for chat_id in sorted(chats):
+            await memory.ensure_chat(chat_id, f"Чат {chat_id}")
+            await memory.set_response_frequency(chat_id, params["frequency"])
+            await memory.set_intelligence(chat_id, params["intelligence"])
+        counter: Optional[CountingConnection] = None
+        if getattr(memory, "db", None) is not None:
+            counter = memory.db = CountingConnection(memory.db)
+        pipeline.max_pending = len(updates) * 2  # Реакция и ответ на каждый апдейт
+        sender.set_global_rate(UNLIMITED)
+        sender.chat_rate = sender.chat_burst = UNLIMITED
+        sender.start()
+        session = FakeSession(params["latency"])
+        bot = Bot(token=FAKE_TOKEN, session=session)
+        dp = Dispatcher(storage=MemoryStorage())
+        dp.include_router(group_router)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for update in updates:
+            queue.put_nowait(Update.model_validate(update, context={"bot": bot}))
+        latencies: List[float] = []
+
+        async def worker():
+            while not queue.empty():
+                update = queue.get_nowait()
+                started = time.perf_counter()
+                await dp.feed_update(bot, update)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(params["concurrency"])))
+        await pipeline.drain()
+        await memory.flush()
+        elapsed = time.perf_counter() - started
+
+        db_calls = counter.calls if counter else 0
+        await sender.stop()
+        if counter:
+            memory.db = counter.db
+        await memory.close_db()
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        "rate": len(updates) / elapsed,
+        "p50": percentiles[49] * 1000,
+        "p95": percentiles[94] * 1000,
+        "p99": percentiles[98] * 1000,
+        "db": db_calls / len(updates),
+        "api": sum(session.calls.values()) / len(updates),
+        "dropped": pipeline.dropped,
+        "rss": rss_mib(),
+    }
+
+
+def parse_profiles(value: str) -> List[tuple]:
+    """Строка вида "50:50,100:90" — пары частота:интеллект."""
+    profiles = []
+    for item in value.split(","):
+        frequency, intelligence = item.split(":")
+        profiles.append((int(frequency), int(intelligence)))
+    return profiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--file", help="JSONL с записанными апдейтами вместо синтетических")
+    parser.add_argument("--updates", type=int, default=5000, help="апдейтов в сценарии")
+    parser.add_argument("--chats", default="10,100,1000", help="числа чатов через запятую")
+    parser.add_argument("--profiles", default="0:50,50:50,100:90,100:100",
+                        help="пары частота:интеллект через запятую")
+    parser.add_argument("--stickers", type=float, default=0.1, help="доля стикеров")
+    parser.add_argument("--duplicates", type=float, default=0.05, help="доля повторов прошлых сообщений чата")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных feed_update")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушки Bot API (сек)")
+    parser.add_argument("--backend", choices=("sqlite", "memory"), default="sqlite", help="хранилище бота")
+    args = parser.parse_args()
+
+    if args.file:
+        traffic = [("файл", load_updates(args.file))]
+    else:
+        traffic = [(str(chats), make_updates(args.updates, chats, stickers=args.stickers,
+                                             duplicates=args.duplicates))
+                   for chats in map(int, args.chats.split(","))]
+
+    print(f"Хранилище: {args.backend}, одновременных обработчиков: {args.concurrency}, "
+          f"задержка Bot API: {args.latency * 1000:.0f} мс")
+    print(f"{'чатов':>6} {'част':>5} {'интел':>5} {'апд/с':>8} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} "
+          f"{'БД/апд':>7} {'API/апд':>8} {'отбр':>5} {'RSS МиБ':>8}")
+    context = multiprocessing.get_context("spawn")
+    for label, updates in traffic:
+        for frequency, intelligence in parse_profiles(args.profiles):
+            params = {"updates": updates, "frequency": frequency, "intelligence": intelligence,
+                      "concurrency": args.concurrency, "latency": args.latency, "backend": args.backend}
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_scenario, params).result()
+            print(f"{label:>6} {frequency:>5} {intelligence:>5} {result['rate']:>8.0f} {result['p50']:>8.2f} "
+                  f"{result['p95']:>8.2f} {result['p99']:>8.2f} {result['db']:>7.2f} {result['api']:>8.2f} "
+                  f"{result['dropped']:>5} {result['rss']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
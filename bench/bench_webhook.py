@@ -0,0 +1,100 @@
+"""Бенчмарк webhook-режима: апдейты по HTTP на локальный сервер, апдейтов в секунду.
+
+Поднимается WebhookServer с обработчиками бота, временной базой и сессией Bot
+API без сети. Клиент шлёт записанные (--file, JSONL) или синтетические
+апдейты с секретным токеном; замеряется приём по HTTP и полная обработка
+до опустошения очереди.
+
+Запуск из корня репозитория: python -m bench.bench_webhook
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+from aiohttp import ClientSession  # noqa: E402
+
+from bench.fakes import FAKE_TOKEN, FakeSession, load_updates, make_updates  # noqa: E402
+from handlers.group_handlers import group_router  # noqa: E402
+from storage.memory import memory  # noqa: E402
+from utils.pipeline import pipeline  # noqa: E402
+from utils.sender import sender  # noqa: E402
+from utils.webhook import SECRET_HEADER, WebhookServer  # noqa: E402
+
+SECRET = "bench-secret"
+
+
+async def post_all(url: str, bodies, concurrency: int) -> int:
+    """Отправка апдейтов с ограничением числа одновременных запросов; число ответов 200."""
+    semaphore = asyncio.Semaphore(concurrency)
+    accepted = 0
+    async with ClientSession() as client:
+        async def post(body: bytes):
+            nonlocal accepted
+            async with semaphore:
+                async with client.post(url, data=body, headers={SECRET_HEADER: SECRET,
+                                                                "Content-Type": "application/json"}) as response:
+                    if response.status == 200:
+                        accepted += 1
+
+        async with client.post(url, data=b"{}", headers={SECRET_HEADER: "wrong"}) as response:
+            print(f"Запрос с неверным секретом: HTTP {response.status}")
+        await asyncio.gather(*(post(body) for body in bodies))
+    return accepted
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--file", help="JSONL с записанными апдейтами вместо синтетических")
+    parser.add_argument("--updates", type=int, default=5000, help="число синтетических апдейтов")
+    parser.add_argument("--chats", type=int, default=100, help="число чатов в синтетических апдейтах")
+    parser.add_argument("--concurrency", type=int, default=64, help="одновременных HTTP-запросов клиента")
+    parser.add_argument("--workers", type=int, default=32, help="обработчиков апдейтов на сервере")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушки Bot API (сек)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)  # Отброшенные под нагрузкой этапы считаются ниже
+
+    updates = load_updates(args.file) if args.file else make_updates(args.updates, args.chats)
+    bodies = [json.dumps(update).encode("utf-8") for update in updates]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        memory.db_path = os.path.join(tmp, "bench.db")
+        await memory.init_db()
+        sender.start()
+        session = FakeSession(args.latency)
+        bot = Bot(token=FAKE_TOKEN, session=session)
+        dp = Dispatcher(storage=MemoryStorage())
+        dp.include_router(group_router)
+        server = WebhookServer(dp, bot, "/webhook", SECRET, args.workers, 1000)
+        await server.start("127.0.0.1", 0)
+
+        started = time.perf_counter()
+        accepted = await post_all(f"http://127.0.0.1:{server.port}/webhook", bodies, args.concurrency)
+        received = time.perf_counter() - started
+        await server.queue.join()
+        processed = time.perf_counter() - started
+
+        await server.stop()
+        await pipeline.drain()
+        await sender.stop()
+        await memory.flush()
+        stored = sum(memory.message_counts.values())
+        await memory.close_db()
+
+    print(f"Апдейтов: {len(bodies)}, принято: {accepted}, сохранено сообщений: {stored}")
+    print(f"Приём по HTTP:     {received:6.2f} с, {len(bodies) / received:8.0f} апдейтов/с")
+    print(f"Полная обработка:  {processed:6.2f} с, {len(bodies) / processed:8.0f} апдейтов/с")
+    print(f"Отброшено фоновых этапов: {pipeline.dropped}, устаревших отправок: {sender.dropped}")
+    print(f"Вызовы Bot API: {dict(session.calls)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
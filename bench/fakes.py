@@ -0,0 +1,98 @@
+"""Заглушки для бенчмарков: сессия Bot API без сети и синтетические апдейты.
+
+Апдейты повторяют по форме JSON, который Telegram присылает для сообщений в
+супергруппах, так что их можно подменить записанными настоящими (JSONL).
+"""
+import asyncio
+import itertools
+import json
+import random
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetChat, GetChatAdministrators, SendMessage, SendSticker
+from aiogram.types import Chat, ChatFullInfo, Message
+
+FAKE_TOKEN = "123456789:" + "A" * 35
+WORDS = ("уголь", "кот", "печка", "дым", "искра", "зола", "жар", "тепло", "ночь", "снег",
+         "hello", "world", "fire", "coal", "smoke", "cat", "warm", "night", "snow", "spark")
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot API без сети: отвечает заглушками и считает вызовы по методам."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None) -> Any:
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = getattr(method, "chat_id", 0)
+        if isinstance(method, GetChat):
+            # Без валидации: обязательные поля ChatFullInfo меняются от версии к версии Bot API
+            return ChatFullInfo.model_construct(id=chat_id, type="supergroup", available_reactions=None)
+        if isinstance(method, GetChatAdministrators):
+            return []
+        if isinstance(method, (SendMessage, SendSticker)):
+            return Message.model_construct(message_id=next(self.message_ids), date=datetime.now(),
+                                           chat=Chat(id=chat_id, type="supergroup"),
+                                           text=getattr(method, "text", None))
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url: str, headers=None, timeout: int = 30, chunk_size: int = 65536,
+                             raise_for_status: bool = True):
+        """Пустой поток: в сценариях бот файлов не скачивает, вызов только учитывается."""
+        self.calls["stream_content"] += 1
+        for chunk in ():
+            yield chunk
+
+
+def make_updates(count: int, chats: int, seed: int = 1, stickers: float = 0.0,
+                 duplicates: float = 0.0) -> List[Dict[str, Any]]:
+    """Синтетические апдейты, равномерно по чатам.
+
+    Доля stickers приходится на стикеры из небольшого набора, доля duplicates
+    повторяет текст одного из прошлых сообщений того же чата.
+    """
+    rng = random.Random(seed)
+    now = int(datetime.now().timestamp())
+    sent: Dict[int, List[str]] = {}
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = -1_000_000_000_000 - rng.randrange(chats)
+        message = {
+            "message_id": update_id,
+            "date": now,
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"Чат {chat_id}"},
+            "from": {"id": 1000 + rng.randrange(500), "is_bot": False, "first_name": "Тест"},
+        }
+        roll = rng.random()
+        history = sent.setdefault(chat_id, [])
+        if roll < stickers:
+            sticker = rng.randrange(20)
+            message["sticker"] = {"file_id": f"sticker-{sticker}", "file_unique_id": f"unique-{sticker}",
+                                  "type": "regular", "width": 512, "height": 512,
+                                  "is_animated": False, "is_video": False}
+        elif roll < stickers + duplicates and history:
+            message["text"] = rng.choice(history)
+        else:
+            text = ". ".join(" ".join(rng.choices(WORDS, k=rng.randint(3, 8))) for _ in range(rng.randint(1, 3)))
+            message["text"] = f"{text} {update_id}"
+            history.append(message["text"])
+        updates.append({"update_id": update_id, "message": message})
+    return updates
+
+
+def load_updates(path: str) -> List[Dict[str, Any]]:
+    """Записанные апдейты: по одному JSON-объекту на строку."""
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
@@ -1,3 +1,90 @@
 # Конфигурационные данные
 BOT_TOKEN = "тут мой токен"  # Замените на токен от BotFather
 MAX_MESSAGES_PER_CHAT = 1000  # Максимум сообщений для хранения в чате
+EVICTION_BATCH_RATIO = 0.05  # Доля лимита, освобождаемая за один проход вытеснения
+
+# Пакетная запись входящих сообщений
+INGEST_BATCH_SIZE = 200  # Максимум сообщений в одной транзакции записи
+INGEST_FLUSH_INTERVAL = 0.5  # Максимальное ожидание набора пачки (сек)
+INGEST_QUEUE_SIZE = 10000  # Ёмкость очереди сообщений на запись
+
+# Параметры SQLite
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # Размер отображения файла базы в память (байт)
+SQLITE_CACHE_SIZE = -64000  # Кэш страниц (отрицательное значение — в КиБ)
+
+# Кэш корпусов чатов (id сообщений, предложения и слова) для выборки и генерации
+CORPUS_CACHE_MAX_CHATS = 2000  # Сколько чатов держать в памяти
+
+# Генерация ответов цепями Маркова (интеллект 80–99)
+MARKOV_MAX_WORDS = 30  # Максимальная длина сгенерированной фразы в словах
+
+# Отсечение дубликатов сообщений по 64-битным хэшам
+DEDUP_CACHE_MAX_CHATS = 10000  # Сколько чатов держать с хэшами в памяти (8 байт на сообщение)
+
+# Кэши обращений к Bot API
+ADMIN_CACHE_TTL = 300  # Время жизни списка администраторов чата (сек)
+ADMIN_CACHE_MAX_CHATS = 10000  # Сколько чатов держать со списком администраторов
+REACTIONS_CACHE_TTL = 3600  # Время жизни списка доступных реакций чата (сек)
+REACTIONS_NEGATIVE_TTL = 600  # Время жизни пустого результата: реакции выключены или чат не группа (сек)
+REACTIONS_CACHE_MAX_CHATS = 10000  # Сколько чатов держать со списком реакций, включая пустые
+
+# Сеансы меню /settings
+SETTINGS_SESSION_TTL = 300  # Через сколько секунд без действий меню настроек освобождается (сек)
+SETTINGS_SESSION_MAX = 10000  # Сколько меню может быть открыто одновременно, сверх этого закрываются старейшие
+
+# Планировщик исходящих запросов к Bot API
+SEND_GLOBAL_RATE = 30  # Запросов в секунду на всего бота
+SEND_CHAT_RATE = 20 / 60  # Запросов в секунду в одну группу (20 в минуту)
+SEND_CHAT_BURST = 3  # Запас запросов в чат, который можно отправить подряд
+SEND_MAX_AGE = 30  # Через сколько секунд неотправленные реакции и ответы устаревают
+
+# Фоновые этапы обработки сообщений (реакция и ответ)
+PIPELINE_CONCURRENCY = 64  # Сколько этапов выполняется одновременно
+PIPELINE_MAX_PENDING = 1000  # Сколько этапов может ждать в пуле, сверх этого новые отбрасываются
+
+# Режим получения апдейтов: long polling или webhook
+USE_WEBHOOK = False  # True — принимать апдейты через webhook вместо polling
+WEBHOOK_URL = ""  # Публичный адрес webhook для setWebhook; пусто — webhook уже настроен снаружи
+WEBHOOK_HOST = "127.0.0.1"  # Адрес локального сервера (за обратным прокси)
+WEBHOOK_PORT = 8080  # Порт локального сервера
+WEBHOOK_PATH = "/webhook"  # Путь, на который Telegram присылает апдейты
+WEBHOOK_SECRET = ""  # Секретный токен из заголовка X-Telegram-Bot-Api-Secret-Token; пусто — без проверки
+WEBHOOK_WORKERS = 32  # Сколько апдейтов обрабатывается одновременно
+WEBHOOK_QUEUE_SIZE = 1000  # Ёмкость очереди принятых, но не обработанных апдейтов
+
+# Шардирование чатов по процессам
+SHARDS = 1  # Число процессов-обработчиков; 1 — всё в одном процессе, как раньше
+SHARD_DB_PATTERN = "uglyok.{count}.{index}.db"  # База каждого процесса-обработчика
+SHARD_LANES = 16  # Очередей внутри обработчика; чат всегда попадает в одну, порядок сохраняется
+SHARD_QUEUE_SIZE = 10000  # Ёмкость очереди апдейтов каждого обработчика
+
+# Хранилище данных бота
+STORAGE_BACKEND = "sqlite"  # "sqlite" — база SQLite, "memory" — всё в памяти со снимками на диск
+SNAPSHOT_PATH = "uglyok.snapshot"  # Файл снимка хранилища в памяти
+SNAPSHOT_INTERVAL = 300  # Как часто сохранять снимок, если данные менялись (сек)
+
+# Метрики в формате Prometheus
+METRICS_ENABLED = False  # True — отдавать метрики на локальном HTTP-эндпоинте /metrics
+METRICS_HOST = "127.0.0.1"  # Адрес эндпоинта метрик
+METRICS_PORT = 9100  # Порт эндпоинта; обработчики шардов слушают METRICS_PORT + 1 + номер
+METRICS_LOOP_LAG_INTERVAL = 0.5  # Период замера задержки цикла событий (сек)
+
+# Профилирование запросов к SQLite
+SQL_PROFILE_ENABLED = False  # True — статистика по запросам и лог медленных с планом выполнения
+SQL_SLOW_THRESHOLD = 0.05  # Запрос дольше этого (сек) считается медленным
+SQL_PROFILE_TOP = 20  # Сколько запросов выводить в топе (при остановке и по SIGUSR1)
+
+# Логирование
+LOG_LEVEL = "DEBUG"  # Уровень корневого логгера: DEBUG, INFO, WARNING, ERROR
+LOG_FORMAT = "%(levelname)s:%(name)s:%(message)s"  # Формат строк лога
+LOG_QUEUE_SIZE = 10000  # Ёмкость очереди записей к потоку вывода; при переполнении записи отбрасываются
+LOG_DEBUG_RATE = 50  # DEBUG-записей в секунду на логгер, остальные отбрасываются; 0 — без ограничения
+LOG_DEBUG_BURST = 200  # Сколько DEBUG-записей логгер может выдать разом сверх средней частоты
+
+# Резервные копии и выгрузка чатов
+BACKUP_DIR = "backups"  # Каталог резервных копий базы
+BACKUP_INTERVAL = 0  # Период онлайн-копирования базы работающим ботом (сек); 0 — выключено
+BACKUP_KEEP = 3  # Сколько последних копий каждой базы хранить
+BACKUP_PAGES = 256  # Страниц базы, копируемых за один шаг
+BACKUP_STEP_SLEEP = 0.005  # Пауза между шагами копирования (сек)
+EXPORT_BATCH_SIZE = 1000  # Сообщений, читаемых из хранилища за раз при выгрузке чата
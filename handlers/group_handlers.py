@@ -1,10 +1,15 @@
 from aiogram import Router, Bot, types
-from aiogram.filters import Command, ChatMemberUpdatedFilter, IS_MEMBER, IS_NOT_MEMBER
+from aiogram.filters import Command, ChatMemberUpdatedFilter, StateFilter, IS_MEMBER, IS_NOT_MEMBER
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReactionTypeEmoji
 from aiogram.fsm.context import FSMContext
-from storage.memory import BotMemory  # Импортируем глобальный memory
-from utils.helpers import is_admin, get_available_reactions
+from storage.memory import memory  # Импортируем глобальный memory
+from utils.helpers import admin_cache, reactions_cache, is_admin, get_available_reactions
+from utils.pipeline import pipeline
+from utils.sender import sender, PRIORITY_COMMAND
+from utils.settings_sessions import settings_sessions
 from utils.text_modifier import TextModifier
+from functools import partial
+from typing import Optional
 from states.settings_states import SettingsState
 import random
 import logging
@@ -12,14 +17,14 @@ import logging
 group_router = Router()
 logger = logging.getLogger(__name__)
 
-chat_reactions_cache = {}
-active_settings_user = {}
+text_modifier = TextModifier(memory)  # Один экземпляр: корпус чатов кэшируется между апдейтами
 
 MESSAGES = {
     "ru": {
         "start": "Привет всем, меня Углём звать. Настройте язык, позязя :)",
         "only_admins": "Только администраторы могут настраивать меня!",
         "settings_in_use": "Настройки уже использует другой пользователь!",
+        "settings_expired": "Меню настроек закрыто, вызовите /settings заново.",
         "intel_prompt": "Ответьте числом от 0 до 100 на это сообщение для уровня интеллекта:",
         "freq_prompt": "Ответьте числом от 0 до 100 на это сообщение для частоты ответа:",
         "invalid_range": "Значение должно быть от 0 до 100!",
@@ -39,6 +44,7 @@ MESSAGES = {
         "start": "Привіт усім, мене Вуглем звати. Налаштуйте мову, будь ласка :)",
         "only_admins": "Тільки адміністратори можуть мене налаштовувати!",
         "settings_in_use": "Налаштування вже використовує інший користувач!",
+        "settings_expired": "Меню налаштувань закрито, викличте /settings знову.",
         "intel_prompt": "Відповідьте числом (0-100) на це повідомлення для рівня інтелекту:",
         "freq_prompt": "Відповідьте числом (0-100) на це повідомлення для частоти відповіді:",
         "invalid_range": "Значення має бути від 0 до 100!",
@@ -58,6 +64,7 @@ MESSAGES = {
         "start": "Hello everyone, I'm called Uglyok. Please set the language :)",
         "only_admins": "Only administrators can configure me!",
         "settings_in_use": "Settings are already in use by another user!",
+        "settings_expired": "The settings menu has expired, call /settings again.",
         "intel_prompt": "Reply with a number (0-100) to this message for intelligence level:",
         "freq_prompt": "Reply with a number (0-100) to this message for response frequency:",
         "invalid_range": "Value must be between 0 and 100!",
@@ -85,102 +92,111 @@ def translate_button(button: str, value: int, lang: str) -> str:
         return f"Custom ({value})" if lang == "en" else f"Кастом ({value})" if lang == "uk" else f"Кастом ({value})"
     return button
 
+async def reply(message: types.Message, text: str, **kwargs):
+    """Ответ на команду через планировщик отправки, впереди болтовни."""
+    return await sender.call(message.chat.id, partial(message.reply, text, **kwargs), PRIORITY_COMMAND)
+
+async def edit_text(message: types.Message, text: str, **kwargs):
+    """Правка сообщения бота через планировщик отправки, впереди болтовни."""
+    return await sender.call(message.chat.id, partial(message.edit_text, text, **kwargs), PRIORITY_COMMAND)
+
 @group_router.chat_member(ChatMemberUpdatedFilter(IS_NOT_MEMBER >> IS_MEMBER))
 async def bot_added_to_group(event: types.ChatMemberUpdated, bot: Bot):
     if event.new_chat_member.user.id == event.bot.id:
         chat_id = event.chat.id
         chat_title = event.chat.title or "Unnamed Chat"
         try:
-            await BotMemory.add_chat(chat_id, chat_title)
-            logger.info(f"Бот добавлен в чат {chat_id} с названием {chat_title}")
-            if chat_id in chat_reactions_cache:
-                del chat_reactions_cache[chat_id]
+            await memory.add_chat(chat_id, chat_title)
+            logger.info("Бот добавлен в чат %s с названием %s", chat_id, chat_title)
+            reactions_cache.invalidate(chat_id)
         except Exception as e:
-            logger.error(f"Ошибка при добавлении чата {chat_id}: {e}")
-
-@group_router.message(~Command(commands=["start", "settings", "help", "forget_me"]))
-async def handle_group_message(message: types.Message, bot: Bot, state: FSMContext):
-    chat_id = message.chat.id
-    message_id = message.message_id
-    text_modifier = TextModifier(BotMemory)
-    logger.debug(f"Получено сообщение в чате {chat_id}, ID: {message_id}")
-
-    # Регистрируем чат, если его нет
-    try:
-        cursor = await BotMemory.db.execute("SELECT COUNT(*) FROM chats WHERE chat_id = ?", (chat_id,))
-        count = (await cursor.fetchone())[0]
-        if count == 0:
-            chat_title = message.chat.title or "Unnamed Chat"
-            await BotMemory.add_chat(chat_id, chat_title)
-            logger.info(f"Чат {chat_id} зарегистрирован: {chat_title}")
-    except Exception as e:
-        logger.error(f"Ошибка при проверке/регистрации чата {chat_id}: {e}")
-        return
-
-    # Сохраняем сообщение
+            logger.error("Ошибка при добавлении чата %s: %s", chat_id, e)
+    admin_cache.invalidate(event.chat.id)
+
+@group_router.chat_member()
+async def chat_member_updated(event: types.ChatMemberUpdated):
+    # Любое изменение участника может означать назначение или снятие администратора
+    admin_cache.invalidate(event.chat.id)
+
+@group_router.my_chat_member()
+async def bot_status_updated(event: types.ChatMemberUpdated):
+    # Права бота в чате изменились: реакции и администраторов перечитаем при следующем обращении
+    reactions_cache.invalidate(event.chat.id)
+    admin_cache.invalidate(event.chat.id)
+
+async def learn(chat_id: int, message: types.Message):
+    """Этап обучения: сообщение ставится в очередь записи."""
     content = message.text if message.text else message.sticker.file_id if message.sticker else None
     msg_type = "text" if message.text else "sticker" if message.sticker else None
     if content and msg_type:
         try:
-            if not await BotMemory.message_exists(chat_id, msg_type, content):
-                await BotMemory.add_message(chat_id, msg_type, content)
-                logger.debug(f"Сохранено сообщение типа {msg_type}: {content}")
-            else:
-                logger.debug(f"Сообщение типа {msg_type} '{content}' уже существует, пропускаем")
+            # Дубликаты отсекаются по хэшам содержимого до записи
+            await memory.enqueue_message(chat_id, msg_type, content)
+            logger.debug("Сообщение типа %s поставлено в очередь на запись: %s", msg_type, content)
         except Exception as e:
-            logger.error(f"Ошибка при сохранении сообщения в чате {chat_id}: {e}")
-
-    # Получаем настройки
-    frequency = await BotMemory.get_response_frequency(chat_id)
-    intelligence = await BotMemory.get_intelligence(chat_id)
-    lang = await BotMemory.get_language(chat_id)
-    logger.debug(f"Частота ответа для чата {chat_id}: {frequency}%, интеллект: {intelligence}")
+            logger.error("Ошибка при сохранении сообщения в чате %s: %s", chat_id, e)
 
-    # Устанавливаем реакцию
-    available_reactions = await get_available_reactions(bot, chat_id, chat_reactions_cache)
+async def react(bot: Bot, chat_id: int, message_id: int, frequency: int):
+    """Этап реакции: случайная доступная реакция на сообщение."""
+    available_reactions = await get_available_reactions(bot, chat_id)
     if available_reactions and random.randint(0, 100) <= frequency:
         reaction = random.choice(available_reactions)
+        sender.submit(chat_id, partial(
+            bot.set_message_reaction,
+            chat_id=chat_id,
+            message_id=message_id,
+            reaction=[ReactionTypeEmoji(emoji=reaction)],
+            is_big=False
+        ))
+        logger.debug("Реакция %s на сообщение %s в чате %s поставлена в очередь", reaction, message_id, chat_id)
+
+async def reply_randomly(bot: Bot, chat_id: int, intelligence: int, lang: str):
+    """Этап ответа: случайное сообщение из памяти чата с учетом интеллекта."""
+    msg_type, random_message = await memory.get_random_message(chat_id)
+    if random_message:
         try:
-            await bot.set_message_reaction(
-                chat_id=chat_id,
-                message_id=message_id,
-                reaction=[ReactionTypeEmoji(emoji=reaction)],
-                is_big=False
-            )
-            logger.debug(f"Установлена реакция {reaction} на сообщение {message_id} в чате {chat_id}")
+            if msg_type == "text":
+                modified_message = await text_modifier.modify_text(chat_id, random_message, intelligence)
+                sender.submit(chat_id, partial(bot.send_message, chat_id=chat_id, text=modified_message))
+                logger.debug("Модифицированный текст '%s' в чате %s поставлен в очередь", modified_message, chat_id)
+            elif msg_type == "sticker":
+                sender.submit(chat_id, partial(bot.send_sticker, chat_id=chat_id, sticker=random_message))
+                logger.debug("Стикер '%s' в чате %s поставлен в очередь", random_message, chat_id)
         except Exception as e:
-            logger.error(f"Ошибка при установке реакции {reaction} в чате {chat_id}: {e}")
-
-    # Отправляем случайное сообщение с учетом интеллекта
-    if random.randint(0, 100) <= frequency:
-        msg_type, random_message = await BotMemory.get_random_message(chat_id)
-        if random_message:
-            try:
-                if msg_type == "text":
-                    modified_message = await text_modifier.modify_text(chat_id, random_message, intelligence)
-                    await bot.send_message(chat_id=chat_id, text=modified_message)
-                    logger.debug(f"Отправлен модифицированный текст '{modified_message}' в чате {chat_id}")
-                elif msg_type == "sticker":
-                    await bot.send_sticker(chat_id=chat_id, sticker=random_message)
-                    logger.debug(f"Отправлен стикер '{random_message}' в чате {chat_id}")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке ответа в чате {chat_id}: {e}")
-        else:
-            try:
-                await bot.send_message(chat_id=chat_id, text=MESSAGES[lang]["no_messages"])
-                logger.debug(f"Нет сохраненных сообщений для чата {chat_id}, отправлено стандартное сообщение")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке 'no_messages' в чате {chat_id}: {e}")
+            logger.error("Ошибка при отправке ответа в чате %s: %s", chat_id, e)
+    else:
+        sender.submit(chat_id, partial(bot.send_message, chat_id=chat_id, text=MESSAGES[lang]["no_messages"]))
+        logger.debug("Нет сохраненных сообщений для чата %s, стандартное сообщение поставлено в очередь", chat_id)
+
+async def handle_group_message(message: types.Message, bot: Bot, state: FSMContext):
+    chat_id = message.chat.id
+    message_id = message.message_id
+    logger.debug("Получено сообщение в чате %s, ID: %s", chat_id, message_id)
+
+    # Регистрируем чат, если его нет; известный чат обходится без запросов к базе
+    settings = await memory.ensure_chat(chat_id, message.chat.title or "Unnamed Chat")
+    if settings is None:
+        return
+    logger.debug("Частота ответа для чата %s: %s%%, интеллект: %s", chat_id, settings.frequency, settings.intelligence)
+
+    # Обучение — только постановка в очередь записи, поэтому идёт сразу:
+    # заполненная очередь должна притормаживать приём апдейтов.
+    await learn(chat_id, message)
+
+    # Реакция и ответ ходят в Bot API и базу, их выполняет пул в фоне
+    pipeline.spawn(react(bot, chat_id, message_id, settings.frequency), "react")
+    if random.randint(0, 100) <= settings.frequency:
+        pipeline.spawn(reply_randomly(bot, chat_id, settings.intelligence, settings.language), "reply")
 
 @group_router.message(Command("start"))
 async def start_command(message: types.Message, bot: Bot):
     chat_id = message.chat.id
     user_id = message.from_user.id
-    lang = await BotMemory.get_language(chat_id)
-    logger.info(f"Команда /start в чате {chat_id} от пользователя {user_id}")
+    lang = await memory.get_language(chat_id)
+    logger.info("Команда /start в чате %s от пользователя %s", chat_id, user_id)
 
     if not await is_admin(bot, chat_id, user_id):
-        await message.reply(MESSAGES[lang]["only_admins"])
+        await reply(message, MESSAGES[lang]["only_admins"])
         return
 
     buttons = [
@@ -189,7 +205,7 @@ async def start_command(message: types.Message, bot: Bot):
         [InlineKeyboardButton(text="English 🇺🇸", callback_data=f"lang_{chat_id}_en")]
     ]
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await message.reply(MESSAGES[lang]["start"], reply_markup=keyboard)
+    await reply(message, MESSAGES[lang]["start"], reply_markup=keyboard)
 
 @group_router.callback_query(lambda c: c.data.startswith("lang_"))
 async def process_language_selection(callback: types.CallbackQuery, bot: Bot):
@@ -203,37 +219,44 @@ async def process_language_selection(callback: types.CallbackQuery, bot: Bot):
         return
 
     try:
-        if await BotMemory.set_language(chat_id, lang):
-            await callback.message.edit_text(
+        if await memory.set_language(chat_id, lang):
+            await edit_text(
+                callback.message,
                 f"Language set to {lang}!" if lang == "en" else
                 f"Мова встановлена на {lang}!" if lang == "uk" else
                 f"Язык установлен на {lang}!"
             )
         else:
-            await callback.message.edit_text("Error setting language!")
+            await edit_text(callback.message, "Error setting language!")
     except Exception as e:
-        logger.error(f"Ошибка при установке языка в чате {chat_id}: {e}")
-        await callback.message.edit_text("Error setting language!")
+        logger.error("Ошибка при установке языка в чате %s: %s", chat_id, e)
+        await edit_text(callback.message, "Error setting language!")
     await callback.answer()
 
+async def settings_refusal(chat_id: int, user_id: int, lang: str, state: Optional[FSMContext] = None) -> Optional[str]:
+    """None, если меню настроек чата открыто этим пользователем (оно продлевается), иначе текст отказа."""
+    owner = await settings_sessions.touch(chat_id, user_id, state)
+    if owner == user_id:
+        return None
+    return MESSAGES[lang]["settings_in_use" if owner is not None else "settings_expired"]
+
 @group_router.message(Command("settings"))
-async def settings_command(message: types.Message, bot: Bot):
+async def settings_command(message: types.Message, bot: Bot, state: FSMContext):
     chat_id = message.chat.id
     user_id = message.from_user.id
-    lang = await BotMemory.get_language(chat_id)
-    logger.info(f"Команда /settings в чате {chat_id} от пользователя {user_id}")
+    lang = await memory.get_language(chat_id)
+    logger.info("Команда /settings в чате %s от пользователя %s", chat_id, user_id)
 
     if not await is_admin(bot, chat_id, user_id):
-        await message.reply(MESSAGES[lang]["only_admins"])
+        await reply(message, MESSAGES[lang]["only_admins"])
         return
 
-    if chat_id in active_settings_user and active_settings_user[chat_id] != user_id:
-        await message.reply(MESSAGES[lang]["settings_in_use"])
+    if not await settings_sessions.acquire(chat_id, user_id, state):
+        await reply(message, MESSAGES[lang]["settings_in_use"])
         return
 
-    active_settings_user[chat_id] = user_id
-    intelligence = await BotMemory.get_intelligence(chat_id)
-    frequency = await BotMemory.get_response_frequency(chat_id)
+    intelligence = await memory.get_intelligence(chat_id)
+    frequency = await memory.get_response_frequency(chat_id)
 
     buttons = [
         [InlineKeyboardButton(
@@ -246,19 +269,20 @@ async def settings_command(message: types.Message, bot: Bot):
         )]
     ]
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await message.reply("Settings:", reply_markup=keyboard)
+    await reply(message, "Settings:", reply_markup=keyboard)
 
 @group_router.callback_query(lambda c: c.data.startswith("set_intel_menu_"))
 async def intel_menu(callback: types.CallbackQuery, bot: Bot):
     chat_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
-    lang = await BotMemory.get_language(chat_id)
+    lang = await memory.get_language(chat_id)
 
-    if chat_id not in active_settings_user or active_settings_user[chat_id] != user_id:
-        await callback.answer(MESSAGES[lang]["settings_in_use"], show_alert=True)
+    refusal = await settings_refusal(chat_id, user_id, lang)
+    if refusal:
+        await callback.answer(refusal, show_alert=True)
         return
 
-    intelligence = await BotMemory.get_intelligence(chat_id)
+    intelligence = await memory.get_intelligence(chat_id)
     buttons = [
         [InlineKeyboardButton(text="0", callback_data=f"set_intel_{chat_id}_0"),
          InlineKeyboardButton(text="50", callback_data=f"set_intel_{chat_id}_50"),
@@ -267,7 +291,7 @@ async def intel_menu(callback: types.CallbackQuery, bot: Bot):
         [InlineKeyboardButton(text=MESSAGES[lang]["back"], callback_data=f"back_to_settings_{chat_id}")]
     ]
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await callback.message.edit_text(translate_button("intel", intelligence, lang), reply_markup=keyboard)
+    await edit_text(callback.message, translate_button("intel", intelligence, lang), reply_markup=keyboard)
     await callback.answer()
 
 @group_router.callback_query(lambda c: c.data.startswith("set_intel_"))
@@ -276,46 +300,51 @@ async def process_intelligence_selection(callback: types.CallbackQuery, bot: Bot
     chat_id = int(parts[2])
     level = int(parts[3])
     user_id = callback.from_user.id
-    lang = await BotMemory.get_language(chat_id)
+    lang = await memory.get_language(chat_id)
 
-    if chat_id not in active_settings_user or active_settings_user[chat_id] != user_id:
-        await callback.answer(MESSAGES[lang]["settings_in_use"], show_alert=True)
+    refusal = await settings_refusal(chat_id, user_id, lang)
+    if refusal:
+        await callback.answer(refusal, show_alert=True)
         return
 
     try:
-        if await BotMemory.set_intelligence(chat_id, level):
-            await callback.message.edit_text(f"{translate_button('intel', level, lang)} set!")
+        if await memory.set_intelligence(chat_id, level):
+            await edit_text(callback.message, f"{translate_button('intel', level, lang)} set!")
+            await settings_sessions.release(chat_id)
         else:
-            await callback.message.edit_text("Error setting intelligence!")
+            await edit_text(callback.message, "Error setting intelligence!")
     except Exception as e:
-        logger.error(f"Ошибка при установке интеллекта в чате {chat_id}: {e}")
-        await callback.message.edit_text("Error setting intelligence!")
+        logger.error("Ошибка при установке интеллекта в чате %s: %s", chat_id, e)
+        await edit_text(callback.message, "Error setting intelligence!")
     await callback.answer()
 
 @group_router.callback_query(lambda c: c.data.startswith("custom_intel_"))
 async def process_custom_intelligence(callback: types.CallbackQuery, bot: Bot, state: FSMContext):
     chat_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
-    lang = await BotMemory.get_language(chat_id)
+    lang = await memory.get_language(chat_id)
 
-    if chat_id not in active_settings_user or active_settings_user[chat_id] != user_id:
-        await callback.answer(MESSAGES[lang]["settings_in_use"], show_alert=True)
+    refusal = await settings_refusal(chat_id, user_id, lang, state)
+    if refusal:
+        await callback.answer(refusal, show_alert=True)
         return
 
     await state.set_state(SettingsState.CustomIntel)
     await state.update_data(chat_id=chat_id, user_id=user_id, message_id=callback.message.message_id)
-    await callback.message.edit_text(MESSAGES[lang]["intel_prompt"])
+    await edit_text(callback.message, MESSAGES[lang]["intel_prompt"])
     await callback.answer()
 
-@group_router.message(SettingsState.CustomIntel, lambda m: m.text and m.text.isdigit() and m.reply_to_message)
+@group_router.message(StateFilter(SettingsState.CustomIntel), lambda m: m.text and m.text.isdigit() and m.reply_to_message)
 async def set_custom_intelligence(message: types.Message, bot: Bot, state: FSMContext):
     chat_id = message.chat.id
     user_id = message.from_user.id
-    lang = await BotMemory.get_language(chat_id)
+    lang = await memory.get_language(chat_id)
     data = await state.get_data()
 
-    if chat_id not in active_settings_user or active_settings_user[chat_id] != user_id:
-        await message.reply(MESSAGES[lang]["settings_in_use"])
+    refusal = await settings_refusal(chat_id, user_id, lang)
+    if refusal:
+        await state.clear()  # Ожидание ввода осталось от уже закрытого меню
+        await reply(message, refusal)
         return
 
     if "message_id" not in data or message.reply_to_message.message_id != data["message_id"]:
@@ -324,28 +353,27 @@ async def set_custom_intelligence(message: types.Message, bot: Bot, state: FSMCo
     level = int(message.text)
     if 0 <= level <= 100:
         try:
-            await BotMemory.set_intelligence(chat_id, level)
-            await message.reply(f"{translate_button('intel', level, lang)} set!")
-            await state.clear()
-            if chat_id in active_settings_user:
-                del active_settings_user[chat_id]
+            await memory.set_intelligence(chat_id, level)
+            await reply(message, f"{translate_button('intel', level, lang)} set!")
+            await settings_sessions.release(chat_id)  # Сбрасывает и ожидание ввода
         except Exception as e:
-            logger.error(f"Ошибка при установке интеллекта в чате {chat_id}: {e}")
-            await message.reply("Error setting intelligence!")
+            logger.error("Ошибка при установке интеллекта в чате %s: %s", chat_id, e)
+            await reply(message, "Error setting intelligence!")
     else:
-        await message.reply(MESSAGES[lang]["invalid_range"])
+        await reply(message, MESSAGES[lang]["invalid_range"])
 
 @group_router.callback_query(lambda c: c.data.startswith("set_freq_menu_"))
 async def freq_menu(callback: types.CallbackQuery, bot: Bot):
     chat_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
-    lang = await BotMemory.get_language(chat_id)
+    lang = await memory.get_language(chat_id)
 
-    if chat_id not in active_settings_user or active_settings_user[chat_id] != user_id:
-        await callback.answer(MESSAGES[lang]["settings_in_use"], show_alert=True)
+    refusal = await settings_refusal(chat_id, user_id, lang)
+    if refusal:
+        await callback.answer(refusal, show_alert=True)
         return
 
-    frequency = await BotMemory.get_response_frequency(chat_id)
+    frequency = await memory.get_response_frequency(chat_id)
     buttons = [
         [InlineKeyboardButton(text="0%", callback_data=f"set_freq_{chat_id}_0"),
          InlineKeyboardButton(text="50%", callback_data=f"set_freq_{chat_id}_50"),
@@ -354,7 +382,7 @@ async def freq_menu(callback: types.CallbackQuery, bot: Bot):
         [InlineKeyboardButton(text=MESSAGES[lang]["back"], callback_data=f"back_to_settings_{chat_id}")]
     ]
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await callback.message.edit_text(translate_button("freq", frequency, lang), reply_markup=keyboard)
+    await edit_text(callback.message, translate_button("freq", frequency, lang), reply_markup=keyboard)
     await callback.answer()
 
 @group_router.callback_query(lambda c: c.data.startswith("set_freq_"))
@@ -363,46 +391,51 @@ async def process_frequency_selection(callback: types.CallbackQuery, bot: Bot):
     chat_id = int(parts[2])
     freq = int(parts[3])
     user_id = callback.from_user.id
-    lang = await BotMemory.get_language(chat_id)
+    lang = await memory.get_language(chat_id)
 
-    if chat_id not in active_settings_user or active_settings_user[chat_id] != user_id:
-        await callback.answer(MESSAGES[lang]["settings_in_use"], show_alert=True)
+    refusal = await settings_refusal(chat_id, user_id, lang)
+    if refusal:
+        await callback.answer(refusal, show_alert=True)
         return
 
     try:
-        if await BotMemory.set_response_frequency(chat_id, freq):
-            await callback.message.edit_text(f"{translate_button('freq', freq, lang)} set!")
+        if await memory.set_response_frequency(chat_id, freq):
+            await edit_text(callback.message, f"{translate_button('freq', freq, lang)} set!")
+            await settings_sessions.release(chat_id)
         else:
-            await callback.message.edit_text("Error setting frequency!")
+            await edit_text(callback.message, "Error setting frequency!")
     except Exception as e:
-        logger.error(f"Ошибка при установке частоты в чате {chat_id}: {e}")
-        await callback.message.edit_text("Error setting frequency!")
+        logger.error("Ошибка при установке частоты в чате %s: %s", chat_id, e)
+        await edit_text(callback.message, "Error setting frequency!")
     await callback.answer()
 
 @group_router.callback_query(lambda c: c.data.startswith("custom_freq_"))
 async def process_custom_frequency(callback: types.CallbackQuery, bot: Bot, state: FSMContext):
     chat_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
-    lang = await BotMemory.get_language(chat_id)
+    lang = await memory.get_language(chat_id)
 
-    if chat_id not in active_settings_user or active_settings_user[chat_id] != user_id:
-        await callback.answer(MESSAGES[lang]["settings_in_use"], show_alert=True)
+    refusal = await settings_refusal(chat_id, user_id, lang, state)
+    if refusal:
+        await callback.answer(refusal, show_alert=True)
         return
 
     await state.set_state(SettingsState.CustomFreq)
     await state.update_data(chat_id=chat_id, user_id=user_id, message_id=callback.message.message_id)
-    await callback.message.edit_text(MESSAGES[lang]["freq_prompt"])
+    await edit_text(callback.message, MESSAGES[lang]["freq_prompt"])
     await callback.answer()
 
-@group_router.message(SettingsState.CustomFreq, lambda m: m.text and m.text.isdigit() and m.reply_to_message)
+@group_router.message(StateFilter(SettingsState.CustomFreq), lambda m: m.text and m.text.isdigit() and m.reply_to_message)
 async def set_custom_frequency(message: types.Message, bot: Bot, state: FSMContext):
     chat_id = message.chat.id
     user_id = message.from_user.id
-    lang = await BotMemory.get_language(chat_id)
+    lang = await memory.get_language(chat_id)
     data = await state.get_data()
 
-    if chat_id not in active_settings_user or active_settings_user[chat_id] != user_id:
-        await message.reply(MESSAGES[lang]["settings_in_use"])
+    refusal = await settings_refusal(chat_id, user_id, lang)
+    if refusal:
+        await state.clear()  # Ожидание ввода осталось от уже закрытого меню
+        await reply(message, refusal)
         return
 
     if "message_id" not in data or message.reply_to_message.message_id != data["message_id"]:
@@ -411,29 +444,28 @@ async def set_custom_frequency(message: types.Message, bot: Bot, state: FSMConte
     freq = int(message.text)
     if 0 <= freq <= 100:
         try:
-            await BotMemory.set_response_frequency(chat_id, freq)
-            await message.reply(f"{translate_button('freq', freq, lang)} set!")
-            await state.clear()
-            if chat_id in active_settings_user:
-                del active_settings_user[chat_id]
+            await memory.set_response_frequency(chat_id, freq)
+            await reply(message, f"{translate_button('freq', freq, lang)} set!")
+            await settings_sessions.release(chat_id)  # Сбрасывает и ожидание ввода
         except Exception as e:
-            logger.error(f"Ошибка при установке частоты в чате {chat_id}: {e}")
-            await message.reply("Error setting frequency!")
+            logger.error("Ошибка при установке частоты в чате %s: %s", chat_id, e)
+            await reply(message, "Error setting frequency!")
     else:
-        await message.reply(MESSAGES[lang]["invalid_range"])
+        await reply(message, MESSAGES[lang]["invalid_range"])
 
 @group_router.callback_query(lambda c: c.data.startswith("back_to_settings_"))
 async def back_to_settings(callback: types.CallbackQuery, bot: Bot):
     chat_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
-    lang = await BotMemory.get_language(chat_id)
+    lang = await memory.get_language(chat_id)
 
-    if chat_id not in active_settings_user or active_settings_user[chat_id] != user_id:
-        await callback.answer(MESSAGES[lang]["settings_in_use"], show_alert=True)
+    refusal = await settings_refusal(chat_id, user_id, lang)
+    if refusal:
+        await callback.answer(refusal, show_alert=True)
         return
 
-    intelligence = await BotMemory.get_intelligence(chat_id)
-    frequency = await BotMemory.get_response_frequency(chat_id)
+    intelligence = await memory.get_intelligence(chat_id)
+    frequency = await memory.get_response_frequency(chat_id)
     buttons = [
         [InlineKeyboardButton(
             text=translate_button("intel", intelligence, lang),
@@ -445,25 +477,25 @@ async def back_to_settings(callback: types.CallbackQuery, bot: Bot):
         )]
     ]
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await callback.message.edit_text("Settings:", reply_markup=keyboard)
+    await edit_text(callback.message, "Settings:", reply_markup=keyboard)
     await callback.answer()
 
 @group_router.message(Command("help"))
 async def help_command(message: types.Message, bot: Bot):
     chat_id = message.chat.id
-    lang = await BotMemory.get_language(chat_id)
-    logger.info(f"Команда /help вызвана в чате {chat_id}")
-    await message.reply(MESSAGES[lang]["help"], parse_mode="Markdown")
+    lang = await memory.get_language(chat_id)
+    logger.info("Команда /help вызвана в чате %s", chat_id)
+    await reply(message, MESSAGES[lang]["help"], parse_mode="Markdown")
 
 @group_router.message(Command("forget_me"))
 async def forget_me_command(message: types.Message, bot: Bot):
     chat_id = message.chat.id
     user_id = message.from_user.id
-    lang = await BotMemory.get_language(chat_id)
-    logger.info(f"Команда /forget_me в чате {chat_id} от пользователя {user_id}")
+    lang = await memory.get_language(chat_id)
+    logger.info("Команда /forget_me в чате %s от пользователя %s", chat_id, user_id)
 
     if not await is_admin(bot, chat_id, user_id):
-        await message.reply(MESSAGES[lang]["only_admins"])
+        await reply(message, MESSAGES[lang]["only_admins"])
         return
 
     buttons = [
@@ -473,38 +505,38 @@ async def forget_me_command(message: types.Message, bot: Bot):
                               callback_data=f"forget_cancel_{chat_id}")]
     ]
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await message.reply(MESSAGES[lang]["forget_confirm"], reply_markup=keyboard)
+    await reply(message, MESSAGES[lang]["forget_confirm"], reply_markup=keyboard)
 
 @group_router.callback_query(lambda c: c.data.startswith("forget_confirm_"))
 async def process_forget_confirm(callback: types.CallbackQuery, bot: Bot):
     chat_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
-    text_modifier = TextModifier(BotMemory)
-    lang = await BotMemory.get_language(chat_id)
+    lang = await memory.get_language(chat_id)
 
     if not await is_admin(bot, chat_id, user_id):
         await callback.answer(MESSAGES[lang]["only_admins"], show_alert=True)
         return
 
     try:
-        await BotMemory.clear_chat_data(chat_id)
-        await text_modifier.clear_cache(chat_id)
-        if chat_id in chat_reactions_cache:
-            del chat_reactions_cache[chat_id]
-        if chat_id in active_settings_user:
-            del active_settings_user[chat_id]
-        logger.info(f"Все данные чата {chat_id} удалены пользователем {user_id}")
-        await callback.message.edit_text(MESSAGES[lang]["forget_success"])
+        await memory.clear_chat_data(chat_id)  # Сбрасывает и кэш корпуса чата
+        reactions_cache.invalidate(chat_id)
+        await settings_sessions.release(chat_id)
+        logger.info("Все данные чата %s удалены пользователем %s", chat_id, user_id)
+        await edit_text(callback.message, MESSAGES[lang]["forget_success"])
     except Exception as e:
-        logger.error(f"Ошибка при удалении данных чата {chat_id}: {e}")
-        await callback.message.edit_text(MESSAGES[lang]["forget_error"])
+        logger.error("Ошибка при удалении данных чата %s: %s", chat_id, e)
+        await edit_text(callback.message, MESSAGES[lang]["forget_error"])
     await callback.answer()
 
 @group_router.callback_query(lambda c: c.data.startswith("forget_cancel_"))
 async def process_forget_cancel(callback: types.CallbackQuery, bot: Bot):
     chat_id = int(callback.data.split("_")[-1])
-    lang = await BotMemory.get_language(chat_id)
-    await callback.message.edit_text("Operation cancelled." if lang == "en" else
-                                     "Операцію скасовано." if lang == "uk" else
-                                     "Операция отменена.")
-    await callback.answer()
\ No newline at end of file
+    lang = await memory.get_language(chat_id)
+    await edit_text(callback.message, "Operation cancelled." if lang == "en" else
+                    "Операцію скасовано." if lang == "uk" else
+                    "Операция отменена.")
+    await callback.answer()
+
+# Обычные сообщения — последним: иначе этот обработчик перехватывает ввод чисел в состояниях SettingsState.
+# Фильтры перед ним асинхронные (StateFilter, Command): синхронные aiogram выполняет в потоке на каждое сообщение.
+group_router.message.register(handle_group_message, ~Command(commands=["start", "settings", "help", "forget_me"]))
@@ -1,18 +1,55 @@
 import asyncio
 import logging
+import signal
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
+from config import (BOT_TOKEN, LOG_LEVEL, SHARDS, USE_WEBHOOK, WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+                    WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, METRICS_ENABLED, METRICS_HOST, METRICS_PORT,
+                    SQL_PROFILE_ENABLED)
 from handlers.group_handlers import group_router
-from storage.memory import BotMemory
+from storage.memory import BotMemory, memory
+from utils.logging_setup import setup_logging
+from utils.metrics import ApiMetricsMiddleware, MetricsServer, instrument_router, watch_queues
+from utils.pipeline import pipeline
+from utils.sender import sender
+from utils.sharding import run_sharded
+from utils.webhook import WebhookServer
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
-logging.getLogger("aiosqlite").setLevel(logging.INFO)
 
-memory = BotMemory()  # Глобальная переменная memory
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Приём апдейтов через webhook до сигнала остановки."""
+    server = WebhookServer(dp, bot, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: остаётся KeyboardInterrupt
+    await dp.emit_startup(bot=bot)
+    await server.start(WEBHOOK_HOST, WEBHOOK_PORT)
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+            logger.info("Webhook установлен на %s", WEBHOOK_URL)
+        await stop.wait()
+    finally:
+        await server.stop()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
 
 async def main():
+    if SHARDS > 1:
+        # Этот процесс только принимает апдейты, базы открывают обработчики
+        logger.info("Бот Углёк запускается в %s процессах-обработчиках", SHARDS)
+        await run_sharded(SHARDS, USE_WEBHOOK, logging.getLogger().level)
+        return
+
     bot = Bot(token=BOT_TOKEN)
     storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
@@ -22,11 +59,36 @@ async def main():
         logger.critical("Не удалось инициализировать базу данных. Бот завершает работу.")
         return
 
+    if SQL_PROFILE_ENABLED and isinstance(memory, BotMemory):
+        try:
+            # kill -USR1 <pid> — топ запросов в лог без остановки бота
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, memory.log_sql_profile)
+        except (AttributeError, NotImplementedError):
+            pass  # Windows: SIGUSR1 нет
+    sender.start()
+    metrics = MetricsServer()
+    if METRICS_ENABLED:
+        instrument_router(group_router)
+        bot.session.middleware(ApiMetricsMiddleware())
+        watch_queues(memory, pipeline, sender)
+        await metrics.start(METRICS_HOST, METRICS_PORT)
     logger.info("Бот Углёк запущен!")
     try:
-        await dp.start_polling(bot)
+        if USE_WEBHOOK:
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook()  # getUpdates не работает, пока установлен webhook
+            # chat_member не приходит без явного запроса в allowed_updates
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
-        await memory.close_db()
+        await pipeline.drain()  # Доделываем начатые реакции и ответы до остановки отправки
+        await sender.stop()
+        await memory.close_db()  # Сбрасывает очередь сообщений или снимок на диск
+        await metrics.stop()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    logs = setup_logging(LOG_LEVEL)  # Форматирование и вывод лога — в отдельном потоке
+    try:
+        asyncio.run(main())
+    finally:
+        logs.stop()
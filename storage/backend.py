@@ -0,0 +1,49 @@
+from typing import AsyncIterator, Dict, List, Optional, Protocol, Tuple
+from storage.corpus import ChatCorpus
+from storage.settings import ChatSettings
+
+
+class Storage(Protocol):
+    """Хранилище данных бота, с которым работают обработчики и TextModifier.
+
+    Реализации: BotMemory (SQLite с очередью записи и кэшем корпусов) и
+    SnapshotMemory (всё в памяти, периодические снимки на диск). Выбирается
+    настройкой STORAGE_BACKEND.
+    """
+
+    db_path: str  # Файл хранилища на диске: база SQLite или снимок
+    message_counts: Dict[int, int]
+
+    # Жизненный цикл
+    async def init_db(self) -> bool: ...
+    async def flush(self): ...
+    async def close_db(self): ...
+
+    # Чаты и их настройки
+    async def add_chat(self, chat_id: int, chat_title: str) -> bool: ...
+    async def ensure_chat(self, chat_id: int, chat_title: str) -> Optional[ChatSettings]: ...
+    def get_settings(self, chat_id: int) -> ChatSettings: ...
+    async def get_chats(self) -> List[int]: ...
+    async def get_chat_title(self, chat_id: int) -> str: ...
+    async def get_language(self, chat_id: int) -> str: ...
+    async def set_language(self, chat_id: int, lang: str) -> bool: ...
+    async def get_intelligence(self, chat_id: int) -> int: ...
+    async def set_intelligence(self, chat_id: int, level: int) -> bool: ...
+    async def get_response_frequency(self, chat_id: int) -> int: ...
+    async def set_response_frequency(self, chat_id: int, freq: int) -> bool: ...
+
+    # Сообщения
+    async def enqueue_message(self, chat_id: int, msg_type: str, content: str) -> bool: ...
+    async def add_message(self, chat_id: int, msg_type: str, content: str) -> bool: ...
+    async def message_exists(self, chat_id: int, msg_type: str, content: str) -> bool: ...
+
+    # Выборка
+    async def get_corpus(self, chat_id: int) -> ChatCorpus: ...
+    async def get_random_message(self, chat_id: int) -> Tuple[Optional[str], Optional[str]]: ...
+    async def get_random_sentence(self, chat_id: int) -> Optional[str]: ...
+    async def get_random_words(self, chat_id: int, count: int) -> List[str]: ...
+    def drop_cache(self, chat_id: int): ...
+    def iter_messages(self, chat_id: int, batch_size: int = ...) -> AsyncIterator[List[Tuple[str, str]]]: ...
+
+    # Очистка
+    async def clear_chat_data(self, chat_id: int): ...
@@ -0,0 +1,152 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence
+from config import BACKUP_PAGES, BACKUP_STEP_SLEEP, EXPORT_BATCH_SIZE
+from storage.backend import Storage
+
+logger = logging.getLogger(__name__)
+
+
+def backup_database(source_path: str, target_path: str, pages: int = BACKUP_PAGES,
+                    sleep: float = BACKUP_STEP_SLEEP) -> int:
+    """Онлайн-копия базы SQLite шагами по pages страниц; блокирует поток, вызывается не из цикла событий.
+
+    Источник на всё время копирования держит читающую транзакцию: в режиме
+    WAL она не мешает писателю бота, а копия согласована на момент начала.
+    Без неё каждая запись бота между шагами начинала бы копирование заново.
+    Копия пишется во временный файл и атомарно заменяет target_path.
+    """
+    temp_path = f"{target_path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    source = sqlite3.connect(source_path)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # Фиксирует снимок базы
+        target = sqlite3.connect(temp_path)
+        try:
+            source.backup(target, pages=pages, sleep=sleep)
+        finally:
+            target.close()
+        source.rollback()
+    finally:
+        source.close()
+    os.replace(temp_path, target_path)
+    return os.path.getsize(target_path)
+
+
+def restore_database(backup_path: str, target_path: str):
+    """Восстановление базы из копии; бот должен быть остановлен."""
+    source = sqlite3.connect(f"file:{backup_path}?mode=ro", uri=True)
+    try:
+        status = source.execute("PRAGMA quick_check").fetchone()[0]
+        if status != "ok":
+            raise ValueError(f"копия {backup_path} повреждена: {status}")
+        # Через соединение, а не копированием файла: журнал WAL целевой базы учитывается
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+def backup_name(db_path: str, directory: str) -> str:
+    """Имя новой копии: база и время создания."""
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(directory, f"{stem}.{time.strftime('%Y%m%d-%H%M%S')}.db")
+
+
+def prune_backups(db_path: str, directory: str, keep: int) -> List[str]:
+    """Удаление старых копий базы сверх keep последних; список удалённых."""
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    pattern = re.compile(rf"{re.escape(stem)}\.\d{{8}}-\d{{6}}\.db$")
+    names = sorted(name for name in os.listdir(directory) if pattern.match(name))
+    removed = [os.path.join(directory, name) for name in names[:max(0, len(names) - keep)]]
+    for path in removed:
+        os.remove(path)
+        for suffix in ("-wal", "-shm"):  # Копия в режиме WAL, если её открывали
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return removed
+
+
+async def export_chats(storages: Sequence[Storage], path: str,
+                       chat_ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+    """Выгрузка чатов из хранилищ (по одному на шард) в JSONL со сжатием gzip.
+
+    На каждый чат — строка с его настройками, за ней по строке на сообщение
+    от старых к новым. Сообщения читаются из хранилища пачками по
+    EXPORT_BATCH_SIZE, сжатие и запись пачки идут в отдельном потоке, поэтому
+    память не зависит от размера чатов, а цикл событий не блокируется.
+    """
+    wanted = set(chat_ids) if chat_ids is not None else None
+    totals = {"chats": 0, "messages": 0}
+    with gzip.open(path, "wt", encoding="utf-8") as file:
+        for storage in storages:
+            await storage.flush()
+            for chat_id in await storage.get_chats():
+                if wanted is None or chat_id in wanted:
+                    totals["messages"] += await _export_chat(storage, chat_id, file)
+                    totals["chats"] += 1
+    logger.info("Выгружено %s чатов, %s сообщений в %s", totals["chats"], totals["messages"], path)
+    return totals
+
+
+async def _export_chat(storage: Storage, chat_id: int, file: Any) -> int:
+    settings = storage.get_settings(chat_id)
+    header = {"chat_id": chat_id, "title": await storage.get_chat_title(chat_id),
+              "language": settings.language, "intelligence": settings.intelligence,
+              "frequency": settings.frequency}
+    await asyncio.to_thread(file.write, json.dumps(header, ensure_ascii=False) + "\n")
+    exported = 0
+    async for batch in storage.iter_messages(chat_id, EXPORT_BATCH_SIZE):
+        lines = "".join(json.dumps({"type": msg_type, "content": content}, ensure_ascii=False) + "\n"
+                        for msg_type, content in batch)
+        await asyncio.to_thread(file.write, lines)
+        exported += len(batch)
+    return exported
+
+
+async def restore_chats(storage_for: Callable[[int], Awaitable[Storage]], path: str) -> Dict[str, int]:
+    """Загрузка выгрузки export_chats: настройки чатов и сообщения через очередь записи хранилища.
+
+    storage_for возвращает хранилище чата (при шардировании — базу его
+    обработчика). Повторы уже известных сообщений отбрасываются, лимит
+    сообщений на чат соблюдается так же, как при обычной работе бота.
+    """
+    totals = {"chats": 0, "messages": 0}
+    chat_id: Optional[int] = None
+    storage: Optional[Storage] = None
+    used: Dict[int, Storage] = {}
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        while True:
+            lines: List[str] = await asyncio.to_thread(file.readlines, 1024 * 1024)
+            if not lines:
+                break
+            for line in lines:
+                record: Dict[str, Any] = json.loads(line)
+                if "chat_id" in record:
+                    chat_id = record["chat_id"]
+                    storage = await storage_for(chat_id)
+                    used[id(storage)] = storage
+                    await storage.ensure_chat(chat_id, record.get("title") or "Restored Chat")
+                    await storage.set_language(chat_id, record["language"])
+                    await storage.set_intelligence(chat_id, record["intelligence"])
+                    await storage.set_response_frequency(chat_id, record["frequency"])
+                    totals["chats"] += 1
+                elif chat_id is None or storage is None:
+                    raise ValueError(f"в {path} сообщение идёт раньше строки чата")
+                elif await storage.enqueue_message(chat_id, record["type"], record["content"]):
+                    totals["messages"] += 1
+    for storage in used.values():
+        await storage.flush()
+    logger.info("Загружено %s чатов, %s сообщений из %s", totals["chats"], totals["messages"], path)
+    return totals
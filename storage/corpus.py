@@ -0,0 +1,200 @@
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from storage.markov import MarkovChain
+from storage.sampling import IdRing
+from storage.vocab import Vocabulary
+import logging
+import random
+import re
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_END = re.compile(r'[.!?]+')
+
+
+def split_sentences(content: str) -> List[str]:
+    """Непустые предложения текста сообщения; слова предложения — sentence.split()."""
+    return [sentence for sentence in (part.strip() for part in SENTENCE_END.split(content)) if sentence]
+
+
+class ChatCorpus:
+    """Компактный корпус чата.
+
+    Все слова чата лежат одним буфером id словаря (array('I')), предложение —
+    это смещение начала в этом буфере, конец задаёт начало следующего.
+    Старые строки вытесняются сдвигом начала, буферы уплотняются, когда
+    вытесненная часть занимает больше половины.
+
+    Цепи Маркова строятся по буферу при первом запросе генерации и дальше
+    обновляются вместе с ним при добавлении и вытеснении предложений.
+    """
+    __slots__ = ("vocab", "messages", "sentence_ids", "sentence_starts", "sentence_head", "word_ids", "word_head",
+                 "chains")
+
+    def __init__(self, vocab: Vocabulary, message_ids: Iterable[int] = (),
+                 sentences: Iterable[Tuple[int, Iterable[int]]] = ()):
+        self.vocab = vocab
+        self.messages = IdRing(message_ids)
+        self.sentence_ids = array("q")
+        self.sentence_starts = array("I")
+        self.sentence_head = 0
+        self.word_ids = array("I")
+        self.word_head = 0
+        self.chains: Dict[int, MarkovChain] = {}
+        for sentence_id, word_ids in sentences:
+            self.add_sentence(sentence_id, word_ids)
+
+    @classmethod
+    def restore(cls, vocab: Vocabulary, message_ids: array, sentence_ids: array, sentence_starts: array,
+                word_ids: array) -> "ChatCorpus":
+        """Корпус из буферов снимка (см. export) без разбора по предложениям."""
+        corpus = cls(vocab, message_ids)
+        corpus.sentence_ids = sentence_ids
+        corpus.sentence_starts = sentence_starts
+        corpus.word_ids = word_ids
+        return corpus
+
+    def export(self) -> Tuple[array, array, array, array]:
+        """Копии живых буферов для снимка: id сообщений, id предложений, их начала и слова."""
+        if self.sentence_head:
+            self._compact()
+        return (self.messages.ids[self.messages.head:], self.sentence_ids[:], self.sentence_starts[:],
+                self.word_ids[:])
+
+    @property
+    def sentence_count(self) -> int:
+        return len(self.sentence_ids) - self.sentence_head
+
+    @property
+    def word_count(self) -> int:
+        return len(self.word_ids) - self.word_head
+
+    def add_sentence(self, sentence_id: int, word_ids: Iterable[int]):
+        """Добавление предложения; повторы и устаревшие id игнорируются."""
+        if self.sentence_count and sentence_id <= self.sentence_ids[-1]:
+            return
+        self.sentence_ids.append(sentence_id)
+        self.sentence_starts.append(len(self.word_ids))
+        self.word_ids.extend(word_ids)
+        if self.chains:
+            words = self._sentence_slice(len(self.sentence_ids) - 1)
+            for chain in self.chains.values():
+                chain.update(words)
+
+    def evict(self, message_id: int, sentence_id: Optional[int]):
+        """Вытеснение строк до указанных id сообщения и предложения включительно."""
+        self.messages.evict_upto(message_id)
+        if sentence_id is None:
+            return
+        head = bisect_right(self.sentence_ids, sentence_id, self.sentence_head)
+        if self.chains:
+            for index in range(self.sentence_head, head):
+                words = self._sentence_slice(index)
+                for chain in self.chains.values():
+                    chain.update(words, -1)
+        self.sentence_head = head
+        if self.sentence_head < len(self.sentence_ids):
+            self.word_head = self.sentence_starts[self.sentence_head]
+        else:
+            self.word_head = len(self.word_ids)
+        if self.sentence_head and self.sentence_head * 2 >= len(self.sentence_ids):
+            self._compact()
+
+    def _compact(self):
+        base = self.word_head
+        self.sentence_starts = array("I", (start - base for start in self.sentence_starts[self.sentence_head:]))
+        del self.sentence_ids[:self.sentence_head]
+        del self.word_ids[:base]
+        self.sentence_head = 0
+        self.word_head = 0
+
+    def _sentence_slice(self, index: int) -> array:
+        start = self.sentence_starts[index]
+        end = self.sentence_starts[index + 1] if index + 1 < len(self.sentence_starts) else len(self.word_ids)
+        return self.word_ids[start:end]
+
+    def sentence_words(self, index: int) -> List[str]:
+        """Слова предложения по его позиции в буфере."""
+        texts = self.vocab.texts
+        return [texts[word_id] for word_id in self._sentence_slice(index)]
+
+    def random_sentence(self) -> Optional[str]:
+        if not self.sentence_count:
+            return None
+        return " ".join(self.sentence_words(random.randrange(self.sentence_head, len(self.sentence_ids))))
+
+    def random_words(self, count: int) -> List[str]:
+        """Случайные вхождения слов без повторов позиций."""
+        positions = random.sample(range(self.word_head, len(self.word_ids)), min(count, self.word_count))
+        texts = self.vocab.texts
+        return [texts[self.word_ids[i]] for i in positions]
+
+    def chain(self, order: int) -> MarkovChain:
+        """Цепь Маркова заданного порядка; при первом запросе строится по живым предложениям."""
+        chain = self.chains.get(order)
+        if chain is None:
+            chain = self.chains[order] = MarkovChain(order)
+            for index in range(self.sentence_head, len(self.sentence_ids)):
+                chain.update(self._sentence_slice(index))
+        return chain
+
+    def generate(self, order: int, max_words: int) -> Optional[str]:
+        """Фраза из цепи Маркова порядка order (1 — биграммы, 2 — триграммы)."""
+        if not self.sentence_count:
+            return None
+        texts = self.vocab.texts
+        words = [texts[word_id] for word_id in self.chain(order).generate(max_words)]
+        return " ".join(words) if words else None
+
+
+class CorpusCache:
+    """Общий для процесса кэш корпусов чатов с вытеснением по LRU.
+
+    Обновляется писателем BotMemory после каждой пачки и при вытеснении старых
+    сообщений, сбрасывается точечно при удалении данных чата.
+    """
+    __slots__ = ("vocab", "max_chats", "chats")
+
+    def __init__(self, vocab: Vocabulary, max_chats: int):
+        self.vocab = vocab
+        self.max_chats = max_chats
+        self.chats: "OrderedDict[int, ChatCorpus]" = OrderedDict()
+
+    def get(self, chat_id: int) -> Optional[ChatCorpus]:
+        corpus = self.chats.get(chat_id)
+        if corpus is not None:
+            self.chats.move_to_end(chat_id)
+        return corpus
+
+    def load(self, chat_id: int, message_ids: Iterable[int],
+             sentences: Iterable[Tuple[int, Iterable[int]]]) -> ChatCorpus:
+        """Регистрация корпуса чата, загруженного из базы."""
+        corpus = ChatCorpus(self.vocab, message_ids, sentences)
+        self.chats[chat_id] = corpus
+        self.chats.move_to_end(chat_id)
+        while len(self.chats) > self.max_chats:
+            evicted_chat, _ = self.chats.popitem(last=False)
+            logger.debug("Корпус чата %s вытеснен из памяти", evicted_chat)
+        return corpus
+
+    def add(self, chat_id: int, message_ids: Iterable[int], sentences: Iterable[Tuple[int, Iterable[int]]]):
+        """Учёт новых строк; холодные чаты пропускаются и загрузятся при первом обращении."""
+        corpus = self.chats.get(chat_id)
+        if corpus is None:
+            return
+        for message_id in message_ids:
+            corpus.messages.append(message_id)
+        for sentence_id, word_ids in sentences:
+            corpus.add_sentence(sentence_id, word_ids)
+
+    def evict(self, chat_id: int, message_id: int, sentence_id: Optional[int]):
+        """Учёт вытеснения старых строк чата до указанных границ включительно."""
+        corpus = self.chats.get(chat_id)
+        if corpus is not None:
+            corpus.evict(message_id, sentence_id)
+
+    def drop(self, chat_id: int):
+        if self.chats.pop(chat_id, None) is not None:
+            logger.debug("Корпус чата %s сброшен", chat_id)
@@ -0,0 +1,69 @@
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Iterable, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(msg_type: str, content: str) -> int:
+    """64-битный хэш сообщения со знаком, чтобы помещаться в INTEGER SQLite.
+
+    hash() Python не годится: он солится заново при каждом запуске.
+    """
+    digest = blake2b(f"{msg_type}\0{content}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class ContentHashes:
+    """Хэши сообщений, хранящихся в базе, по чатам: отсортированный array('q') на чат.
+
+    Чат попадает в кэш, когда писатель впервые записывает для него пачку, и
+    вытесняется по LRU. Для холодного чата ответа нет (None) — решает индекс
+    (chat_id, hash) в базе.
+    """
+    __slots__ = ("max_chats", "chats")
+
+    def __init__(self, max_chats: int):
+        self.max_chats = max_chats
+        self.chats: "OrderedDict[int, array]" = OrderedDict()
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self.chats
+
+    def contains(self, chat_id: int, value: int) -> Optional[bool]:
+        hashes = self.chats.get(chat_id)
+        if hashes is None:
+            return None
+        index = bisect_left(hashes, value)
+        return index < len(hashes) and hashes[index] == value
+
+    def load(self, chat_id: int, hashes: Iterable[int]):
+        self.chats[chat_id] = array("q", sorted(hashes))
+        self.chats.move_to_end(chat_id)
+        while len(self.chats) > self.max_chats:
+            evicted_chat, _ = self.chats.popitem(last=False)
+            logger.debug("Хэши сообщений чата %s вытеснены из памяти", evicted_chat)
+
+    def add(self, chat_id: int, value: int):
+        hashes = self.chats.get(chat_id)
+        if hashes is None:
+            return
+        self.chats.move_to_end(chat_id)
+        index = bisect_left(hashes, value)
+        if index == len(hashes) or hashes[index] != value:
+            hashes.insert(index, value)
+
+    def discard(self, chat_id: int, values: Iterable[int]):
+        hashes = self.chats.get(chat_id)
+        if hashes is None:
+            return
+        for value in values:
+            index = bisect_left(hashes, value)
+            if index < len(hashes) and hashes[index] == value:
+                del hashes[index]
+
+    def drop(self, chat_id: int):
+        self.chats.pop(chat_id, None)
@@ -0,0 +1,127 @@
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional
+import random
+
+# Граница предложения: id словаря начинаются с 1, поэтому 0 свободен
+BOUNDARY = 0
+SLOT_INDEX_MIN = 8  # С этого числа переходов позиции ищутся по словарю, а не перебором
+
+
+class Transitions:
+    """Переходы из одного состояния: следующие id слов и их счётчики.
+
+    Накопленные веса строятся лениво при первой выборке после изменения,
+    сама выборка — bisect за O(log k). Позиция перехода в массивах ищется
+    по словарю slots за O(1); у состояний с числом переходов меньше
+    SLOT_INDEX_MIN, а их большинство, словаря нет и короткий массив
+    просматривается целиком.
+    """
+    __slots__ = ("next_ids", "counts", "cum_weights", "slots")
+
+    def __init__(self):
+        self.next_ids = array("I")
+        self.counts = array("I")
+        self.cum_weights = None
+        self.slots: Optional[Dict[int, int]] = None  # id слова -> позиция в next_ids
+
+    def __len__(self) -> int:
+        return len(self.next_ids)
+
+    def add(self, word_id: int, delta: int):
+        """Изменение счётчика перехода; обнулённые переходы удаляются."""
+        index = self._slot(word_id)
+        if index is None:
+            if delta > 0:
+                if self.slots is not None:
+                    self.slots[word_id] = len(self.next_ids)
+                elif len(self.next_ids) + 1 >= SLOT_INDEX_MIN:
+                    self.slots = {next_id: slot for slot, next_id in enumerate(self.next_ids)}
+                    self.slots[word_id] = len(self.next_ids)
+                self.next_ids.append(word_id)
+                self.counts.append(delta)
+                self.cum_weights = None
+            return
+        count = self.counts[index] + delta
+        if count > 0:
+            self.counts[index] = count
+        else:
+            # Удаление перестановкой последнего элемента на место удалённого
+            last_id = self.next_ids[-1]
+            self.next_ids[index] = last_id
+            self.counts[index] = self.counts[-1]
+            self.next_ids.pop()
+            self.counts.pop()
+            if self.slots is not None:
+                self.slots[last_id] = index
+                del self.slots[word_id]
+        self.cum_weights = None
+
+    def _slot(self, word_id: int) -> Optional[int]:
+        if self.slots is not None:
+            return self.slots.get(word_id)
+        try:
+            return self.next_ids.index(word_id)
+        except ValueError:
+            return None
+
+    def choice(self) -> int:
+        if self.cum_weights is None:
+            self.cum_weights = array("Q", accumulate(self.counts))
+        return self.next_ids[bisect_right(self.cum_weights, random.randrange(self.cum_weights[-1]))]
+
+
+class MarkovChain:
+    """Цепь Маркова порядка order над id словаря.
+
+    Состояние — последние order слов, упакованные в одно целое по 32 бита на
+    слово. Начало и конец предложения обозначаются BOUNDARY.
+    """
+    __slots__ = ("order", "states")
+
+    def __init__(self, order: int):
+        self.order = order
+        self.states: Dict[int, Transitions] = {}
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def _transitions(self, word_ids: Iterable[int]):
+        """Пары (состояние, следующее слово) для одного предложения."""
+        mask = (1 << (32 * self.order)) - 1
+        state = BOUNDARY
+        for word_id in word_ids:
+            yield state, word_id
+            state = ((state << 32) | word_id) & mask
+        yield state, BOUNDARY
+
+    def update(self, word_ids: Iterable[int], delta: int = 1):
+        """Учёт предложения (delta=1) или его вытеснения (delta=-1)."""
+        states = self.states
+        for state, word_id in self._transitions(word_ids):
+            transitions = states.get(state)
+            if transitions is None:
+                if delta <= 0:
+                    continue
+                transitions = states[state] = Transitions()
+            transitions.add(word_id, delta)
+            if not transitions:
+                del states[state]
+
+    def generate(self, max_words: int) -> List[int]:
+        """Случайная цепочка id слов от начала предложения до его конца или max_words."""
+        mask = (1 << (32 * self.order)) - 1
+        states = self.states
+        state = BOUNDARY
+        result: List[int] = []
+        while len(result) < max_words:
+            transitions = states.get(state)
+            if transitions is None:
+                break
+            word_id = transitions.choice()
+            if word_id == BOUNDARY:
+                break
+            result.append(word_id)
+            state = ((state << 32) | word_id) & mask
+        return result
@@ -1,365 +1,642 @@
 import aiosqlite
-from typing import Optional, Tuple, List
-from config import MAX_MESSAGES_PER_CHAT
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Dict, Optional, Set, Tuple, List
+from config import (MAX_MESSAGES_PER_CHAT, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL, INGEST_QUEUE_SIZE,
+                    CORPUS_CACHE_MAX_CHATS, EVICTION_BATCH_RATIO, DEDUP_CACHE_MAX_CHATS, STORAGE_BACKEND,
+                    SNAPSHOT_PATH, SQL_PROFILE_ENABLED, SQL_SLOW_THRESHOLD, SQL_PROFILE_TOP, BACKUP_DIR,
+                    BACKUP_INTERVAL, BACKUP_KEEP, EXPORT_BATCH_SIZE)
+from storage.backend import Storage
+from storage.backup import backup_database, backup_name, prune_backups
+from storage.migrations import apply_pragmas, migrate
+from storage.profiler import ProfiledConnection
+from storage.corpus import ChatCorpus, CorpusCache, split_sentences
+from storage.dedup import ContentHashes, content_hash
+from storage.settings import ChatSettings, load_settings
+from storage.vocab import Vocabulary
+from utils.metrics import STORAGE_SECONDS, cache_hit, timed
 import logging
-import re
 
 logger = logging.getLogger(__name__)
 
 class BotMemory:
     def __init__(self, db_path: str = "uglyok.db"):
         self.db_path = db_path
-        self.chat_settings_cache = {}
+        self.chat_settings: Dict[int, ChatSettings] = {}  # Все известные чаты, загружаются при старте
         self.db = None
+        self.write_lock = asyncio.Lock()
+        self.ingest_queue: Optional[asyncio.Queue] = None
+        self.writer_task: Optional[asyncio.Task] = None
+        self.cleared_chats: Set[int] = set()  # Чаты, удалённые, пока писатель собирал текущую пачку
+        self.backup_task: Optional[asyncio.Task] = None
+        self.message_counts: Dict[int, int] = {}
+        self.vocab = Vocabulary()
+        self.corpus = CorpusCache(self.vocab, CORPUS_CACHE_MAX_CHATS)
+        self.content_hashes = ContentHashes(DEDUP_CACHE_MAX_CHATS)
 
     async def init_db(self):
         """Инициализация базы данных и создание постоянного соединения."""
         try:
             self.db = await aiosqlite.connect(self.db_path)
-            await self.db.execute("""
-                CREATE TABLE IF NOT EXISTS chats (
-                    chat_id INTEGER PRIMARY KEY,
-                    chat_title TEXT,
-                    language TEXT DEFAULT 'en',
-                    intelligence INTEGER DEFAULT 50,
-                    response_frequency INTEGER DEFAULT 50
-                )
-            """)  # noqa: SQL101
-            await self.db.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER,
-                    type TEXT,
-                    content TEXT,
-                    UNIQUE(chat_id, type, content),
-                    FOREIGN KEY(chat_id) REFERENCES chats(chat_id)
-                )
-            """)  # noqa: SQL101
-            await self.db.execute("""
-                CREATE TABLE IF NOT EXISTS sentences (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    message_id INTEGER,
-                    content TEXT,
-                    FOREIGN KEY(message_id) REFERENCES messages(id)
-                )
-            """)  # noqa: SQL101
-            await self.db.execute("""
-                CREATE TABLE IF NOT EXISTS words (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sentence_id INTEGER,
-                    content TEXT,
-                    FOREIGN KEY(sentence_id) REFERENCES sentences(id)
-                )
-            """)  # noqa: SQL101
-            await self.db.commit()
+            if SQL_PROFILE_ENABLED:
+                self.db = ProfiledConnection(self.db, SQL_SLOW_THRESHOLD, self.db_path)
+            await apply_pragmas(self.db)
+            await migrate(self.db)
+            await self.load_chat_settings()
+            await self.load_message_counts()
+            cursor = await self.db.execute("SELECT id, text FROM vocab")
+            self.vocab.load(await cursor.fetchall())
+            self.start_ingestion()
+            if BACKUP_INTERVAL > 0:
+                self.backup_task = asyncio.create_task(self._backup_loop())
             logger.info("База данных успешно инициализирована")
             return True
         except Exception as e:
-            logger.error(f"Ошибка при инициализации базы данных: {e}")
-            self.db = None
+            logger.error("Ошибка при инициализации базы данных: %s", e)
+            # Очередь не сбрасывается: база в неизвестном состоянии, задачи просто снимаются
+            for task in (self.backup_task, self.writer_task):
+                if task:
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+            self.backup_task = self.writer_task = self.ingest_queue = None
+            if self.db:
+                try:
+                    await self.db.close()
+                except Exception as close_error:
+                    logger.error("Ошибка при закрытии базы после неудачной инициализации: %s", close_error)
+                self.db = None
             return False
 
+    async def load_chat_settings(self):
+        """Загрузка настроек всех чатов одним запросом; наличие в словаре означает, что чат зарегистрирован."""
+        cursor = await self.db.execute("SELECT chat_id, language, intelligence, response_frequency FROM chats")
+        self.chat_settings = load_settings(await cursor.fetchall())
+        logger.debug("Загружены настройки %s чатов", len(self.chat_settings))
+
+    async def load_message_counts(self):
+        """Загрузка счётчиков сообщений по чатам для контроля лимита без COUNT(*) на запись."""
+        cursor = await self.db.execute("SELECT chat_id, COUNT(*) FROM messages GROUP BY chat_id")
+        self.message_counts = dict(await cursor.fetchall())
+        logger.debug("Загружены счётчики сообщений для %s чатов", len(self.message_counts))
+
     async def close_db(self):
         """Закрытие соединения с базой."""
+        if self.backup_task:
+            self.backup_task.cancel()
+            await asyncio.gather(self.backup_task, return_exceptions=True)
+            self.backup_task = None
+        await self.stop_ingestion()
+        self.log_sql_profile()
         if self.db:
             await self.db.close()
+            self.db = None
             logger.info("Соединение с базой данных закрыто")
         else:
             logger.warning("Попытка закрыть неинициализированное соединение с базой")
 
+    async def backup(self, directory: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> Optional[str]:
+        """Онлайн-копия базы в directory; копирование идёт в отдельном потоке, запись бота не ждёт.
+
+        Старые копии сверх keep последних удаляются. Возвращает путь копии
+        или None при ошибке.
+        """
+        target = backup_name(self.db_path, directory)
+        try:
+            started = time.perf_counter()
+            os.makedirs(directory, exist_ok=True)
+            size = await asyncio.to_thread(backup_database, self.db_path, target)
+            removed = await asyncio.to_thread(prune_backups, self.db_path, directory, keep)
+            logger.info("Копия базы %s: %s байт за %.2f с, удалено старых копий: %s",
+                        target, size, time.perf_counter() - started, len(removed))
+            return target
+        except Exception as e:
+            logger.error("Ошибка резервного копирования базы в %s: %s", target, e)
+            return None
+
+    async def _backup_loop(self):
+        while True:
+            await asyncio.sleep(BACKUP_INTERVAL)
+            await self.backup()
+
+    def log_sql_profile(self, limit: int = SQL_PROFILE_TOP):
+        """Топ запросов по суммарному времени в лог, если включено профилирование."""
+        if isinstance(self.db, ProfiledConnection):
+            logger.info("Топ-%s запросов к базе по суммарному времени:\n%s", limit, self.db.report(limit))
+
+    @timed(STORAGE_SECONDS)
     async def add_chat(self, chat_id: int, chat_title: str) -> bool:
         """Добавление нового чата в базу данных."""
         if not self.db:
-            logger.error(f"База данных не инициализирована для добавления чата {chat_id}")
+            logger.error("База данных не инициализирована для добавления чата %s", chat_id)
             return False
+        async with self.write_lock:
+            try:
+                await self.db.execute(
+                    "INSERT INTO chats (chat_id, chat_title) VALUES (?, ?) ON CONFLICT(chat_id) DO NOTHING",
+                    (chat_id, chat_title)
+                )
+                await self.db.commit()
+                self.chat_settings.setdefault(chat_id, ChatSettings())
+                logger.debug("Чат %s добавлен в кэш", chat_id)
+                return True
+            except Exception as e:
+                logger.error("Ошибка при добавлении чата %s: %s", chat_id, e)
+                return False
+
+    @timed(STORAGE_SECONDS)
+    async def ensure_chat(self, chat_id: int, chat_title: str) -> Optional[ChatSettings]:
+        """Настройки чата; неизвестный чат сначала регистрируется в базе, при ошибке — None."""
+        settings = self.chat_settings.get(chat_id)
+        cache_hit("chat_settings", settings is not None)
+        if settings is not None:
+            return settings
+        if not await self.add_chat(chat_id, chat_title):
+            return None
+        logger.info("Чат %s зарегистрирован: %s", chat_id, chat_title)
+        return self.chat_settings[chat_id]
+
+    def get_settings(self, chat_id: int) -> ChatSettings:
+        """Настройки чата без обращения к базе; для неизвестного чата — значения по умолчанию."""
+        settings = self.chat_settings.get(chat_id)
+        return settings if settings is not None else ChatSettings()
+
+    def start_ingestion(self):
+        """Запуск фонового писателя очереди сообщений."""
+        if self.writer_task and not self.writer_task.done():
+            return
+        self.ingest_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self.writer_task = asyncio.create_task(self._writer_loop())
+        logger.debug("Фоновый писатель сообщений запущен")
+
+    async def flush(self):
+        """Ожидание записи всех сообщений из очереди."""
+        if self.ingest_queue is not None and self.writer_task and not self.writer_task.done():
+            await self.ingest_queue.join()
+
+    async def stop_ingestion(self):
+        """Сброс очереди на диск и остановка фонового писателя."""
+        if not self.writer_task:
+            return
+        await self.flush()
+        self.writer_task.cancel()
         try:
-            await self.db.execute(
-                "INSERT INTO chats (chat_id, chat_title) VALUES (?, ?) ON CONFLICT(chat_id) DO NOTHING",
-                (chat_id, chat_title)
-            )
-            await self.db.commit()
-            self.chat_settings_cache[chat_id] = {
-                "language": "en",
-                "intelligence": 50,
-                "frequency": 50
-            }
-            logger.debug(f"Чат {chat_id} добавлен в кэш")
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении чата {chat_id}: {e}")
+            await self.writer_task
+        except asyncio.CancelledError:
+            pass
+        self.writer_task = None
+        self.ingest_queue = None
+        logger.info("Очередь сообщений сброшена, фоновый писатель остановлен")
+
+    @timed(STORAGE_SECONDS)
+    async def enqueue_message(self, chat_id: int, msg_type: str, content: str) -> bool:
+        """Постановка сообщения в очередь на запись без ожидания транзакции.
+
+        Дубликат сообщения, уже известного по хэшам чата, отбрасывается сразу.
+        """
+        if self.ingest_queue is None or not self.writer_task or self.writer_task.done():
+            return await self.add_message(chat_id, msg_type, content)
+        value = content_hash(msg_type, content)
+        known = self.content_hashes.contains(chat_id, value)
+        cache_hit("content_hashes", known is not None)
+        if known:
+            logger.debug("Дубликат сообщения в чате %s отброшен без записи", chat_id)
             return False
+        item = (chat_id, msg_type, content, value)
+        try:
+            self.ingest_queue.put_nowait(item)
+        except asyncio.QueueFull:
+            logger.warning("Очередь сообщений переполнена, ожидаем писателя (чат %s)", chat_id)
+            await self.ingest_queue.put(item)
+        return True
 
-    async def add_message(self, chat_id: int, msg_type: str, content: str) -> bool:
-        """Добавление сообщения с разбиением текста на предложения и слова."""
+    async def _writer_loop(self):
+        """Сбор сообщений из очереди в пачки и их групповая запись."""
+        queue = self.ingest_queue
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            self.cleared_chats.clear()
+            deadline = loop.time() + INGEST_FLUSH_INTERVAL
+            while len(batch) < INGEST_BATCH_SIZE:
+                try:
+                    batch.append(queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._write_batch(batch, skip_cleared=True)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    @timed(STORAGE_SECONDS)
+    async def _write_batch(self, batch: List[Tuple[int, str, str, int]], skip_cleared: bool = False) -> bool:
+        """Запись пачки сообщений с предложениями и словами одной транзакцией.
+
+        С skip_cleared сообщения чатов, удалённых clear_chat_data, пока
+        собиралась пачка, отбрасываются.
+        """
         if not self.db:
-            logger.error(f"База данных не инициализирована для добавления сообщения в чат {chat_id}")
+            logger.error("База данных не инициализирована для записи %s сообщений", len(batch))
             return False
-        try:
+        async with self.write_lock:
+            if skip_cleared and self.cleared_chats:
+                batch = [item for item in batch if item[0] not in self.cleared_chats]
+                if not batch:
+                    return True
+            try:
+                # Писатель единственный, поэтому идентификаторы выдаём сами
+                # и вставляем предложения и слова через executemany.
+                cursor = await self.db.execute(
+                    "SELECT name, seq FROM sqlite_sequence WHERE name IN ('messages', 'sentences', 'words')"
+                )
+                seq = dict(await cursor.fetchall())
+                last_message_id = seq.get("messages", 0)
+                sentence_id = seq.get("sentences", 0)
+                word_id = seq.get("words", 0)
+
+                # Хэши холодных чатов подгружаются по индексу (chat_id, hash),
+                # дальше дубликаты отсекаются в памяти.
+                for chat_id in {item[0] for item in batch}:
+                    if chat_id not in self.content_hashes:
+                        cursor = await self.db.execute("SELECT hash FROM messages WHERE chat_id = ?", (chat_id,))
+                        self.content_hashes.load(chat_id, (row[0] for row in await cursor.fetchall()))
+                fresh = []
+                pending = set()
+                for chat_id, msg_type, content, value in batch:
+                    if (chat_id, value) in pending or self.content_hashes.contains(chat_id, value):
+                        continue
+                    pending.add((chat_id, value))
+                    fresh.append((chat_id, msg_type, content, value))
+                if fresh:
+                    await self.db.executemany(
+                        "INSERT INTO messages (chat_id, type, content, hash) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(chat_id, hash) DO NOTHING",
+                        fresh
+                    )
+                cursor = await self.db.execute(
+                    "SELECT id, chat_id, type, content, hash FROM messages WHERE id > ? ORDER BY id",
+                    (last_message_id,)
+                )
+                inserted = await cursor.fetchall()
+
+                sentence_rows = []
+                word_rows = []
+                new_words = {}  # слова, которых ещё нет в словаре: текст -> id
+                frequencies = {}  # (chat_id, id слова) -> число вхождений в пачке
+                new_rows = {}  # chat_id -> (id сообщений, [(id предложения, id слов словаря)])
+                for message_id, chat_id, msg_type, content, value in inserted:
+                    message_ids, chat_sentences = new_rows.setdefault(chat_id, ([], []))
+                    message_ids.append(message_id)
+                    if msg_type != "text":
+                        continue
+                    for sentence in split_sentences(content):
+                        sentence_id += 1
+                        sentence_words = []
+                        chat_sentences.append((sentence_id, sentence_words))
+                        sentence_rows.append((sentence_id, message_id, chat_id, sentence))
+                        for word in sentence.split():
+                            vocab_id = self.vocab.lookup(word)
+                            if vocab_id is None:
+                                vocab_id = new_words.get(word)
+                                if vocab_id is None:
+                                    vocab_id = new_words[word] = self.vocab.max_id + len(new_words) + 1
+                            word_id += 1
+                            sentence_words.append(vocab_id)
+                            word_rows.append((word_id, sentence_id, chat_id, vocab_id))
+                            key = (chat_id, vocab_id)
+                            frequencies[key] = frequencies.get(key, 0) + 1
+                if sentence_rows:
+                    await self.db.executemany(
+                        "INSERT INTO sentences (id, message_id, chat_id, content) VALUES (?, ?, ?, ?)",
+                        sentence_rows
+                    )
+                if new_words:
+                    await self.db.executemany(
+                        "INSERT INTO vocab (id, text) VALUES (?, ?)",
+                        [(vocab_id, word) for word, vocab_id in new_words.items()]
+                    )
+                if word_rows:
+                    await self.db.executemany(
+                        "INSERT INTO words (id, sentence_id, chat_id, word_id) VALUES (?, ?, ?, ?)",
+                        word_rows
+                    )
+                    await self.db.executemany(
+                        "INSERT INTO chat_vocab (chat_id, word_id, count) VALUES (?, ?, ?) "
+                        "ON CONFLICT(chat_id, word_id) DO UPDATE SET count = count + excluded.count",
+                        [(chat_id, vocab_id, count) for (chat_id, vocab_id), count in frequencies.items()]
+                    )
+
+                added = {chat_id: len(rows[0]) for chat_id, rows in new_rows.items()}
+                evicted = await self._evict_overflow(added)
+                await self.db.commit()
+
+                self.vocab.register((vocab_id, word) for word, vocab_id in new_words.items())
+                for chat_id, (message_ids, chat_sentences) in new_rows.items():
+                    self.message_counts[chat_id] = self.message_counts.get(chat_id, 0) + added[chat_id]
+                    self.corpus.add(chat_id, message_ids, chat_sentences)
+                for row in inserted:
+                    self.content_hashes.add(row[1], row[4])
+                for chat_id, message_id, sentence_id, removed, hashes in evicted:
+                    self.message_counts[chat_id] -= removed
+                    self.corpus.evict(chat_id, message_id, sentence_id)
+                    self.content_hashes.discard(chat_id, hashes)
+                logger.debug("Записана пачка: %s сообщений, новых %s, предложений %s, слов %s, новых в словаре %s",
+                             len(batch), len(inserted), len(sentence_rows), len(word_rows), len(new_words))
+                return True
+            except Exception as e:
+                logger.error("Ошибка при записи пачки из %s сообщений: %s", len(batch), e)
+                await self.db.rollback()
+                return False
+
+    async def _evict_overflow(self, added: Dict[int, int]) -> List[Tuple[int, int, Optional[int], int, List[int]]]:
+        """Вытеснение старых сообщений чатов, превысивших лимит, вместе с предложениями и словами.
+
+        Вызывается внутри транзакции пачки. Чат обрезается сразу на долю
+        EVICTION_BATCH_RATIO от лимита, поэтому вытеснение происходит редко.
+        """
+        evicted = []
+        for chat_id, count in added.items():
+            total = self.message_counts.get(chat_id, 0) + count
+            if total <= MAX_MESSAGES_PER_CHAT:
+                continue
+            target = max(0, MAX_MESSAGES_PER_CHAT - int(MAX_MESSAGES_PER_CHAT * EVICTION_BATCH_RATIO))
             cursor = await self.db.execute(
-                "SELECT COUNT(*) FROM messages WHERE chat_id = ?",
-                (chat_id,)
+                "SELECT id FROM messages WHERE chat_id = ? ORDER BY id LIMIT 1 OFFSET ?",
+                (chat_id, total - target - 1)
             )
-            count = (await cursor.fetchone())[0]
-            if count >= MAX_MESSAGES_PER_CHAT:
+            row = await cursor.fetchone()
+            if row is None:
+                continue
+            message_id = row[0]
+            # id растут вместе с сообщениями, поэтому старые строки чата — это
+            # префикс индекса (chat_id, id), и удалять их можно диапазоном.
+            cursor = await self.db.execute(
+                "SELECT (SELECT MAX(id) FROM sentences WHERE chat_id = ?1 AND message_id <= ?2), "
+                "(SELECT MAX(id) FROM words WHERE chat_id = ?1 AND sentence_id <= "
+                "(SELECT MAX(id) FROM sentences WHERE chat_id = ?1 AND message_id <= ?2))",
+                (chat_id, message_id)
+            )
+            sentence_id, word_id = await cursor.fetchone()
+            if word_id is not None:
                 await self.db.execute(
-                    "DELETE FROM messages WHERE id = (SELECT id FROM messages WHERE chat_id = ? ORDER BY id ASC LIMIT 1)",
-                    (chat_id,)
+                    "WITH gone AS (SELECT word_id, COUNT(*) AS n FROM words WHERE chat_id = ?1 AND id <= ?2 GROUP BY word_id) "
+                    "UPDATE chat_vocab SET count = count - (SELECT n FROM gone WHERE gone.word_id = chat_vocab.word_id) "
+                    "WHERE chat_id = ?1 AND word_id IN (SELECT word_id FROM gone)",
+                    (chat_id, word_id)
                 )
-                logger.info(f"Удалено старое сообщение в чате {chat_id} из-за превышения лимита {MAX_MESSAGES_PER_CHAT}")
-
+                await self.db.execute("DELETE FROM chat_vocab WHERE chat_id = ? AND count <= 0", (chat_id,))
+                await self.db.execute("DELETE FROM words WHERE chat_id = ? AND id <= ?", (chat_id, word_id))
+            if sentence_id is not None:
+                await self.db.execute("DELETE FROM sentences WHERE chat_id = ? AND id <= ?", (chat_id, sentence_id))
             cursor = await self.db.execute(
-                "INSERT INTO messages (chat_id, type, content) VALUES (?, ?, ?) ON CONFLICT(chat_id, type, content) DO NOTHING RETURNING id",
-                (chat_id, msg_type, content)
+                "SELECT hash FROM messages WHERE chat_id = ? AND id <= ?",
+                (chat_id, message_id)
             )
-            row = await cursor.fetchone()
-            message_id = row[0] if row else None
-            if message_id and msg_type == "text":
-                sentences = re.split(r'[.!?]+', content)
-                for sentence in sentences:
-                    sentence = sentence.strip()
-                    if sentence:
-                        cursor = await self.db.execute(
-                            "INSERT INTO sentences (message_id, content) VALUES (?, ?)",
-                            (message_id, sentence)
-                        )
-                        sentence_id = cursor.lastrowid
-                        words = sentence.split()
-                        for word in words:
-                            await self.db.execute(
-                                "INSERT INTO words (sentence_id, content) VALUES (?, ?)",
-                                (sentence_id, word)
-                            )
-            await self.db.commit()
-            logger.debug(f"Добавлено сообщение в чат {chat_id}: {content}")
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении сообщения в чате {chat_id}: {e}")
+            hashes = [row[0] for row in await cursor.fetchall()]
+            cursor = await self.db.execute(
+                "DELETE FROM messages WHERE chat_id = ? AND id <= ?",
+                (chat_id, message_id)
+            )
+            logger.info("Удалено %s старых сообщений в чате %s из-за превышения лимита %s",
+                        cursor.rowcount, chat_id, MAX_MESSAGES_PER_CHAT)
+            evicted.append((chat_id, message_id, sentence_id, cursor.rowcount, hashes))
+        return evicted
+
+    @timed(STORAGE_SECONDS)
+    async def add_message(self, chat_id: int, msg_type: str, content: str) -> bool:
+        """Добавление сообщения с разбиением текста на предложения и слова."""
+        if not self.db:
+            logger.error("База данных не инициализирована для добавления сообщения в чат %s", chat_id)
             return False
+        if await self._write_batch([(chat_id, msg_type, content, content_hash(msg_type, content))]):
+            logger.debug("Добавлено сообщение в чат %s: %s", chat_id, content)
+            return True
+        return False
 
+    @timed(STORAGE_SECONDS)
     async def message_exists(self, chat_id: int, msg_type: str, content: str) -> bool:
         """Проверка, существует ли сообщение в базе."""
         if not self.db:
-            logger.error(f"База данных не инициализирована для проверки сообщения в чате {chat_id}")
+            logger.error("База данных не инициализирована для проверки сообщения в чате %s", chat_id)
             return False
+        value = content_hash(msg_type, content)
+        known = self.content_hashes.contains(chat_id, value)
+        if known is not None:
+            return known
         try:
             cursor = await self.db.execute(
-                "SELECT COUNT(*) FROM messages WHERE chat_id = ? AND type = ? AND content = ?",
-                (chat_id, msg_type, content)
+                "SELECT COUNT(*) FROM messages WHERE chat_id = ? AND hash = ?",
+                (chat_id, value)
             )
             count = (await cursor.fetchone())[0]
             return count > 0
         except Exception as e:
-            logger.error(f"Ошибка при проверке сообщения в чате {chat_id}: {e}")
+            logger.error("Ошибка при проверке сообщения в чате %s: %s", chat_id, e)
             return False
 
+    async def _upsert_setting(self, chat_id: int, column: str, value):
+        """Запись настройки; строка чата создаётся, если её нет (например, после /forget_me).
+
+        Иначе UPDATE не изменил бы ни одной строки, а настройка осталась бы
+        только в кэше, и ensure_chat уже не зарегистрировал бы чат в базе.
+        column — имя столбца из кода, не из ввода пользователя.
+        """
+        await self.db.execute(
+            f"INSERT INTO chats (chat_id, chat_title, {column}) VALUES (?, ?, ?) "
+            f"ON CONFLICT(chat_id) DO UPDATE SET {column} = excluded.{column}",
+            (chat_id, "Unknown Chat", value)
+        )
+
     async def get_language(self, chat_id: int) -> str:
         """Получение языка чата."""
-        if chat_id in self.chat_settings_cache:
-            return self.chat_settings_cache[chat_id]["language"]
-        if not self.db:
-            logger.error(f"База данных не инициализирована для получения языка чата {chat_id}")
-            return "en"
-        try:
-            cursor = await self.db.execute(
-                "SELECT language, intelligence, response_frequency FROM chats WHERE chat_id = ?",
-                (chat_id,)
-            )
-            result = await cursor.fetchone()
-            if result:
-                lang, intel, freq = result
-                self.chat_settings_cache[chat_id] = {
-                    "language": lang,
-                    "intelligence": intel,
-                    "frequency": freq
-                }
-                logger.debug(f"Загружены настройки чата {chat_id} из базы")
-                return lang
-            return "en"
-        except Exception as e:
-            logger.error(f"Ошибка при получении языка чата {chat_id}: {e}")
-            return "en"
+        return self.get_settings(chat_id).language
 
+    @timed(STORAGE_SECONDS)
     async def set_language(self, chat_id: int, lang: str) -> bool:
         """Установка языка чата."""
         if not self.db:
-            logger.error(f"База данных не инициализирована для установки языка чата {chat_id}")
-            return False
-        try:
-            cursor = await self.db.execute("SELECT COUNT(*) FROM chats WHERE chat_id = ?", (chat_id,))
-            count = (await cursor.fetchone())[0]
-            if count == 0:
-                await self.db.execute(
-                    "INSERT INTO chats (chat_id, chat_title, language) VALUES (?, ?, ?)",
-                    (chat_id, "Unknown Chat", lang)
-                )
-                logger.info(f"Добавлен новый чат {chat_id} с языком {lang}")
-            else:
-                await self.db.execute(
-                    "UPDATE chats SET language = ? WHERE chat_id = ?",
-                    (lang, chat_id)
-                )
-                logger.debug(f"Язык чата {chat_id} обновлен на {lang}")
-            await self.db.commit()
-            self.chat_settings_cache[chat_id] = self.chat_settings_cache.get(chat_id, {
-                "language": "en",
-                "intelligence": 50,
-                "frequency": 50
-            })
-            self.chat_settings_cache[chat_id]["language"] = lang
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка при установке языка чата {chat_id}: {e}")
+            logger.error("База данных не инициализирована для установки языка чата %s", chat_id)
             return False
+        async with self.write_lock:
+            try:
+                await self._upsert_setting(chat_id, "language", lang)
+                await self.db.commit()
+                self.chat_settings.setdefault(chat_id, ChatSettings()).language = lang
+                logger.debug("Язык чата %s обновлен на %s", chat_id, lang)
+                return True
+            except Exception as e:
+                logger.error("Ошибка при установке языка чата %s: %s", chat_id, e)
+                return False
 
     async def get_intelligence(self, chat_id: int) -> int:
         """Получение уровня интеллекта чата."""
-        if chat_id in self.chat_settings_cache:
-            return self.chat_settings_cache[chat_id]["intelligence"]
-        if not self.db:
-            logger.error(f"База данных не инициализирована для получения интеллекта чата {chat_id}")
-            return 50
-        try:
-            cursor = await self.db.execute(
-                "SELECT language, intelligence, response_frequency FROM chats WHERE chat_id = ?",
-                (chat_id,)
-            )
-            result = await cursor.fetchone()
-            if result:
-                lang, intel, freq = result
-                self.chat_settings_cache[chat_id] = {
-                    "language": lang,
-                    "intelligence": intel,
-                    "frequency": freq
-                }
-                logger.debug(f"Загружены настройки чата {chat_id} из базы")
-                return intel
-            return 50
-        except Exception as e:
-            logger.error(f"Ошибка при получении интеллекта чата {chat_id}: {e}")
-            return 50
+        return self.get_settings(chat_id).intelligence
 
+    @timed(STORAGE_SECONDS)
     async def set_intelligence(self, chat_id: int, level: int) -> bool:
         """Установка уровня интеллекта чата."""
         if not self.db:
-            logger.error(f"База данных не инициализирована для установки интеллекта чата {chat_id}")
-            return False
-        try:
-            await self.db.execute(
-                "UPDATE chats SET intelligence = ? WHERE chat_id = ?",
-                (level, chat_id)
-            )
-            await self.db.commit()
-            self.chat_settings_cache[chat_id] = self.chat_settings_cache.get(chat_id, {
-                "language": "en",
-                "intelligence": 50,
-                "frequency": 50
-            })
-            self.chat_settings_cache[chat_id]["intelligence"] = level
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка при установке интеллекта чата {chat_id}: {e}")
+            logger.error("База данных не инициализирована для установки интеллекта чата %s", chat_id)
             return False
+        async with self.write_lock:
+            try:
+                await self._upsert_setting(chat_id, "intelligence", level)
+                await self.db.commit()
+                self.chat_settings.setdefault(chat_id, ChatSettings()).intelligence = level
+                return True
+            except Exception as e:
+                logger.error("Ошибка при установке интеллекта чата %s: %s", chat_id, e)
+                return False
 
     async def get_response_frequency(self, chat_id: int) -> int:
         """Получение частоты ответа чата."""
-        if chat_id in self.chat_settings_cache:
-            return self.chat_settings_cache[chat_id]["frequency"]
-        if not self.db:
-            logger.error(f"База данных не инициализирована для получения частоты чата {chat_id}")
-            return 50
-        try:
-            cursor = await self.db.execute(
-                "SELECT language, intelligence, response_frequency FROM chats WHERE chat_id = ?",
-                (chat_id,)
-            )
-            result = await cursor.fetchone()
-            if result:
-                lang, intel, freq = result
-                self.chat_settings_cache[chat_id] = {
-                    "language": lang,
-                    "intelligence": intel,
-                    "frequency": freq
-                }
-                logger.debug(f"Загружены настройки чата {chat_id} из базы")
-                return freq
-            return 50
-        except Exception as e:
-            logger.error(f"Ошибка при получении частоты чата {chat_id}: {e}")
-            return 50
+        return self.get_settings(chat_id).frequency
 
+    @timed(STORAGE_SECONDS)
     async def set_response_frequency(self, chat_id: int, freq: int) -> bool:
         """Установка частоты ответа чата."""
         if not self.db:
-            logger.error(f"База данных не инициализирована для установки частоты чата {chat_id}")
-            return False
-        try:
-            await self.db.execute(
-                "UPDATE chats SET response_frequency = ? WHERE chat_id = ?",
-                (freq, chat_id)
-            )
-            await self.db.commit()
-            self.chat_settings_cache[chat_id] = self.chat_settings_cache.get(chat_id, {
-                "language": "en",
-                "intelligence": 50,
-                "frequency": 50
-            })
-            self.chat_settings_cache[chat_id]["frequency"] = freq
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка при установке частоты чата {chat_id}: {e}")
+            logger.error("База данных не инициализирована для установки частоты чата %s", chat_id)
             return False
+        async with self.write_lock:
+            try:
+                await self._upsert_setting(chat_id, "response_frequency", freq)
+                await self.db.commit()
+                self.chat_settings.setdefault(chat_id, ChatSettings()).frequency = freq
+                return True
+            except Exception as e:
+                logger.error("Ошибка при установке частоты чата %s: %s", chat_id, e)
+                return False
+
+    @timed(STORAGE_SECONDS)
+    async def get_corpus(self, chat_id: int) -> ChatCorpus:
+        """Корпус чата из общего кэша; холодный чат загружается по индексам (chat_id, id)."""
+        corpus = self.corpus.get(chat_id)
+        cache_hit("corpus", corpus is not None)
+        if corpus is not None:
+            return corpus
+        # Загрузка под блокировкой записи, чтобы не пропустить строки параллельной пачки
+        async with self.write_lock:
+            corpus = self.corpus.get(chat_id)
+            if corpus is not None:
+                return corpus
+            cursor = await self.db.execute("SELECT id FROM messages WHERE chat_id = ? ORDER BY id", (chat_id,))
+            message_ids = [row[0] for row in await cursor.fetchall()]
+            cursor = await self.db.execute("SELECT sentence_id, word_id FROM words WHERE chat_id = ? ORDER BY id", (chat_id,))
+            sentences = {}
+            for sentence_id, vocab_id in await cursor.fetchall():
+                sentences.setdefault(sentence_id, []).append(vocab_id)
+            corpus = self.corpus.load(chat_id, message_ids, sorted(sentences.items()))
+            logger.debug("Загружен корпус чата %s: %s сообщений, %s предложений, %s слов",
+                         chat_id, len(message_ids), corpus.sentence_count, corpus.word_count)
+            return corpus
 
+    def drop_cache(self, chat_id: int):
+        """Сброс корпуса чата из кэша; при следующем обращении он загрузится из базы."""
+        self.corpus.drop(chat_id)
+
+    @timed(STORAGE_SECONDS)
     async def get_random_message(self, chat_id: int) -> Tuple[Optional[str], Optional[str]]:
         """Получение случайного сообщения из базы."""
         if not self.db:
-            logger.error(f"База данных не инициализирована для получения сообщения в чате {chat_id}")
+            logger.error("База данных не инициализирована для получения сообщения в чате %s", chat_id)
             return None, None
         try:
+            corpus = await self.get_corpus(chat_id)
+            if not corpus.messages:
+                return None, None
             cursor = await self.db.execute(
-                "SELECT type, content FROM messages WHERE chat_id = ? ORDER BY RANDOM() LIMIT 1",
-                (chat_id,)
+                "SELECT type, content FROM messages WHERE id = ?",
+                (corpus.messages.choice(),)
             )
             result = await cursor.fetchone()
+            if result is None:
+                logger.warning("Корпус чата %s рассинхронизирован с базой, сбрасываем", chat_id)
+                self.corpus.drop(chat_id)
+                cursor = await self.db.execute(
+                    "SELECT type, content FROM messages WHERE chat_id = ? ORDER BY RANDOM() LIMIT 1",
+                    (chat_id,)
+                )
+                result = await cursor.fetchone()
             if result:
                 msg_type, content = result
                 return msg_type, content
             return None, None
         except Exception as e:
-            logger.error(f"Ошибка при получении случайного сообщения в чате {chat_id}: {e}")
+            logger.error("Ошибка при получении случайного сообщения в чате %s: %s", chat_id, e)
             return None, None
 
+    @timed(STORAGE_SECONDS)
     async def get_random_sentence(self, chat_id: int) -> Optional[str]:
-        """Получение случайного предложения из базы."""
+        """Получение случайного предложения чата."""
         if not self.db:
-            logger.error(f"База данных не инициализирована для получения предложения в чате {chat_id}")
+            logger.error("База данных не инициализирована для получения предложения в чате %s", chat_id)
             return None
         try:
-            cursor = await self.db.execute(
-                "SELECT content FROM sentences WHERE message_id IN (SELECT id FROM messages WHERE chat_id = ?) ORDER BY RANDOM() LIMIT 1",
-                (chat_id,)
-            )
-            result = await cursor.fetchone()
-            return result[0] if result else None
+            corpus = await self.get_corpus(chat_id)
+            return corpus.random_sentence()
         except Exception as e:
-            logger.error(f"Ошибка при получении случайного предложения в чате {chat_id}: {e}")
+            logger.error("Ошибка при получении случайного предложения в чате %s: %s", chat_id, e)
             return None
 
+    @timed(STORAGE_SECONDS)
     async def get_random_words(self, chat_id: int, count: int) -> List[str]:
-        """Получение случайных слов из базы."""
+        """Получение случайных слов чата."""
         if not self.db:
-            logger.error(f"База данных не инициализирована для получения слов в чате {chat_id}")
+            logger.error("База данных не инициализирована для получения слов в чате %s", chat_id)
             return []
         try:
-            cursor = await self.db.execute(
-                "SELECT content FROM words WHERE sentence_id IN (SELECT id FROM sentences WHERE message_id IN (SELECT id FROM messages WHERE chat_id = ?)) ORDER BY RANDOM() LIMIT ?",
-                (chat_id, count)
-            )
-            results = await cursor.fetchall()
-            return [row[0] for row in results] if results else []
+            corpus = await self.get_corpus(chat_id)
+            return corpus.random_words(count)
         except Exception as e:
-            logger.error(f"Ошибка при получении случайных слов в чате {chat_id}: {e}")
+            logger.error("Ошибка при получении случайных слов в чате %s: %s", chat_id, e)
             return []
 
+    @timed(STORAGE_SECONDS)
+    async def get_chat_title(self, chat_id: int) -> str:
+        """Название чата, сохранённое при регистрации."""
+        if not self.db:
+            logger.error("База данных не инициализирована для получения названия чата %s", chat_id)
+            return "Unknown Chat"
+        try:
+            cursor = await self.db.execute("SELECT chat_title FROM chats WHERE chat_id = ?", (chat_id,))
+            row = await cursor.fetchone()
+            return row[0] if row and row[0] else "Unknown Chat"
+        except Exception as e:
+            logger.error("Ошибка при получении названия чата %s: %s", chat_id, e)
+            return "Unknown Chat"
+
+    async def iter_messages(self, chat_id: int, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[Tuple[str, str]]]:
+        """Сообщения чата (тип, содержимое) от старых к новым пачками по batch_size.
+
+        Каждая пачка — отдельный запрос по индексу (chat_id, id) после
+        последнего прочитанного id, поэтому в памяти не больше одной пачки.
+        """
+        if not self.db:
+            logger.error("База данных не инициализирована для выгрузки чата %s", chat_id)
+            return
+        last_id = 0
+        while True:
+            cursor = await self.db.execute(
+                "SELECT id, type, content FROM messages WHERE chat_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (chat_id, last_id, batch_size)
+            )
+            rows = await cursor.fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [(msg_type, content) for _, msg_type, content in rows]
+
+    @timed(STORAGE_SECONDS)
     async def get_chats(self) -> List[int]:
         """Получение списка всех зарегистрированных чатов."""
         if not self.db:
@@ -370,28 +647,48 @@ class BotMemory:
             chats = await cursor.fetchall()
             return [chat[0] for chat in chats]
         except Exception as e:
-            logger.error(f"Ошибка при получении списка чатов: {e}")
+            logger.error("Ошибка при получении списка чатов: %s", e)
             return []
 
+    @timed(STORAGE_SECONDS)
     async def clear_chat_data(self, chat_id: int):
-        """Удаление всех данных чата из базы."""
+        """Удаление всех данных чата из базы.
+
+        Сначала записывается очередь сообщений, иначе писатель вернул бы в базу
+        сообщения, поставленные до удаления. Пачку, собранную тем временем,
+        писатель запишет уже без этого чата.
+        """
         if not self.db:
-            logger.error(f"База данных не инициализирована для удаления данных чата {chat_id}")
+            logger.error("База данных не инициализирована для удаления данных чата %s", chat_id)
             return
-        try:
-            await self.db.execute(
-                "DELETE FROM words WHERE sentence_id IN (SELECT id FROM sentences WHERE message_id IN (SELECT id FROM messages WHERE chat_id = ?))",
-                (chat_id,)
-            )
-            await self.db.execute(
-                "DELETE FROM sentences WHERE message_id IN (SELECT id FROM messages WHERE chat_id = ?)",
-                (chat_id,)
-            )
-            await self.db.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
-            await self.db.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
-            await self.db.commit()
-            if chat_id in self.chat_settings_cache:
-                del self.chat_settings_cache[chat_id]
-            logger.info(f"Все данные чата {chat_id} удалены из базы")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении данных чата {chat_id}: {e}")
\ No newline at end of file
+        await self.flush()
+        async with self.write_lock:
+            if self.writer_task and not self.writer_task.done():
+                self.cleared_chats.add(chat_id)
+            try:
+                await self.db.execute("DELETE FROM words WHERE chat_id = ?", (chat_id,))
+                await self.db.execute("DELETE FROM chat_vocab WHERE chat_id = ?", (chat_id,))
+                await self.db.execute("DELETE FROM sentences WHERE chat_id = ?", (chat_id,))
+                await self.db.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+                await self.db.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+                await self.db.commit()
+                self.chat_settings.pop(chat_id, None)
+                self.corpus.drop(chat_id)
+                self.content_hashes.drop(chat_id)
+                self.message_counts.pop(chat_id, None)
+                logger.info("Все данные чата %s удалены из базы", chat_id)
+            except Exception as e:
+                logger.error("Ошибка при удалении данных чата %s: %s", chat_id, e)
+
+
+def create_storage(backend: str) -> Storage:
+    """Хранилище по имени из STORAGE_BACKEND."""
+    if backend == "memory":
+        from storage.snapshot import SnapshotMemory
+        return SnapshotMemory(SNAPSHOT_PATH)
+    if backend != "sqlite":
+        raise ValueError(f"Неизвестное хранилище: {backend}")
+    return BotMemory()
+
+
+memory: Storage = create_storage(STORAGE_BACKEND)  # Глобальный экземпляр памяти бота
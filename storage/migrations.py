@@ -0,0 +1,220 @@
+import aiosqlite
+from typing import Awaitable, Callable, List, Tuple, Union
+from config import SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE
+from storage.dedup import content_hash
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Шаг миграции: список SQL-выражений или корутина, получающая соединение
+MigrationStep = Union[List[str], Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+async def _delete_orphans(db: aiosqlite.Connection):
+    """Удаление предложений и слов, оставшихся от вытесненных ранее сообщений."""
+    cursor = await db.execute(
+        "DELETE FROM sentences WHERE NOT EXISTS (SELECT 1 FROM messages WHERE messages.id = sentences.message_id)"
+    )
+    sentences = cursor.rowcount
+    cursor = await db.execute(
+        "DELETE FROM words WHERE NOT EXISTS (SELECT 1 FROM sentences WHERE sentences.id = words.sentence_id)"
+    )
+    logger.info("Удалено осиротевших строк: %s предложений, %s слов", sentences, cursor.rowcount)
+
+
+async def _hash_messages(db: aiosqlite.Connection):
+    """Пересборка messages: UNIQUE по полному тексту заменяется уникальным индексом (chat_id, hash)."""
+    cursor = await db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'")
+    row = await cursor.fetchone()
+    await db.execute("""
+        CREATE TABLE messages_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            type TEXT,
+            content TEXT,
+            hash INTEGER NOT NULL,
+            FOREIGN KEY(chat_id) REFERENCES chats(chat_id)
+        )
+    """)  # noqa: SQL101
+    await db.execute("CREATE UNIQUE INDEX idx_messages_chat_hash ON messages_new(chat_id, hash)")
+    cursor = await db.execute("SELECT id, chat_id, type, content FROM messages ORDER BY id")
+    copied = 0
+    while True:
+        rows = await cursor.fetchmany(5000)
+        if not rows:
+            break
+        # При совпадении 64-битных хэшей остаётся более раннее сообщение
+        await db.executemany(
+            "INSERT OR IGNORE INTO messages_new (id, chat_id, type, content, hash) VALUES (?, ?, ?, ?, ?)",
+            [(message_id, chat_id, msg_type, content, content_hash(msg_type, content))
+             for message_id, chat_id, msg_type, content in rows]
+        )
+        copied += len(rows)
+    cursor = await db.execute("SELECT COUNT(*) FROM messages_new")
+    dropped = copied - (await cursor.fetchone())[0]
+    await db.execute("DROP TABLE messages")
+    await db.execute("ALTER TABLE messages_new RENAME TO messages")
+    await db.execute("CREATE INDEX idx_messages_chat_id ON messages(chat_id, id)")
+    if row is not None:
+        # Счётчик id не должен откатиться назад, если последние сообщения удалялись
+        await db.execute("DELETE FROM sqlite_sequence WHERE name = 'messages'")
+        await db.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'messages', MAX(?, COALESCE(MAX(id), 0)) FROM messages",
+            (row[0],)
+        )
+    if dropped:
+        # Предложения и слова отброшенных сообщений удаляются, частоты слов пересчитываются
+        logger.warning("Совпадение хэшей: отброшено %s сообщений", dropped)
+        await _delete_orphans(db)
+        await db.execute("DELETE FROM chat_vocab")
+        await db.execute(
+            "INSERT INTO chat_vocab (chat_id, word_id, count) "
+            "SELECT chat_id, word_id, COUNT(*) FROM words WHERE chat_id IS NOT NULL GROUP BY chat_id, word_id"
+        )
+    logger.info("Посчитаны хэши %s сообщений", copied)
+
+
+MIGRATIONS: List[Tuple[int, str, MigrationStep]] = [
+    (1, "базовая схема", [
+        """
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            chat_title TEXT,
+            language TEXT DEFAULT 'en',
+            intelligence INTEGER DEFAULT 50,
+            response_frequency INTEGER DEFAULT 50
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            type TEXT,
+            content TEXT,
+            UNIQUE(chat_id, type, content),
+            FOREIGN KEY(chat_id) REFERENCES chats(chat_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sentences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id INTEGER,
+            content TEXT,
+            FOREIGN KEY(message_id) REFERENCES messages(id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS words (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sentence_id INTEGER,
+            content TEXT,
+            FOREIGN KEY(sentence_id) REFERENCES sentences(id)
+        )
+        """,
+    ]),
+    (2, "индексы для выборок по чатам", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_sentences_message_id ON sentences(message_id)",
+        "CREATE INDEX IF NOT EXISTS idx_words_sentence_id ON words(sentence_id)",
+    ]),
+    (3, "chat_id в предложениях и словах", [
+        "ALTER TABLE sentences ADD COLUMN chat_id INTEGER",
+        "ALTER TABLE words ADD COLUMN chat_id INTEGER",
+        "UPDATE sentences SET chat_id = (SELECT chat_id FROM messages WHERE messages.id = sentences.message_id)",
+        "UPDATE words SET chat_id = (SELECT chat_id FROM sentences WHERE sentences.id = words.sentence_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sentences_chat_id ON sentences(chat_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_words_chat_id ON words(chat_id, id)",
+    ]),
+    (4, "очистка осиротевших предложений и слов", _delete_orphans),
+    (5, "словарь и частоты слов по чатам", [
+        "CREATE TABLE vocab (id INTEGER PRIMARY KEY, text TEXT NOT NULL UNIQUE)",
+        """
+        CREATE TABLE chat_vocab (
+            chat_id INTEGER,
+            word_id INTEGER,
+            count INTEGER NOT NULL,
+            PRIMARY KEY(chat_id, word_id)
+        ) WITHOUT ROWID
+        """,
+        "INSERT INTO vocab (text) SELECT content FROM words GROUP BY content",
+        """
+        CREATE TABLE words_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sentence_id INTEGER,
+            chat_id INTEGER,
+            word_id INTEGER,
+            FOREIGN KEY(sentence_id) REFERENCES sentences(id),
+            FOREIGN KEY(word_id) REFERENCES vocab(id)
+        )
+        """,
+        "INSERT INTO words_new (id, sentence_id, chat_id, word_id) "
+        "SELECT words.id, words.sentence_id, words.chat_id, vocab.id FROM words JOIN vocab ON vocab.text = words.content",
+        "DROP TABLE words",
+        "ALTER TABLE words_new RENAME TO words",
+        "CREATE INDEX idx_words_sentence_id ON words(sentence_id)",
+        "CREATE INDEX idx_words_chat_id ON words(chat_id, id)",
+        "INSERT INTO chat_vocab (chat_id, word_id, count) "
+        "SELECT chat_id, word_id, COUNT(*) FROM words WHERE chat_id IS NOT NULL GROUP BY chat_id, word_id",
+    ]),
+    (6, "хэши сообщений вместо уникальности по тексту", _hash_messages),
+]
+
+
+async def apply_pragmas(db: aiosqlite.Connection):
+    """Настройка соединения: WAL, облегчённая синхронизация, mmap и кэш страниц."""
+    cursor = await db.execute("PRAGMA journal_mode = WAL")
+    journal_mode = (await cursor.fetchone())[0]
+    await db.execute("PRAGMA synchronous = NORMAL")
+    await db.execute(f"PRAGMA mmap_size = {int(SQLITE_MMAP_SIZE)}")
+    await db.execute(f"PRAGMA cache_size = {int(SQLITE_CACHE_SIZE)}")
+    await db.execute("PRAGMA temp_store = MEMORY")
+    logger.debug("Прагмы SQLite применены: journal_mode=%s, mmap_size=%s, cache_size=%s",
+                 journal_mode, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE)
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    """Текущая версия схемы базы данных."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)  # noqa: SQL101
+    await db.commit()
+    cursor = await db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return (await cursor.fetchone())[0]
+
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    """Применение недостающих миграций по порядку, каждая в своей транзакции."""
+    started = time.perf_counter()
+    current = await get_schema_version(db)
+    applied = 0
+    for version, name, step in MIGRATIONS:
+        if version <= current:
+            continue
+        step_started = time.perf_counter()
+        try:
+            await db.execute("BEGIN")
+            if callable(step):
+                await step(db)
+            else:
+                for sql in step:
+                    await db.execute(sql)
+            await db.execute(
+                "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                (version, name)
+            )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logger.error("Ошибка при применении миграции %s (%s)", version, name)
+            raise
+        current = version
+        applied += 1
+        logger.info("Миграция %s (%s) применена за %.1f мс",
+                    version, name, (time.perf_counter() - step_started) * 1000)
+    logger.info("Схема базы данных версии %s, применено миграций: %s, затрачено %.1f мс",
+                current, applied, (time.perf_counter() - started) * 1000)
+    return current
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![?\w.])\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def normalize_sql(sql: str) -> str:
+    """Запрос без литералов и лишних пробелов: одинаковые запросы с разными значениями сливаются."""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(...)", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+class StatementStats:
+    """Накопленная статистика одного нормализованного запроса."""
+    __slots__ = ("calls", "total", "wait", "max", "slow")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0  # Полное время в цикле событий, вместе с ожиданием потока базы
+        self.wait = 0.0  # Из него — ожидание, пока поток базы доделает предыдущие запросы
+        self.max = 0.0
+        self.slow = 0
+
+
+class _Statement:
+    """Один вызов запроса: время execute и последующих fetch складывается."""
+    __slots__ = ("key", "sql", "parameters", "elapsed", "reported")
+
+    def __init__(self, key: str, sql: str, parameters: Any):
+        self.key = key
+        self.sql = sql
+        self.parameters = parameters
+        self.elapsed = 0.0
+        self.reported = False
+
+
+class ProfiledCursor:
+    """Курсор aiosqlite, у которого время выборки строк засчитывается его запросу."""
+
+    def __init__(self, connection: "ProfiledConnection", cursor, statement: _Statement):
+        self._connection = connection
+        self._cursor = cursor
+        self._statement = statement
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+    async def fetchone(self):
+        return await self._connection._call(self._statement, self._cursor.fetchone(), first=False)
+
+    async def fetchmany(self, size: Optional[int] = None):
+        call = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        return await self._connection._call(self._statement, call, first=False)
+
+    async def fetchall(self):
+        return await self._connection._call(self._statement, self._cursor.fetchall(), first=False)
+
+
+class ProfiledConnection:
+    """Обёртка соединения aiosqlite со статистикой запросов.
+
+    Для каждого вызова замеряется полное время ожидания в цикле событий и
+    оценивается, сколько из него запрос стоял в очереди потока базы: поток
+    выполняет вызовы строго по очереди, поэтому запрос начинается не раньше,
+    чем завершился предыдущий. Статистика копится по нормализованному тексту
+    запроса. Запрос дольше slow_threshold записывается в лог вместе с планом
+    EXPLAIN QUERY PLAN (план считается один раз на нормализованный запрос).
+    План строится в отдельном потоке через своё соединение только для
+    чтения: в соединении бота в это время может быть открыта транзакция
+    миграции или пачки, и лишний запрос в ней мешает её фиксации.
+    """
+
+    def __init__(self, db, slow_threshold: float, db_path: str):
+        self.db = db
+        self.slow_threshold = slow_threshold
+        self.db_path = db_path
+        self.stats: Dict[str, StatementStats] = {}
+        self.plans: Dict[str, str] = {}
+        self.last_done: Optional[asyncio.Future] = None
+        self.explaining: Set[str] = set()
+        self.reporting: Set[asyncio.Task] = set()
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+    async def execute(self, sql: str, parameters: Any = None) -> ProfiledCursor:
+        statement = self._statement(sql, parameters)
+        call = self.db.execute(sql, parameters) if parameters is not None else self.db.execute(sql)
+        cursor = await self._call(statement, call)
+        return ProfiledCursor(self, cursor, statement)
+
+    async def executemany(self, sql: str, parameters: Any) -> ProfiledCursor:
+        parameters = list(parameters)
+        statement = self._statement(sql, parameters[0] if parameters else None)
+        cursor = await self._call(statement, self.db.executemany(sql, parameters))
+        return ProfiledCursor(self, cursor, statement)
+
+    async def commit(self):
+        await self._call(self._statement("COMMIT", None), self.db.commit())
+
+    async def rollback(self):
+        await self._call(self._statement("ROLLBACK", None), self.db.rollback())
+
+    async def close(self):
+        await self.db.close()
+
+    def _statement(self, sql: str, parameters: Any) -> _Statement:
+        return _Statement(normalize_sql(sql), sql, parameters)
+
+    async def _call(self, statement: _Statement, call, first: bool = True):
+        loop = asyncio.get_running_loop()
+        previous = self.last_done
+        done = self.last_done = loop.create_future()
+        submitted = time.perf_counter()
+        try:
+            return await call
+        finally:
+            finished = time.perf_counter()
+            done.set_result(finished)
+            # Предыдущий вызов завершился в потоке раньше нашего; пока его время
+            # неизвестно (он ещё не проснулся), считаем, что очереди не было
+            started = previous.result() if previous is not None and previous.done() else submitted
+            self._record(statement, finished - submitted, max(0.0, started - submitted), first)
+
+    def _record(self, statement: _Statement, elapsed: float, wait: float, first: bool):
+        stats = self.stats.get(statement.key)
+        if stats is None:
+            stats = self.stats[statement.key] = StatementStats()
+        if first:
+            stats.calls += 1
+        stats.total += elapsed
+        stats.wait += wait
+        statement.elapsed += elapsed
+        stats.max = max(stats.max, statement.elapsed)
+        if statement.elapsed >= self.slow_threshold and not statement.reported:
+            statement.reported = True
+            stats.slow += 1
+            task = asyncio.get_running_loop().create_task(self._report_slow(statement))
+            self.reporting.add(task)
+            task.add_done_callback(self.reporting.discard)
+
+    async def _report_slow(self, statement: _Statement):
+        plan = self.plans.get(statement.key)
+        if plan is None and statement.key not in self.explaining \
+                and statement.sql.lstrip().upper().startswith(_EXPLAINABLE):
+            self.explaining.add(statement.key)
+            try:
+                parameters = statement.parameters if statement.parameters is not None else ()
+                rows = await asyncio.to_thread(self._explain, statement.sql, parameters)
+                plan = self.plans[statement.key] = "\n".join(f"    {row[-1]}" for row in rows)
+            except Exception as e:
+                plan = f"    план недоступен: {e}"
+            finally:
+                self.explaining.discard(statement.key)
+        logger.warning("Медленный запрос: %.1f мс: %s%s",
+                       statement.elapsed * 1000, statement.key, f"\n{plan}" if plan else "")
+
+    def _explain(self, sql: str, parameters: Any) -> List[tuple]:
+        """План запроса через отдельное соединение только для чтения; вызывается в потоке."""
+        db = sqlite3.connect(f"{Path(self.db_path).resolve().as_uri()}?mode=ro", uri=True, timeout=1.0)
+        try:
+            cursor = db.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)
+            try:
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        finally:
+            db.close()
+
+    def report(self, limit: int) -> str:
+        """Топ запросов по суммарному времени."""
+        top = sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+        lines: List[str] = [f"{'всего мс':>10} {'ожид мс':>9} {'вызовов':>8} {'средн мс':>9} {'макс мс':>9} "
+                            f"{'медл':>5}  запрос"]
+        for key, stats in top:
+            lines.append(f"{stats.total * 1000:>10.1f} {stats.wait * 1000:>9.1f} {stats.calls:>8} "
+                         f"{stats.total / max(stats.calls, 1) * 1000:>9.2f} {stats.max * 1000:>9.2f} "
+                         f"{stats.slow:>5}  {key}")
+        return "\n".join(lines)
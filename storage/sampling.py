@@ -0,0 +1,49 @@
+from array import array
+from bisect import bisect_right
+from typing import Iterable, List
+import random
+
+
+class IdRing:
+    """Возрастающие идентификаторы строк чата с выборкой за O(1).
+
+    Новые строки всегда получают больший id, а вытесняются самые старые,
+    поэтому хватает массива со сдвигаемым началом вместо множества.
+    """
+    __slots__ = ("ids", "head")
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self.ids = array("q", ids)
+        self.head = 0
+
+    def __len__(self) -> int:
+        return len(self.ids) - self.head
+
+    def _accepts(self, row_id: int) -> bool:
+        # Повторы и устаревшие id (гонка с загрузкой из базы) игнорируются
+        return not (len(self.ids) > self.head and row_id <= self.ids[-1])
+
+    def append(self, row_id: int):
+        """Добавление нового id."""
+        if self._accepts(row_id):
+            self.ids.append(row_id)
+
+    def evict_upto(self, row_id: int):
+        """Вытеснение всех id, не превышающих row_id."""
+        self.head = bisect_right(self.ids, row_id, self.head)
+        if self.head and self.head * 2 >= len(self.ids):
+            self._compact()
+
+    def _compact(self):
+        del self.ids[:self.head]
+        self.head = 0
+
+    def _random_positions(self, count: int) -> List[int]:
+        return random.sample(range(self.head, len(self.ids)), min(count, len(self)))
+
+    def choice(self) -> int:
+        return self.ids[random.randrange(self.head, len(self.ids))]
+
+    def sample(self, count: int) -> List[int]:
+        return [self.ids[i] for i in self._random_positions(count)]
+
@@ -0,0 +1,20 @@
+from typing import Iterable, Dict, Tuple
+
+
+class ChatSettings:
+    """Настройки чата из таблицы chats; значения по умолчанию совпадают с DEFAULT схемы."""
+    __slots__ = ("language", "intelligence", "frequency")
+
+    def __init__(self, language: str = "en", intelligence: int = 50, frequency: int = 50):
+        self.language = language
+        self.intelligence = intelligence
+        self.frequency = frequency
+
+    def __repr__(self) -> str:
+        return (f"ChatSettings(language={self.language!r}, intelligence={self.intelligence}, "
+                f"frequency={self.frequency})")
+
+
+def load_settings(rows: Iterable[Tuple[int, str, int, int]]) -> Dict[int, ChatSettings]:
+    """Словарь настроек из строк (chat_id, language, intelligence, response_frequency)."""
+    return {chat_id: ChatSettings(lang, intel, freq) for chat_id, lang, intel, freq in rows}
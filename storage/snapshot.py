@@ -0,0 +1,369 @@
+import asyncio
+import logging
+import os
+import pickle
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from config import MAX_MESSAGES_PER_CHAT, EVICTION_BATCH_RATIO, SNAPSHOT_INTERVAL, EXPORT_BATCH_SIZE
+from storage.corpus import ChatCorpus, split_sentences
+from storage.dedup import content_hash
+from storage.settings import ChatSettings
+from storage.vocab import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 2  # Меняется вместе с форматом снимка; версия 1 ещё читается
+
+# Буферы корпуса чата и записи его сообщений в том же порядке (см. ChatCorpus.export)
+ChatState = Tuple[Any, Any, Any, Any, List[Tuple[str, str, int, int]]]
+
+
+class SnapshotMemory:
+    """Хранилище целиком в памяти с периодическими снимками на диск.
+
+    Сообщения сразу разбираются в корпус чата, без очереди записи и SQLite.
+    Раз в SNAPSHOT_INTERVAL секунд, если данные менялись, состояние
+    сериализуется pickle в отдельном потоке во временный файл и атомарно
+    заменяет прежний снимок. В цикле событий копируются только чаты,
+    изменившиеся с прошлого снимка, с передачей управления после каждого;
+    копии остальных чатов и словаря берутся из прошлых снимков. Буферы
+    корпусов сохраняются как есть, поэтому при загрузке тексты заново не
+    разбираются. Изменения после последнего снимка при аварийном
+    завершении теряются.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.chat_settings: Dict[int, ChatSettings] = {}
+        self.chat_titles: Dict[int, str] = {}
+        self.message_counts: Dict[int, int] = {}
+        self.vocab = Vocabulary()
+        self.corpora: Dict[int, ChatCorpus] = {}
+        # id сообщения -> (тип, содержимое, хэш, последний id предложения на момент добавления)
+        self.messages: Dict[int, Tuple[str, str, int, int]] = {}
+        self.hashes: Dict[int, Set[int]] = {}
+        self.last_message_id = 0
+        self.last_sentence_id = 0
+        self.dirty = False
+        self.dirty_chats: Set[int] = set()
+        self.chat_states: Dict[int, ChatState] = {}  # Копии чатов на момент их последнего снимка
+        # Словарь для снимка: неизменяемые куски слов, добавленных между снимками
+        self.vocab_chunks: List[List[Tuple[int, str]]] = []
+        self.new_words: List[Tuple[int, str]] = []
+        self.snapshot_lock = asyncio.Lock()
+        self.snapshot_task: Optional[asyncio.Task] = None
+
+    async def init_db(self) -> bool:
+        """Загрузка последнего снимка, если он есть, и запуск периодического сохранения."""
+        try:
+            started = time.perf_counter()
+            state = await asyncio.to_thread(self._read)
+            if state is not None:
+                self._restore(state)
+            self.snapshot_task = asyncio.create_task(self._snapshot_loop())
+            logger.info("Хранилище в памяти готово: %s чатов, %s сообщений, загрузка снимка %.2f с",
+                        len(self.chat_settings), len(self.messages), time.perf_counter() - started)
+            return True
+        except Exception as e:
+            logger.error("Ошибка загрузки снимка %s: %s", self.db_path, e)
+            return False
+
+    async def flush(self):
+        """Сообщения применяются сразу, ждать нечего."""
+
+    async def close_db(self):
+        """Остановка периодического сохранения и финальный снимок."""
+        if self.snapshot_task:
+            self.snapshot_task.cancel()
+            try:
+                await self.snapshot_task
+            except asyncio.CancelledError:
+                pass
+            self.snapshot_task = None
+        await self.save_snapshot()
+        logger.info("Хранилище в памяти закрыто")
+
+    # --- Снимки ---
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            await self.save_snapshot()
+
+    async def save_snapshot(self):
+        """Сохранение снимка, если данные менялись с прошлого раза."""
+        async with self.snapshot_lock:
+            if not self.dirty:
+                return
+            started = time.perf_counter()
+            self.dirty = False
+            state = await self._state()
+            try:
+                size = await asyncio.to_thread(self._write, state)
+            except Exception as e:
+                self.dirty = True
+                logger.error("Ошибка сохранения снимка %s: %s", self.db_path, e)
+                return
+            logger.debug("Снимок %s сохранён: %s байт за %.2f с", self.db_path, size, time.perf_counter() - started)
+
+    async def _state(self) -> Dict[str, Any]:
+        """Состояние для снимка; копируются только чаты, изменившиеся с прошлого раза.
+
+        Между чатами цикл событий отпускается. Чат, изменённый после своей
+        копии, снова помечается и попадёт в следующий снимок; каждый чат в
+        снимке согласован сам по себе. Счётчики id и словарь берутся после
+        копирования чатов, поэтому покрывают все id в их буферах.
+        """
+        chats, self.dirty_chats = self.dirty_chats, set()
+        for chat_id in chats:
+            corpus = self.corpora.get(chat_id)
+            if corpus is None:
+                self.chat_states.pop(chat_id, None)
+                continue
+            buffers = corpus.export()
+            self.chat_states[chat_id] = (*buffers, [self.messages[message_id] for message_id in buffers[0]])
+            await asyncio.sleep(0)
+        self._seal_vocab()
+        return {
+            "version": SNAPSHOT_VERSION,
+            "last_message_id": self.last_message_id,
+            "last_sentence_id": self.last_sentence_id,
+            "vocab": list(self.vocab_chunks),
+            "chats": {chat_id: (self.chat_titles.get(chat_id, ""), settings.language, settings.intelligence,
+                                settings.frequency)
+                      for chat_id, settings in self.chat_settings.items()},
+            "corpora": dict(self.chat_states),
+        }
+
+    def _seal_vocab(self):
+        """Перенос новых слов в куски словаря для снимка.
+
+        Соседние куски сливаются, пока предыдущий не больше последнего, поэтому
+        кусков O(log n), а каждое слово копируется O(log n) раз за всё время.
+        Слияние создаёт новый список: уже отданные в снимок куски не меняются.
+        """
+        if not self.new_words:
+            return
+        self.vocab_chunks.append(self.new_words)
+        self.new_words = []
+        while len(self.vocab_chunks) > 1 and len(self.vocab_chunks[-2]) <= len(self.vocab_chunks[-1]):
+            last = self.vocab_chunks.pop()
+            self.vocab_chunks[-1] = self.vocab_chunks[-1] + last
+
+    def _write(self, state: Dict[str, Any]) -> int:
+        temp_path = f"{self.db_path}.tmp"
+        with open(temp_path, "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.db_path)
+        return os.path.getsize(self.db_path)
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.db_path):
+            return None
+        with open(self.db_path, "rb") as file:
+            return pickle.load(file)
+
+    def _restore(self, state: Dict[str, Any]):
+        version = state.get("version")
+        if version == 1:
+            # Все сообщения лежали одним словарём, словарь слов — одним списком
+            messages = state["messages"]
+            state["corpora"] = {chat_id: (*buffers, [messages[message_id] for message_id in buffers[0]])
+                                for chat_id, buffers in state["corpora"].items()}
+            state["vocab"] = [state["vocab"]]
+        elif version != SNAPSHOT_VERSION:
+            raise ValueError(f"неподдерживаемая версия снимка {version}")
+        self.last_message_id = state["last_message_id"]
+        self.last_sentence_id = state["last_sentence_id"]
+        self.vocab_chunks = [list(chunk) for chunk in state["vocab"] if chunk]
+        self.new_words = []
+        self.vocab.load(word for chunk in self.vocab_chunks for word in chunk)
+        self.chat_settings = {}
+        self.chat_titles = {}
+        for chat_id, (title, language, intelligence, frequency) in state["chats"].items():
+            self.chat_settings[chat_id] = ChatSettings(language, intelligence, frequency)
+            self.chat_titles[chat_id] = title
+        self.messages = {}
+        self.corpora = {}
+        self.hashes = {}
+        self.message_counts = {}
+        # Буферы снимка остаются копией для следующих снимков, корпус получает свои
+        self.chat_states = state["corpora"]
+        self.dirty_chats = set()
+        for chat_id, (message_ids, sentence_ids, sentence_starts, word_ids, entries) in self.chat_states.items():
+            corpus = self.corpora[chat_id] = ChatCorpus.restore(
+                self.vocab, message_ids[:], sentence_ids[:], sentence_starts[:], word_ids[:]
+            )
+            self.message_counts[chat_id] = len(corpus.messages)
+            self.messages.update(zip(message_ids, entries))
+            self.hashes[chat_id] = {entry[2] for entry in entries}
+
+    # --- Чаты и настройки ---
+
+    async def add_chat(self, chat_id: int, chat_title: str) -> bool:
+        """Добавление нового чата."""
+        if chat_id not in self.chat_settings:
+            self.chat_settings[chat_id] = ChatSettings()
+            self.chat_titles[chat_id] = chat_title
+            self.dirty = True
+        return True
+
+    async def ensure_chat(self, chat_id: int, chat_title: str) -> Optional[ChatSettings]:
+        """Настройки чата; неизвестный чат сначала регистрируется."""
+        settings = self.chat_settings.get(chat_id)
+        if settings is None:
+            await self.add_chat(chat_id, chat_title)
+            logger.info("Чат %s зарегистрирован: %s", chat_id, chat_title)
+            settings = self.chat_settings[chat_id]
+        return settings
+
+    def get_settings(self, chat_id: int) -> ChatSettings:
+        """Настройки чата; для неизвестного чата — значения по умолчанию."""
+        settings = self.chat_settings.get(chat_id)
+        return settings if settings is not None else ChatSettings()
+
+    def _settings_for_update(self, chat_id: int) -> ChatSettings:
+        self.dirty = True
+        settings = self.chat_settings.get(chat_id)
+        if settings is None:
+            settings = self.chat_settings[chat_id] = ChatSettings()
+            self.chat_titles[chat_id] = "Unknown Chat"
+        return settings
+
+    async def get_chats(self) -> List[int]:
+        """Список всех зарегистрированных чатов."""
+        return list(self.chat_settings)
+
+    async def get_chat_title(self, chat_id: int) -> str:
+        return self.chat_titles.get(chat_id) or "Unknown Chat"
+
+    async def get_language(self, chat_id: int) -> str:
+        return self.get_settings(chat_id).language
+
+    async def set_language(self, chat_id: int, lang: str) -> bool:
+        self._settings_for_update(chat_id).language = lang
+        return True
+
+    async def get_intelligence(self, chat_id: int) -> int:
+        return self.get_settings(chat_id).intelligence
+
+    async def set_intelligence(self, chat_id: int, level: int) -> bool:
+        self._settings_for_update(chat_id).intelligence = level
+        return True
+
+    async def get_response_frequency(self, chat_id: int) -> int:
+        return self.get_settings(chat_id).frequency
+
+    async def set_response_frequency(self, chat_id: int, freq: int) -> bool:
+        self._settings_for_update(chat_id).frequency = freq
+        return True
+
+    # --- Сообщения ---
+
+    async def enqueue_message(self, chat_id: int, msg_type: str, content: str) -> bool:
+        """Очереди нет: сообщение сразу попадает в корпус чата."""
+        return await self.add_message(chat_id, msg_type, content)
+
+    async def add_message(self, chat_id: int, msg_type: str, content: str) -> bool:
+        """Добавление сообщения с разбиением текста на предложения и слова; дубликат отбрасывается."""
+        value = content_hash(msg_type, content)
+        hashes = self.hashes.setdefault(chat_id, set())
+        if value in hashes:
+            logger.debug("Дубликат сообщения в чате %s отброшен", chat_id)
+            return False
+        corpus = self.corpora.get(chat_id)
+        if corpus is None:
+            corpus = self.corpora[chat_id] = ChatCorpus(self.vocab)
+        if msg_type == "text":
+            for sentence in split_sentences(content):
+                word_ids = []
+                for word in sentence.split():
+                    vocab_id = self.vocab.lookup(word)
+                    if vocab_id is None:
+                        vocab_id = self.vocab.max_id + 1
+                        self.vocab.register(((vocab_id, word),))
+                        self.new_words.append((vocab_id, word))
+                    word_ids.append(vocab_id)
+                self.last_sentence_id += 1
+                corpus.add_sentence(self.last_sentence_id, word_ids)
+        self.last_message_id += 1
+        corpus.messages.append(self.last_message_id)
+        # id предложений растут глобально, поэтому все предложения чата вплоть до
+        # этого сообщения не превышают текущий last_sentence_id
+        self.messages[self.last_message_id] = (msg_type, content, value, self.last_sentence_id)
+        hashes.add(value)
+        self.message_counts[chat_id] = self.message_counts.get(chat_id, 0) + 1
+        if self.message_counts[chat_id] > MAX_MESSAGES_PER_CHAT:
+            self._evict_overflow(chat_id, corpus)
+        self.dirty = True
+        self.dirty_chats.add(chat_id)
+        return True
+
+    def _evict_overflow(self, chat_id: int, corpus: ChatCorpus):
+        """Вытеснение старых сообщений чата сразу на долю EVICTION_BATCH_RATIO от лимита."""
+        target = max(0, MAX_MESSAGES_PER_CHAT - int(MAX_MESSAGES_PER_CHAT * EVICTION_BATCH_RATIO))
+        ring = corpus.messages
+        gone = ring.ids[ring.head:ring.head + len(ring) - target]
+        last_id = gone[-1]
+        corpus.evict(last_id, self.messages[last_id][3])
+        hashes = self.hashes[chat_id]
+        for message_id in gone:
+            hashes.discard(self.messages.pop(message_id)[2])
+        self.message_counts[chat_id] -= len(gone)
+        logger.info("Удалено %s старых сообщений в чате %s из-за превышения лимита %s",
+                    len(gone), chat_id, MAX_MESSAGES_PER_CHAT)
+
+    async def message_exists(self, chat_id: int, msg_type: str, content: str) -> bool:
+        return content_hash(msg_type, content) in self.hashes.get(chat_id, ())
+
+    # --- Выборка ---
+
+    async def get_corpus(self, chat_id: int) -> ChatCorpus:
+        corpus = self.corpora.get(chat_id)
+        return corpus if corpus is not None else ChatCorpus(self.vocab)
+
+    def drop_cache(self, chat_id: int):
+        """Корпус здесь и есть данные чата, сбрасывать нечего."""
+
+    async def iter_messages(self, chat_id: int, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[Tuple[str, str]]]:
+        """Сообщения чата (тип, содержимое) от старых к новым пачками по batch_size."""
+        corpus = self.corpora.get(chat_id)
+        if corpus is None:
+            return
+        ring = corpus.messages
+        message_ids = ring.ids[ring.head:ring.head + len(ring)].tolist()  # Копия: между пачками чат может меняться
+        for start in range(0, len(message_ids), batch_size):
+            batch = [self.messages.get(message_id) for message_id in message_ids[start:start + batch_size]]
+            yield [(entry[0], entry[1]) for entry in batch if entry is not None]
+
+    async def get_random_message(self, chat_id: int) -> Tuple[Optional[str], Optional[str]]:
+        corpus = self.corpora.get(chat_id)
+        if corpus is None or not corpus.messages:
+            return None, None
+        msg_type, content, _, _ = self.messages[corpus.messages.choice()]
+        return msg_type, content
+
+    async def get_random_sentence(self, chat_id: int) -> Optional[str]:
+        return (await self.get_corpus(chat_id)).random_sentence()
+
+    async def get_random_words(self, chat_id: int, count: int) -> List[str]:
+        return (await self.get_corpus(chat_id)).random_words(count)
+
+    # --- Очистка ---
+
+    async def clear_chat_data(self, chat_id: int):
+        """Удаление всех данных чата."""
+        corpus = self.corpora.pop(chat_id, None)
+        if corpus is not None:
+            ring = corpus.messages
+            for message_id in ring.ids[ring.head:]:
+                self.messages.pop(message_id, None)
+        self.chat_settings.pop(chat_id, None)
+        self.chat_titles.pop(chat_id, None)
+        self.hashes.pop(chat_id, None)
+        self.message_counts.pop(chat_id, None)
+        self.dirty = True
+        self.dirty_chats.add(chat_id)
+        logger.info("Все данные чата %s удалены", chat_id)
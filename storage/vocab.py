@@ -0,0 +1,39 @@
+from typing import Dict, Iterable, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Vocabulary:
+    """Интернированный словарь: каждое слово хранится в памяти один раз.
+
+    Отражает таблицу vocab. Новые слова получают id в транзакции пачки и
+    регистрируются здесь только после её фиксации.
+    """
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.texts: Dict[int, str] = {}
+        self.max_id = 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def load(self, rows: Iterable[Tuple[int, str]]):
+        self.ids.clear()
+        self.texts.clear()
+        self.register(rows)
+        logger.debug("Загружен словарь: %s слов", len(self.ids))
+
+    def register(self, rows: Iterable[Tuple[int, str]]):
+        for word_id, text in rows:
+            self.ids[text] = word_id
+            self.texts[word_id] = text
+            if word_id > self.max_id:
+                self.max_id = word_id
+
+    def lookup(self, text: str) -> Optional[int]:
+        return self.ids.get(text)
+
+    def text(self, word_id: int) -> str:
+        return self.texts[word_id]
@@ -0,0 +1,166 @@
+"""Резервные копии баз бота, выгрузка чатов в сжатый JSONL и восстановление.
+
+Команды:
+  backup [--dir DIR]          онлайн-копия каждой базы SQLite; бот может работать
+  restore-db COPY [--db PATH] замена базы копией; бот должен быть остановлен
+  export OUT.jsonl.gz         выгрузка настроек и сообщений чатов (--chat-id для отдельных чатов)
+  restore IN.jsonl.gz         загрузка выгрузки; бот должен быть остановлен
+
+Копия снимается через backup API SQLite шагами по BACKUP_PAGES страниц,
+источник держит читающую транзакцию, поэтому запись бота не прерывает
+копирование. Выгрузка читает сообщения пачками по EXPORT_BATCH_SIZE и не
+зависит от размера базы по памяти; при STORAGE_BACKEND = "sqlite" её тоже
+можно снимать с работающего бота. Восстановление раскладывает чаты по базам
+обработчиков при SHARDS > 1 и пишет через очередь хранилища, так что повторы
+и лимит MAX_MESSAGES_PER_CHAT учитываются как при обычной работе.
+
+Запуск из корня репозитория: python -m tools.backup backup
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import BACKUP_DIR, BACKUP_KEEP, SHARDS, STORAGE_BACKEND  # noqa: E402
+from storage.backend import Storage  # noqa: E402
+from storage.backup import (backup_database, backup_name, export_chats, prune_backups,  # noqa: E402
+                            restore_chats, restore_database)
+from storage.memory import create_storage  # noqa: E402
+from utils.sharding import shard_db_path, shard_for  # noqa: E402
+
+SINGLE_DB_PATH = "uglyok.db"  # База бота без шардирования (SHARDS = 1)
+
+
+def db_paths(db_path: str) -> List[str]:
+    """Базы бота: --db, база каждого обработчика или единственная база."""
+    if db_path:
+        return [db_path]
+    if SHARDS > 1:
+        return [shard_db_path(index, SHARDS) for index in range(SHARDS)]
+    return [SINGLE_DB_PATH]
+
+
+class Storages:
+    """Открытые хранилища по номеру шарда."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.storages: Dict[int, Storage] = {}
+
+    async def open(self, index: int) -> Storage:
+        storage = self.storages.get(index)
+        if storage is None:
+            storage = create_storage(STORAGE_BACKEND)
+            if self.db_path:
+                storage.db_path = self.db_path
+            elif SHARDS > 1:
+                storage.db_path = shard_db_path(index, SHARDS)
+            if not await storage.init_db():
+                raise RuntimeError(f"не удалось открыть хранилище {storage.db_path}")
+            self.storages[index] = storage
+        return storage
+
+    async def open_all(self) -> List[Storage]:
+        return [await self.open(index) for index in range(1 if self.db_path else SHARDS)]
+
+    async def for_chat(self, chat_id: int) -> Storage:
+        return await self.open(shard_for(chat_id, SHARDS) if SHARDS > 1 and not self.db_path else 0)
+
+    async def close(self):
+        for storage in self.storages.values():
+            await storage.close_db()
+
+
+def backup_command(args: argparse.Namespace):
+    os.makedirs(args.dir, exist_ok=True)
+    for path in db_paths(args.db):
+        if not os.path.exists(path):
+            sys.exit(f"Нет базы {path}")
+        target = backup_name(path, args.dir)
+        started = time.perf_counter()
+        size = backup_database(path, target)
+        removed = prune_backups(path, args.dir, args.keep)
+        print(f"{path} -> {target}: {size} байт за {time.perf_counter() - started:.2f} с, "
+              f"удалено старых копий: {len(removed)}")
+
+
+def restore_db_command(args: argparse.Namespace):
+    target = args.db or SINGLE_DB_PATH
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(target + suffix) and os.path.getsize(target + suffix) > 0:
+            print(f"Внимание: у {target} есть непустой {target + suffix}; убедитесь, что бот остановлен")
+    started = time.perf_counter()
+    restore_database(args.copy, target)
+    print(f"{args.copy} -> {target} за {time.perf_counter() - started:.2f} с")
+
+
+async def export_command(args: argparse.Namespace):
+    storages = Storages(args.db)
+    started = time.perf_counter()
+    try:
+        totals = await export_chats(await storages.open_all(), args.out, args.chat_id)
+    finally:
+        await storages.close()
+    print(f"Готово за {time.perf_counter() - started:.2f} с: выгружено {totals['messages']} сообщений "
+          f"из {totals['chats']} чатов в {args.out}")
+
+
+async def restore_command(args: argparse.Namespace):
+    storages = Storages(args.db)
+    started = time.perf_counter()
+    try:
+        totals = await restore_chats(storages.for_chat, args.path)
+    finally:
+        await storages.close()
+    print(f"Готово за {time.perf_counter() - started:.2f} с: загружено {totals['messages']} сообщений "
+          f"в {totals['chats']} чатов")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backup = commands.add_parser("backup", help="онлайн-копия баз SQLite")
+    backup.add_argument("--dir", default=BACKUP_DIR, help="каталог копий")
+    backup.add_argument("--keep", type=int, default=BACKUP_KEEP, help="сколько последних копий хранить")
+
+    restore_db = commands.add_parser("restore-db", help="замена базы копией (бот остановлен)")
+    restore_db.add_argument("copy", help="файл копии")
+
+    export = commands.add_parser("export", help="выгрузка чатов в JSONL.gz")
+    export.add_argument("out", help="файл выгрузки")
+    export.add_argument("--chat-id", type=int, action="append", help="выгрузить только этот чат; можно повторять")
+
+    restore = commands.add_parser("restore", help="загрузка выгрузки JSONL.gz (бот остановлен)")
+    restore.add_argument("path", help="файл выгрузки")
+
+    for command in (backup, export, restore):
+        command.add_argument("--db", help="файл хранилища вместо стандартного (только при SHARDS = 1)")
+    restore_db.add_argument("--db", help="заменяемая база (при SHARDS > 1 обязательно)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.command == "restore-db":
+        if SHARDS > 1 and not args.db:
+            parser.error("при SHARDS > 1 укажите в --db базу обработчика, которую заменяет копия")
+    elif args.db and SHARDS > 1:
+        parser.error("--db несовместим с SHARDS > 1: чаты раскладываются по базам обработчиков")
+    if args.command in ("backup", "restore-db") and STORAGE_BACKEND != "sqlite":
+        sys.exit("Копии баз поддерживаются только для хранилища SQLite (STORAGE_BACKEND = \"sqlite\")")
+
+    if args.command == "backup":
+        backup_command(args)
+    elif args.command == "restore-db":
+        restore_db_command(args)
+    elif args.command == "export":
+        asyncio.run(export_command(args))
+    else:
+        asyncio.run(restore_command(args))
+
+
+if __name__ == "__main__":
+    main()
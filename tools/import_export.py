@@ -0,0 +1,284 @@
+"""Офлайн-импорт истории чатов из экспорта Telegram Desktop (result.json) в память бота.
+
+Бот должен быть остановлен. Файл читается потоково: метаданные чатов
+обходятся по структуре, а каждое сообщение разбирается отдельно через
+JSONDecoder.raw_decode, поэтому память не зависит от размера экспорта.
+Поддерживаются экспорт одного чата и экспорт всего аккаунта (chats.list);
+в последнем импортируются только группы и супергруппы.
+
+Из каждого чата берутся текстовые сообщения: повторы отбрасываются, а
+сохраняются самые новые, сколько помещается в MAX_MESSAGES_PER_CHAT вместе
+с уже накопленными ботом. Стикеры не импортируются: в экспорте вместо
+file_id лежит путь к файлу. Запись идёт через очередь хранилища бота:
+пачками по INGEST_BATCH_SIZE, одна транзакция на пачку, с разбиением на
+предложения и слова. При SHARDS > 1 чат попадает в базу своего обработчика.
+
+Запуск из корня репозитория: python -m tools.import_export result.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, TextIO, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import MAX_MESSAGES_PER_CHAT, SHARDS, STORAGE_BACKEND  # noqa: E402
+from storage.backend import Storage  # noqa: E402
+from storage.dedup import content_hash  # noqa: E402
+from storage.memory import create_storage  # noqa: E402
+from utils.sharding import shard_db_path, shard_for  # noqa: E402
+
+READ_CHUNK_SIZE = 1024 * 1024  # Символов, дочитываемых из файла за раз
+SUPERGROUP_ID_OFFSET = 10 ** 12  # Bot API: id супергруппы = -100<id из экспорта>
+GROUP_TYPES = ("private_group",)
+SUPERGROUP_TYPES = ("private_supergroup", "public_supergroup")
+SKIPPED_SECTIONS = ("left_chats",)  # Чаты, из которых владелец экспорта вышел
+
+_WHITESPACE = re.compile(r"\s*")
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+class ExportReader:
+    """Потоковый обход JSON экспорта.
+
+    Выдаёт события ("chat", поля чата) перед массивом messages,
+    ("message", сообщение) на каждый его элемент и ("end", поля чата) после
+    него. Скалярные поля объекта, встреченные до messages (name, type, id),
+    попадают в поля чата. Вложенные объекты и массивы обходятся по
+    структуре, целиком разбираются только сообщения и скалярные значения.
+    Разделы SKIPPED_SECTIONS обходятся без событий.
+    """
+
+    def __init__(self, file: TextIO, chunk_size: int = READ_CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Дочитывание файла; разобранное начало буфера отбрасывается."""
+        if self.eof:
+            return False
+        data = self.file.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Следующий значащий символ без его потребления."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("неожиданный конец файла")
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(f"ожидался один из символов {chars!r}, а не {char!r}")
+        self.pos += 1
+        return char
+
+    def _value(self) -> Any:
+        """Одно значение целиком; при обрыве на границе буфера файл дочитывается."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # Число в самом конце буфера могло оборваться на середине
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def events(self) -> Iterator[Event]:
+        if self._peek() != "{":
+            raise ValueError("экспорт должен быть JSON-объектом")
+        yield from self._object({})
+
+    def _object(self, fields: Dict[str, Any], skip: bool = False) -> Iterator[Event]:
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            char = self._peek()
+            nested_skip = skip or key in SKIPPED_SECTIONS
+            if key == "messages" and char == "[":
+                if not skip:
+                    yield "chat", fields
+                yield from self._array(skip, messages=True)
+                if not skip:
+                    yield "end", fields
+            elif char == "{":
+                yield from self._object({}, nested_skip)
+            elif char == "[":
+                yield from self._array(nested_skip)
+            else:
+                fields[key] = self._value()
+            if self._expect(",}") == "}":
+                return
+
+    def _array(self, skip: bool = False, messages: bool = False) -> Iterator[Event]:
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            char = self._peek()
+            if messages:
+                message = self._value()
+                if not skip:
+                    yield "message", message
+            elif char == "{":
+                yield from self._object({}, skip)
+            elif char == "[":
+                yield from self._array(skip)
+            else:
+                self._value()
+            if self._expect(",]") == "]":
+                return
+
+
+def bot_chat_id(fields: Dict[str, Any]) -> Optional[int]:
+    """chat_id в Bot API по полям чата из экспорта; None — не группа."""
+    chat_type = fields.get("type")
+    export_id = fields.get("id")
+    if not isinstance(export_id, int):
+        return None
+    if chat_type in SUPERGROUP_TYPES:
+        return -(SUPERGROUP_ID_OFFSET + export_id)
+    if chat_type in GROUP_TYPES:
+        return -export_id
+    return None
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    """Текст сообщения; в экспорте форматированный текст — список строк и фрагментов."""
+    if message.get("type") != "message":
+        return ""
+    text = message.get("text")
+    if isinstance(text, list):
+        text = "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    return text.strip() if isinstance(text, str) else ""
+
+
+class Importer:
+    """Отбор новейших сообщений каждого чата и запись их в хранилища бота."""
+
+    def __init__(self, chat_id: Optional[int], db_path: Optional[str]):
+        self.chat_id = chat_id
+        self.db_path = db_path
+        self.storages: Dict[int, Storage] = {}
+        self.read = 0
+        self.imported = 0
+        self.chats = 0
+
+    async def storage_for(self, chat_id: int) -> Storage:
+        index = shard_for(chat_id, SHARDS) if SHARDS > 1 else 0
+        storage = self.storages.get(index)
+        if storage is None:
+            storage = create_storage(STORAGE_BACKEND)
+            if SHARDS > 1:
+                storage.db_path = shard_db_path(index, SHARDS)
+            elif self.db_path:
+                storage.db_path = self.db_path
+            if not await storage.init_db():
+                raise RuntimeError(f"не удалось открыть хранилище {storage.db_path}")
+            self.storages[index] = storage
+        return storage
+
+    async def run(self, path: str):
+        target: Optional[int] = None
+        retained: "OrderedDict[int, str]" = OrderedDict()  # хэш -> текст, от старых к новым
+        room = 0
+        with open(path, encoding="utf-8") as file:
+            for event, data in ExportReader(file).events():
+                if event == "message":
+                    if target is None:
+                        continue
+                    self.read += 1
+                    text = message_text(data)
+                    if not text:
+                        continue
+                    value = content_hash("text", text)
+                    if value in retained:
+                        retained.move_to_end(value)  # Повтор считается по последнему появлению
+                        continue
+                    retained[value] = text
+                    if len(retained) > room:
+                        retained.popitem(last=False)
+                elif event == "chat":
+                    target = self.chat_id if self.chat_id is not None else bot_chat_id(data)
+                    if target is None:
+                        print(f"Пропущен чат «{data.get('name')}» ({data.get('type')}): не группа")
+                        continue
+                    storage = await self.storage_for(target)
+                    await storage.ensure_chat(target, data.get("name") or "Imported Chat")
+                    room = max(0, MAX_MESSAGES_PER_CHAT - storage.message_counts.get(target, 0))
+                    retained.clear()
+                elif event == "end" and target is not None:
+                    await self.write_chat(target, retained, data.get("name"))
+                    target = None
+
+    async def write_chat(self, chat_id: int, retained: "OrderedDict[int, str]", name: Optional[str]):
+        storage = await self.storage_for(chat_id)
+        before = storage.message_counts.get(chat_id, 0)
+        for text in retained.values():
+            await storage.enqueue_message(chat_id, "text", text)
+        await storage.flush()
+        added = storage.message_counts.get(chat_id, 0) - before
+        self.imported += added
+        self.chats += 1
+        print(f"Чат «{name}» ({chat_id}): импортировано {added} сообщений")
+        retained.clear()
+
+    async def close(self):
+        for storage in self.storages.values():
+            await storage.close_db()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("export", help="result.json из экспорта Telegram Desktop")
+    parser.add_argument("--chat-id", type=int, help="chat_id группы в Bot API, если экспорт одного чата "
+                                                    "нужно записать под другим id")
+    parser.add_argument("--db", help="файл хранилища вместо стандартного (только при SHARDS = 1)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.db and SHARDS > 1:
+        parser.error("--db несовместим с SHARDS > 1: чаты раскладываются по базам обработчиков")
+
+    importer = Importer(args.chat_id, args.db)
+    started = time.perf_counter()
+    try:
+        await importer.run(args.export)
+    finally:
+        await importer.close()
+    elapsed = time.perf_counter() - started
+    print(f"Готово за {elapsed:.2f} с: прочитано {importer.read} сообщений "
+          f"({importer.read / max(elapsed, 1e-9) * 60:,.0f} в минуту), "
+          f"импортировано {importer.imported} в {importer.chats} чатов")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+"""Офлайн-перераскладка баз при смене числа процессов-обработчиков (SHARDS).
+
+Бот должен быть остановлен. Чаты из баз старой раскладки переносятся в базы
+новой по тому же хэшу chat_id, что и у входного процесса. id сообщений,
+предложений и слов сдвигаются, чтобы не пересекаться между источниками;
+слова переводятся на словарь целевой базы по тексту. Чат целиком лежит в
+одном источнике, поэтому его id в целевой базе остаются возрастающими.
+Исходные базы не меняются и не удаляются.
+
+Запуск из корня репозитория: python -m tools.rebalance_shards --from 1 --to 4
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite  # noqa: E402
+
+from config import STORAGE_BACKEND  # noqa: E402
+from storage.migrations import apply_pragmas, migrate  # noqa: E402
+from utils.sharding import shard_db_path, shard_for  # noqa: E402
+
+SINGLE_DB_PATH = "uglyok.db"  # База бота без шардирования (SHARDS = 1)
+
+# Строки каждого источника копируются в порядке id, со сдвигом на максимум в целевой базе
+COPY_QUERIES = (
+    ("chats", """
+        INSERT INTO chats (chat_id, chat_title, language, intelligence, response_frequency)
+        SELECT chat_id, chat_title, language, intelligence, response_frequency
+        FROM src.chats WHERE target_shard(chat_id)
+        ON CONFLICT(chat_id) DO NOTHING
+    """),
+    ("messages", """
+        INSERT INTO messages (id, chat_id, type, content, hash)
+        SELECT id + :messages, chat_id, type, content, hash
+        FROM src.messages WHERE target_shard(chat_id) ORDER BY id
+    """),
+    ("sentences", """
+        INSERT INTO sentences (id, message_id, content, chat_id)
+        SELECT id + :sentences, message_id + :messages, content, chat_id
+        FROM src.sentences WHERE target_shard(chat_id) ORDER BY id
+    """),
+    ("vocab", """
+        INSERT OR IGNORE INTO vocab (text)
+        SELECT sv.text FROM src.vocab sv
+        WHERE sv.id IN (SELECT word_id FROM src.words WHERE target_shard(chat_id))
+        ORDER BY sv.id
+    """),
+    ("words", """
+        INSERT INTO words (id, sentence_id, chat_id, word_id)
+        SELECT w.id + :words, w.sentence_id + :sentences, w.chat_id, tv.id
+        FROM src.words w
+        JOIN src.vocab sv ON sv.id = w.word_id
+        JOIN main.vocab tv ON tv.text = sv.text
+        WHERE target_shard(w.chat_id) ORDER BY w.id
+    """),
+    ("chat_vocab", """
+        INSERT INTO chat_vocab (chat_id, word_id, count)
+        SELECT cv.chat_id, tv.id, cv.count
+        FROM src.chat_vocab cv
+        JOIN src.vocab sv ON sv.id = cv.word_id
+        JOIN main.vocab tv ON tv.text = sv.text
+        WHERE target_shard(cv.chat_id)
+    """),
+)
+
+
+def db_path(index: int, count: int) -> str:
+    return SINGLE_DB_PATH if count == 1 else shard_db_path(index, count)
+
+
+async def max_ids(db: aiosqlite.Connection) -> dict:
+    offsets = {}
+    for table in ("messages", "sentences", "words"):
+        cursor = await db.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")  # noqa: SQL101
+        offsets[table] = (await cursor.fetchone())[0]
+    return offsets
+
+
+async def build_target(index: int, count: int, sources: list) -> dict:
+    """Сборка одной целевой базы из всех источников; число скопированных строк по таблицам."""
+    copied = {name: 0 for name, _ in COPY_QUERIES}
+    async with aiosqlite.connect(db_path(index, count)) as db:
+        await apply_pragmas(db)
+        await migrate(db)
+        await db.create_function("target_shard", 1, lambda chat_id: shard_for(chat_id, count) == index,
+                                 deterministic=True)
+        for source in sources:
+            await db.execute("ATTACH DATABASE ? AS src", (source,))
+            try:
+                await db.execute("BEGIN")
+                offsets = await max_ids(db)
+                for name, sql in COPY_QUERIES:
+                    cursor = await db.execute(sql, offsets)
+                    copied[name] += cursor.rowcount
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+            finally:
+                await db.execute("DETACH DATABASE src")
+    return copied
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--from", dest="source_count", type=int, required=True, help="текущее число шардов")
+    parser.add_argument("--to", dest="target_count", type=int, required=True, help="новое число шардов")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.source_count < 1 or args.target_count < 1 or args.source_count == args.target_count:
+        parser.error("число шардов должно быть положительным и отличаться от текущего")
+    if STORAGE_BACKEND != "sqlite":
+        sys.exit("Перераскладка поддерживает только хранилище SQLite (STORAGE_BACKEND = \"sqlite\")")
+
+    sources = [db_path(index, args.source_count) for index in range(args.source_count)]
+    missing = [path for path in sources if not os.path.exists(path)]
+    if missing:
+        sys.exit(f"Нет исходных баз: {', '.join(missing)}")
+    targets = [db_path(index, args.target_count) for index in range(args.target_count)]
+    existing = [path for path in targets if os.path.exists(path)]
+    if existing:
+        sys.exit(f"Целевые базы уже существуют: {', '.join(existing)}")
+
+    # Источники обновляются до текущей схемы, как это сделал бы бот при запуске
+    for source in sources:
+        async with aiosqlite.connect(source) as db:
+            await migrate(db)
+
+    started = time.perf_counter()
+    for index, target in enumerate(targets):
+        copied = await build_target(index, args.target_count, sources)
+        print(f"{target}: " + ", ".join(f"{name} {rows}" for name, rows in copied.items()))
+    print(f"Готово за {time.perf_counter() - started:.2f} с. Исходные базы оставлены на месте, "
+          f"после проверки их можно удалить и запустить бота с SHARDS = {args.target_count}.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,33 +1,143 @@
 from aiogram import Bot
-from aiogram.types import ChatMemberAdministrator, ChatMemberOwner
-from typing import Dict, List
+from aiogram.types import ChatMemberAdministrator, ChatMemberOwner, ReactionTypeEmoji
+from collections import OrderedDict
+from config import (ADMIN_CACHE_TTL, ADMIN_CACHE_MAX_CHATS, REACTIONS_CACHE_TTL, REACTIONS_NEGATIVE_TTL,
+                    REACTIONS_CACHE_MAX_CHATS)
+from typing import Dict, FrozenSet, List, Optional, Tuple
+from utils.metrics import cache_hit
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+class AdminCache:
+    """Администраторы чатов, загружаемые списком через get_chat_administrators.
+
+    Запись живёт ttl секунд и сбрасывается при апдейтах chat_member чата.
+    Хранится не больше max_size чатов, давно не спрошенные вытесняются первыми.
+    Если списка нет (личный чат, нет прав), это тоже запоминается на ttl, а
+    пользователи проверяются по одному через get_chat_member с запоминанием
+    ответа в той же записи.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        # chat_id -> (срок, администраторы или None без списка, проверенные по одному пользователи)
+        self.admins: "OrderedDict[int, Tuple[float, Optional[FrozenSet[int]], Dict[int, bool]]]" = OrderedDict()
+
+    def invalidate(self, chat_id: int):
+        if self.admins.pop(chat_id, None) is not None:
+            logger.debug("Кэш администраторов чата %s сброшен", chat_id)
+
+    async def is_admin(self, bot: Bot, chat_id: int, user_id: int) -> bool:
+        entry = self.admins.get(chat_id)
+        now = time.monotonic()
+        if entry is not None:
+            if entry[0] > now:
+                self.admins.move_to_end(chat_id)
+            else:
+                del self.admins[chat_id]
+                entry = None
+        if entry is None:
+            entry = await self._load(bot, chat_id, now)
+        else:
+            cache_hit("admins", True)
+        _, admins, members = entry
+        if admins is not None:
+            return user_id in admins
+        known = members.get(user_id)
+        cache_hit("admin_members", known is not None)
+        if known is not None:
+            return known
+        # Ошибку здесь не запоминаем: она может быть временной
+        member = await bot.get_chat_member(chat_id, user_id)
+        members[user_id] = isinstance(member, (ChatMemberAdministrator, ChatMemberOwner))
+        return members[user_id]
+
+    async def _load(self, bot: Bot, chat_id: int,
+                    now: float) -> Tuple[float, Optional[FrozenSet[int]], Dict[int, bool]]:
+        cache_hit("admins", False)
+        try:
+            members = await bot.get_chat_administrators(chat_id)
+            admins: Optional[FrozenSet[int]] = frozenset(
+                member.user.id for member in members if isinstance(member, (ChatMemberAdministrator, ChatMemberOwner))
+            )
+            logger.debug("Загружены администраторы чата %s: %s", chat_id, len(admins))
+        except Exception as e:
+            # Например, в личных чатах списка администраторов нет
+            admins = None
+            logger.debug("Список администраторов чата %s недоступен: %s", chat_id, e)
+        entry = self.admins[chat_id] = (now + self.ttl, admins, {})
+        self.admins.move_to_end(chat_id)
+        while len(self.admins) > self.max_size:
+            self.admins.popitem(last=False)
+        return entry
+
+admin_cache = AdminCache(ADMIN_CACHE_TTL, ADMIN_CACHE_MAX_CHATS)
+
 async def is_admin(bot: Bot, chat_id: int, user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором чата."""
     try:
-        member = await bot.get_chat_member(chat_id, user_id)
-        return isinstance(member, (ChatMemberAdministrator, ChatMemberOwner))
+        return await admin_cache.is_admin(bot, chat_id, user_id)
     except Exception as e:
-        logger.error(f"Ошибка проверки админа в чате {chat_id}: {e}")
+        logger.error("Ошибка проверки админа в чате %s: %s", chat_id, e)
         return False
 
-async def get_available_reactions(bot: Bot, chat_id: int, cache: Dict[int, List[str]]) -> List[str]:
+# Реакции, которые ставим, когда в чате разрешены все стандартные эмодзи
+DEFAULT_REACTIONS = ["👍", "👎", "😂", "😮", "😢"]
+
+class ReactionsCache:
+    """Доступные реакции чатов из available_reactions с отдельным TTL для пустых ответов.
+
+    Пустой список (реакции выключены, чат не группа, ошибка API) тоже
+    кэшируется, чтобы не обращаться к Bot API на каждое сообщение. Как и
+    в AdminCache, хранится не больше max_size чатов.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.reactions: "OrderedDict[int, Tuple[float, List[str]]]" = OrderedDict()
+
+    def invalidate(self, chat_id: int):
+        if self.reactions.pop(chat_id, None) is not None:
+            logger.debug("Кэш реакций чата %s сброшен", chat_id)
+
+    async def get(self, bot: Bot, chat_id: int) -> List[str]:
+        entry = self.reactions.get(chat_id)
+        now = time.monotonic()
+        if entry is not None:
+            if entry[0] > now:
+                cache_hit("reactions", True)
+                self.reactions.move_to_end(chat_id)
+                return entry[1]
+            del self.reactions[chat_id]
+        cache_hit("reactions", False)
+        try:
+            chat = await bot.get_chat(chat_id)
+            if chat.type not in ("group", "supergroup"):
+                reactions = []
+                logger.debug("Реакции недоступны в чате %s (тип: %s)", chat_id, chat.type)
+            elif chat.available_reactions is None:
+                # Список не задан — разрешены все стандартные эмодзи
+                reactions = DEFAULT_REACTIONS
+            else:
+                reactions = [reaction.emoji for reaction in chat.available_reactions
+                             if isinstance(reaction, ReactionTypeEmoji)]
+        except Exception as e:
+            logger.error("Ошибка при получении реакций для чата %s: %s", chat_id, e)
+            reactions = []
+        self.reactions[chat_id] = (now + (self.ttl if reactions else self.negative_ttl), reactions)
+        self.reactions.move_to_end(chat_id)
+        while len(self.reactions) > self.max_size:
+            self.reactions.popitem(last=False)
+        logger.debug("Реакции для чата %s: %s", chat_id, reactions)
+        return reactions
+
+reactions_cache = ReactionsCache(REACTIONS_CACHE_TTL, REACTIONS_NEGATIVE_TTL, REACTIONS_CACHE_MAX_CHATS)
+
+async def get_available_reactions(bot: Bot, chat_id: int) -> List[str]:
     """Получает список доступных реакций для чата."""
-    if chat_id in cache:
-        return cache[chat_id]
-    try:
-        chat = await bot.get_chat(chat_id)
-        # Упрощаем: если это группа или супергруппа, предполагаем, что реакции доступны
-        if chat.type in ("group", "supergroup"):
-            reactions = ["👍", "👎", "😂", "😮", "😢"]
-            cache[chat_id] = reactions
-            logger.debug(f"Реакции для чата {chat_id}: {reactions}")
-            return reactions
-        logger.debug(f"Реакции недоступны в чате {chat_id} (тип: {chat.type})")
-        return []
-    except Exception as e:
-        logger.error(f"Ошибка при получении реакций для чата {chat_id}: {e}")
-        return []
\ No newline at end of file
+    return await reactions_cache.get(bot, chat_id)
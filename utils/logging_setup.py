@@ -0,0 +1,109 @@
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, TextIO, Union
+from config import LOG_FORMAT, LOG_QUEUE_SIZE, LOG_DEBUG_RATE, LOG_DEBUG_BURST
+
+logger = logging.getLogger(__name__)
+
+
+class DebugSampler(logging.Filter):
+    """Ограничение частоты DEBUG-записей: у каждого логгера своё ведро токенов.
+
+    Записи INFO и выше проходят всегда. Отброшенные записи считаются по
+    логгерам, итог выводится при остановке логирования.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, List[float]] = {}  # логгер -> [токены, время пополнения]
+        self.dropped: Dict[str, int] = {}
+        self.lock = threading.Lock()  # Пишут и цикл событий, и потоки
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(record.name)
+            if bucket is None:
+                bucket = self.buckets[record.name] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True
+            self.dropped[record.name] = self.dropped.get(record.name, 0) + 1
+            return False
+
+
+class _RecordQueueHandler(QueueHandler):
+    """Кладёт запись в очередь как есть: форматирование и вывод — в потоке QueueListener.
+
+    Аргументы записи форматируются позже, поэтому в горячем пути в них
+    передаются только неизменяемые значения (id, строки, числа).
+    """
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1  # Поток вывода не успевает; цикл событий не ждёт его
+
+
+class LogPipeline:
+    """Логирование через очередь: цикл событий только кладёт запись, вывод — в отдельном потоке."""
+
+    def __init__(self, level: Union[int, str], fmt: str = LOG_FORMAT, stream: Optional[TextIO] = None,
+                 debug_rate: float = LOG_DEBUG_RATE, debug_burst: float = LOG_DEBUG_BURST,
+                 queue_size: int = LOG_QUEUE_SIZE):
+        self.level = level
+        self.output = logging.StreamHandler(stream if stream is not None else sys.stderr)
+        self.output.setFormatter(logging.Formatter(fmt))
+        self.sampler = DebugSampler(debug_rate, debug_burst)
+        self.handler = _RecordQueueHandler(queue.Queue(queue_size))
+        self.handler.addFilter(self.sampler)
+        self.listener = QueueListener(self.handler.queue, self.output)
+
+    def start(self):
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        logging.getLogger("aiosqlite").setLevel(logging.INFO)
+        self.listener.start()
+
+    def stop(self):
+        """Итог прореживания, вывод оставшихся записей; дальше лог пишется напрямую."""
+        if self.sampler.dropped:
+            summary = ", ".join(f"{name}: {count}" for name, count in
+                                sorted(self.sampler.dropped.items(), key=lambda item: -item[1]))
+            logger.info("Отброшено DEBUG-записей сверх %s/с по логгерам: %s", self.sampler.rate, summary)
+        if self.handler.dropped:
+            logger.warning("Отброшено записей при переполненной очереди лога: %s", self.handler.dropped)
+        self.listener.stop()
+        root = logging.getLogger()
+        root.removeHandler(self.handler)
+        root.addHandler(self.output)
+
+
+def setup_logging(level: Union[int, str], fmt: str = LOG_FORMAT, stream: Optional[TextIO] = None,
+                  debug_rate: float = LOG_DEBUG_RATE) -> LogPipeline:
+    """Настройка корневого логгера процесса; вызывающий останавливает конвейер перед выходом."""
+    logs = LogPipeline(level, fmt, stream, debug_rate)
+    logs.start()
+    return logs
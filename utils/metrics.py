@@ -0,0 +1,252 @@
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from aiogram import BaseMiddleware, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+from config import METRICS_LOOP_LAG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек (сек)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """Монотонный счётчик с метками."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+                for values, value in self.values.items()]
+
+
+class Gauge:
+    """Текущее значение: задаётся явно или читается функцией при каждом сборе."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self) -> List[str]:
+        value = self.read() if self.read is not None else self.value
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами; в каждой корзине — только её наблюдения."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # метки -> [счётчики корзин (последняя — +Inf), сумма]
+        self.series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        bounds = self.buckets + (float("inf"),)
+        for values, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), values + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Реестр метрик процесса с выводом в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self.metrics: List[Any] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, read: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, read))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()  # Глобальный реестр метрик процесса
+
+HANDLER_SECONDS = registry.histogram("uglyok_handler_seconds", "Время обработчиков роутера", ("handler",))
+HANDLER_ERRORS = registry.counter("uglyok_handler_errors_total", "Исключения в обработчиках роутера", ("handler",))
+STORAGE_SECONDS = registry.histogram("uglyok_storage_seconds", "Время методов хранилища", ("method",))
+CACHE_REQUESTS = registry.counter("uglyok_cache_requests_total", "Обращения к кэшам", ("cache", "result"))
+API_SECONDS = registry.histogram("uglyok_api_seconds", "Время запросов к Bot API", ("method",))
+API_ERRORS = registry.counter("uglyok_api_errors_total", "Ошибки запросов к Bot API", ("method", "error"))
+LOOP_LAG_SECONDS = registry.histogram("uglyok_event_loop_lag_seconds", "Опоздание пробуждения цикла событий")
+
+
+def cache_hit(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def timed(histogram: Histogram):
+    """Декоратор корутины: время каждого вызова попадает в гистограмму с меткой имени функции."""
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        name = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время и ошибки обработчиков; внутреннее middleware, поэтому обработчик уже выбран."""
+
+    async def __call__(self, handler, event, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время и ошибки всех запросов бота к Bot API, по методам."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def instrument_router(router: Router):
+    """Подключение замера времени ко всем типам событий роутера."""
+    middleware = HandlerMetricsMiddleware()
+    for observer in router.observers.values():
+        observer.middleware(middleware)
+
+
+def watch_queues(memory, pipeline, sender):
+    """Очереди и сброс нагрузки; значения читаются при каждом сборе метрик."""
+    registry.gauge("uglyok_ingest_queue", "Сообщения в очереди записи",
+                   lambda: memory.ingest_queue.qsize() if getattr(memory, "ingest_queue", None) else 0)
+    registry.gauge("uglyok_pipeline_tasks", "Фоновые этапы в пуле", lambda: len(pipeline))
+    registry.gauge("uglyok_pipeline_dropped", "Отброшенные фоновые этапы с запуска", lambda: pipeline.dropped)
+    registry.gauge("uglyok_send_queue", "Запросы в очереди отправки", lambda: len(sender.ready) + len(sender.delayed))
+    registry.gauge("uglyok_send_dropped", "Устаревшие и отброшенные отправки с запуска", lambda: sender.dropped)
+
+
+async def monitor_loop_lag(interval: float = METRICS_LOOP_LAG_INTERVAL):
+    """Насколько позже заказанного просыпается sleep: задержка всех задач цикла событий."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - started - interval))
+
+
+class MetricsServer:
+    """Локальный HTTP-эндпоинт /metrics и фоновый замер задержки цикла событий."""
+
+    def __init__(self):
+        self.runner: Optional[web.AppRunner] = None
+        self.lag_task: Optional[asyncio.Task] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.lag_task = asyncio.create_task(monitor_loop_lag())
+        logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+
+    async def stop(self):
+        if self.lag_task:
+            self.lag_task.cancel()
+            await asyncio.gather(self.lag_task, return_exceptions=True)
+            self.lag_task = None
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
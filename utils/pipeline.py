@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from typing import Coroutine, Set
+from config import PIPELINE_CONCURRENCY, PIPELINE_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+
+class TaskPool:
+    """Ограниченный пул фоновых задач обработки апдейтов.
+
+    Одновременно выполняется не больше concurrency задач, остальные ждут
+    семафора. Если ждущих и выполняемых задач набралось max_pending, новые
+    отбрасываются: ответ бота не стоит того, чтобы копить память без предела.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_pending = max_pending
+        self.tasks: Set[asyncio.Task] = set()
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def spawn(self, coro: Coroutine, name: str) -> bool:
+        """Запуск этапа в фоне; False, если пул переполнен и этап отброшен."""
+        if len(self.tasks) >= self.max_pending:
+            coro.close()
+            self.dropped += 1
+            logger.warning("Пул фоновых задач переполнен (%s), этап %s отброшен", len(self.tasks), name)
+            return False
+        task = asyncio.create_task(self._run(coro, name))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    async def _run(self, coro: Coroutine, name: str):
+        async with self.semaphore:
+            try:
+                await coro
+            except Exception as e:
+                logger.error("Ошибка в фоновом этапе %s: %s", name, e)
+
+    async def drain(self):
+        """Ожидание завершения всех запущенных этапов."""
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+        logger.debug("Фоновые этапы обработки завершены")
+
+
+pipeline = TaskPool(PIPELINE_CONCURRENCY, PIPELINE_MAX_PENDING)  # Глобальный пул этапов обработки сообщений
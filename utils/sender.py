@@ -0,0 +1,253 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from aiogram.exceptions import TelegramRetryAfter
+from config import SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_COMMAND = 0  # Ответы на команды и кнопки настроек
+PRIORITY_CHATTER = 1  # Реакции и случайные ответы бота
+
+# Вызов Bot API без аргументов; фабрика нужна, чтобы повторить запрос после RetryAfter
+SendFactory = Callable[[], Awaitable[Any]]
+
+
+class SendDropped(Exception):
+    """Запрос снят с очереди без отправки: устарел или планировщик остановлен.
+
+    Ожидающий sender.call получает это исключение, а не CancelledError,
+    которое aiogram принял бы за отмену самого обработчика.
+    """
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас."""
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд появится токен; 0 — отправлять можно сейчас."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, until: float):
+        """Остановка ведра до момента until (RetryAfter от Telegram)."""
+        self.paused_until = max(self.paused_until, until)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+    def idle(self, now: float) -> bool:
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("chat_id", "factory", "priority", "deadline", "future", "seq")
+
+    def __init__(self, chat_id: int, factory: SendFactory, priority: int,
+                 deadline: Optional[float], future: Optional[asyncio.Future], seq: int):
+        self.chat_id = chat_id
+        self.factory = factory
+        self.priority = priority
+        self.deadline = deadline
+        self.future = future
+        self.seq = seq
+
+    def stale(self, now: float) -> bool:
+        return self.deadline is not None and now > self.deadline
+
+
+class Sender:
+    """Планировщик исходящих запросов к Bot API.
+
+    Общее ведро ограничивает всю отправку бота, вёдра чатов — отправку в
+    каждый чат. Готовые задания лежат в куче по (приоритет, порядок), задания
+    чатов, исчерпавших лимит, ждут своего времени в отдельной куче и не
+    задерживают остальные чаты. Болтовня устаревает через max_age секунд и
+    отбрасывается, ответы на команды ждут сколько нужно.
+    """
+
+    MAX_IDLE_BUCKETS = 10000  # После этого числа вёдер простаивающие удаляются
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float):
+        self.global_bucket = TokenBucket(global_rate, global_rate, time.monotonic())
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.ready: List[Tuple[int, int, _Job]] = []
+        self.delayed: List[Tuple[float, int, _Job]] = []
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.worker_task: Optional[asyncio.Task] = None
+        self.inflight: Set[asyncio.Task] = set()
+        self.dropped = 0
+
+    def set_global_rate(self, rate: float):
+        """Смена общего лимита, например, когда отправку делят несколько процессов."""
+        self.global_bucket = TokenBucket(rate, rate, time.monotonic())
+
+    @property
+    def running(self) -> bool:
+        return self.worker_task is not None and not self.worker_task.done()
+
+    def start(self):
+        """Запуск фонового цикла отправки."""
+        if self.running:
+            return
+        self.wakeup = asyncio.Event()
+        self.worker_task = asyncio.create_task(self._worker_loop())
+        logger.debug("Планировщик отправки запущен")
+
+    async def stop(self):
+        """Остановка: ожидание начатых запросов, ожидающие в очереди получают SendDropped."""
+        if not self.worker_task:
+            return
+        self.worker_task.cancel()
+        try:
+            await self.worker_task
+        except asyncio.CancelledError:
+            pass
+        self.worker_task = None
+        if self.inflight:
+            await asyncio.gather(*self.inflight, return_exceptions=True)
+        pending = [job for _, _, job in self.ready] + [job for _, _, job in self.delayed]
+        for job in pending:
+            if job.future is not None and not job.future.done():
+                job.future.set_exception(SendDropped("планировщик отправки остановлен"))
+        self.ready.clear()
+        self.delayed.clear()
+        logger.info("Планировщик отправки остановлен, снято запросов с очереди: %s", len(pending))
+
+    def submit(self, chat_id: int, factory: SendFactory, priority: int = PRIORITY_CHATTER,
+               max_age: Optional[float] = SEND_MAX_AGE):
+        """Постановка запроса в очередь без ожидания; ошибки только логируются."""
+        self._enqueue(chat_id, factory, priority, max_age, None)
+
+    async def call(self, chat_id: int, factory: SendFactory, priority: int = PRIORITY_COMMAND,
+                   max_age: Optional[float] = None) -> Any:
+        """Запрос через очередь с ожиданием результата; ошибки и SendDropped пробрасываются вызывающему."""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(chat_id, factory, priority, max_age, future)
+        return await future
+
+    def _enqueue(self, chat_id: int, factory: SendFactory, priority: int,
+                 max_age: Optional[float], future: Optional[asyncio.Future]):
+        deadline = None if max_age is None else time.monotonic() + max_age
+        job = _Job(chat_id, factory, priority, deadline, future, next(self.counter))
+        if not self.running:
+            # Без планировщика (например, в скриптах) запрос выполняется сразу
+            self._spawn(job)
+            return
+        heapq.heappush(self.ready, (job.priority, job.seq, job))
+        self.wakeup.set()
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_IDLE_BUCKETS:
+                self.chat_buckets = {chat: b for chat, b in self.chat_buckets.items() if not b.idle(now)}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _drop(self, job: _Job, reason: str):
+        self.dropped += 1
+        if job.future is not None and not job.future.done():
+            job.future.set_exception(SendDropped(reason))
+        logger.debug("Запрос в чат %s отброшен: %s", job.chat_id, reason)
+
+    async def _worker_loop(self):
+        while True:
+            now = time.monotonic()
+            while self.delayed and self.delayed[0][0] <= now:
+                _, _, job = heapq.heappop(self.delayed)
+                heapq.heappush(self.ready, (job.priority, job.seq, job))
+            if not self.ready:
+                timeout = self.delayed[0][0] - now if self.delayed else None
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job = self.ready[0][2]
+            if job.stale(now):
+                heapq.heappop(self.ready)
+                self._drop(job, "устарел в очереди")
+                continue
+            if job.future is not None and job.future.done():
+                heapq.heappop(self.ready)  # Вызывающий перестал ждать
+                continue
+            wait = self.global_bucket.delay(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self.ready)
+            bucket = self._chat_bucket(job.chat_id, now)
+            wait = bucket.delay(now)
+            if wait > 0:
+                heapq.heappush(self.delayed, (now + wait, job.seq, job))
+                continue
+            self.global_bucket.take(now)
+            bucket.take(now)
+            self._spawn(job)
+
+    def _spawn(self, job: _Job):
+        task = asyncio.create_task(self._run(job))
+        self.inflight.add(task)
+        task.add_done_callback(self.inflight.discard)
+
+    async def _run(self, job: _Job):
+        try:
+            result = await job.factory()
+        except TelegramRetryAfter as e:
+            until = time.monotonic() + e.retry_after
+            # Ожидание при флуде Telegram действует на весь бот, а не только на этот чат
+            self.global_bucket.pause(until)
+            self._chat_bucket(job.chat_id, time.monotonic()).pause(until)
+            logger.warning("Telegram просит подождать %s с перед отправкой в чат %s", e.retry_after, job.chat_id)
+            if not self.running:
+                if job.future is not None and not job.future.done():
+                    job.future.set_exception(e)
+                return
+            if job.deadline is not None and until > job.deadline:
+                self._drop(job, f"RetryAfter {e.retry_after} с")
+                return
+            heapq.heappush(self.delayed, (until, job.seq, job))
+            self.wakeup.set()
+        except Exception as e:
+            if job.future is not None:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                logger.error("Ошибка отправки в чат %s: %s", job.chat_id, e)
+        else:
+            if job.future is not None and not job.future.done():
+                job.future.set_result(result)
+
+
+sender = Sender(SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST)  # Глобальный планировщик отправки
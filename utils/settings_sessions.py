@@ -0,0 +1,102 @@
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from aiogram.fsm.context import FSMContext
+from config import SETTINGS_SESSION_TTL, SETTINGS_SESSION_MAX
+
+logger = logging.getLogger(__name__)
+
+# chat_id -> (владелец, срок, его FSM-состояние в чате)
+Session = Tuple[int, float, Optional[FSMContext]]
+
+
+class SettingsSessions:
+    """Открытые меню /settings: какой администратор сейчас настраивает чат.
+
+    Сеанс продлевается каждым действием владельца и освобождается, когда
+    меню завершено, через ttl секунд без действий или при вытеснении, если
+    открыто больше max_size меню. Сроки лежат в куче; продление добавляет
+    новую запись, а старая отбрасывается при извлечении, поэтому обращение
+    к сеансу не перебирает остальные. Вместе с сеансом сбрасывается
+    FSM-состояние владельца, чтобы ожидание ввода числа не пережило меню.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sessions: Dict[int, Session] = {}
+        self.expiry: List[Tuple[float, int]] = []  # Куча (срок, chat_id), в том числе устаревшие записи
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    async def acquire(self, chat_id: int, user_id: int, state: Optional[FSMContext] = None) -> bool:
+        """Открытие меню; False, если меню чата уже открыл другой пользователь."""
+        await self._expire()
+        session = self.sessions.get(chat_id)
+        if session is not None and session[0] != user_id:
+            return False
+        if session is None and len(self.sessions) >= self.max_size:
+            await self._evict()
+        if state is None and session is not None:
+            state = session[2]
+        self._schedule(chat_id, user_id, state)
+        return True
+
+    async def touch(self, chat_id: int, user_id: int, state: Optional[FSMContext] = None) -> Optional[int]:
+        """Владелец меню чата или None; действие владельца продлевает сеанс."""
+        await self._expire()
+        session = self.sessions.get(chat_id)
+        if session is None:
+            return None
+        if session[0] == user_id:
+            self._schedule(chat_id, user_id, state if state is not None else session[2])
+        return session[0]
+
+    async def release(self, chat_id: int):
+        """Меню завершено: сеанс и ожидание ввода владельца сбрасываются."""
+        session = self.sessions.pop(chat_id, None)
+        if session is not None:
+            await self._close(chat_id, session, "закрыто")
+
+    def _schedule(self, chat_id: int, user_id: int, state: Optional[FSMContext]):
+        expires = time.monotonic() + self.ttl
+        self.sessions[chat_id] = (user_id, expires, state)
+        heapq.heappush(self.expiry, (expires, chat_id))
+        if len(self.expiry) > 2 * len(self.sessions) + 64:
+            # Продления копят в куче устаревшие записи; пересобираем её из живых сеансов
+            self.expiry = [(session[1], chat) for chat, session in self.sessions.items()]
+            heapq.heapify(self.expiry)
+
+    def _pop_live(self, until: float = float("inf")) -> Optional[Tuple[int, Session]]:
+        """Сеанс с ближайшим сроком, если срок не позже until; устаревшие записи кучи отбрасываются."""
+        while self.expiry and self.expiry[0][0] <= until:
+            expires, chat_id = heapq.heappop(self.expiry)
+            session = self.sessions.get(chat_id)
+            if session is not None and session[1] == expires:
+                del self.sessions[chat_id]
+                return chat_id, session
+        return None
+
+    async def _expire(self):
+        now = time.monotonic()
+        while True:
+            popped = self._pop_live(now)
+            if popped is None:
+                return
+            await self._close(*popped, "истекло")
+
+    async def _evict(self):
+        popped = self._pop_live()
+        if popped is not None:
+            await self._close(*popped, "вытеснено")
+
+    async def _close(self, chat_id: int, session: Session, reason: str):
+        user_id, _, state = session
+        if state is not None:
+            await state.clear()
+        logger.debug("Меню настроек чата %s пользователя %s %s", chat_id, user_id, reason)
+
+
+settings_sessions = SettingsSessions(SETTINGS_SESSION_TTL, SETTINGS_SESSION_MAX)
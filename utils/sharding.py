@@ -0,0 +1,249 @@
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+from aiohttp import web
+from config import (BOT_TOKEN, LOG_FORMAT, SEND_GLOBAL_RATE, SHARD_DB_PATTERN, SHARD_LANES, SHARD_QUEUE_SIZE,
+                    SNAPSHOT_PATH, STORAGE_BACKEND, WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+                    WEBHOOK_SECRET, METRICS_ENABLED, METRICS_HOST, METRICS_PORT)
+from utils.logging_setup import setup_logging
+from utils.metrics import ApiMetricsMiddleware, MetricsServer, instrument_router, watch_queues
+from utils.webhook import SECRET_HEADER
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 30  # Длительность long polling во входном процессе (сек)
+
+
+def chat_hash(chat_id: int) -> int:
+    """Стабильный между процессами и запусками хэш чата."""
+    return zlib.crc32(str(chat_id).encode())
+
+
+def shard_for(chat_id: Optional[int], count: int) -> int:
+    if chat_id is None:
+        return 0
+    return chat_hash(chat_id) % count
+
+
+def shard_db_path(index: int, count: int) -> str:
+    if STORAGE_BACKEND == "memory":
+        return f"{SNAPSHOT_PATH}.{count}.{index}"
+    return SHARD_DB_PATTERN.format(index=index, count=count)
+
+
+def update_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """chat_id апдейта в виде JSON: у сообщений и участников — chat, у кнопок — message.chat."""
+    for key, event in data.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat.get("id")
+    return None
+
+
+def resolve_update_types() -> List[str]:
+    """Типы апдейтов, которые нужны обработчикам."""
+    from handlers.group_handlers import group_router
+    dp = Dispatcher()
+    dp.include_router(group_router)
+    return dp.resolve_used_update_types()
+
+
+# --- Процесс-обработчик ---
+
+def worker_main(index: int, count: int, updates: multiprocessing.Queue, log_level: int):
+    """Точка входа процесса-обработчика."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Останавливает входной процесс, присылая None
+    logs = setup_logging(log_level, fmt=f"[shard {index}] {LOG_FORMAT}")
+    try:
+        asyncio.run(run_worker(index, count, updates))
+    finally:
+        logs.stop()
+
+
+async def run_worker(index: int, count: int, updates: multiprocessing.Queue):
+    from handlers.group_handlers import group_router
+    from storage.memory import memory
+    from utils.pipeline import pipeline
+    from utils.sender import sender
+
+    memory.db_path = shard_db_path(index, count)
+    if not await memory.init_db():
+        logger.critical("Обработчик %s: не удалось открыть базу %s", index, memory.db_path)
+        return
+    sender.set_global_rate(SEND_GLOBAL_RATE / count)  # Общий лимит бота делится между процессами
+    sender.start()
+    bot = Bot(token=BOT_TOKEN)
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(group_router)
+    metrics = MetricsServer()
+    if METRICS_ENABLED:
+        instrument_router(group_router)
+        bot.session.middleware(ApiMetricsMiddleware())
+        watch_queues(memory, pipeline, sender)
+        await metrics.start(METRICS_HOST, METRICS_PORT + 1 + index)
+    lanes = [asyncio.Queue(maxsize=SHARD_QUEUE_SIZE) for _ in range(SHARD_LANES)]
+
+    async def lane_loop(lane: asyncio.Queue):
+        while True:
+            data = await lane.get()
+            try:
+                await dp.feed_update(bot, Update.model_validate(data, context={"bot": bot}))
+            except Exception as e:
+                logger.error("Ошибка обработки апдейта %s: %s", data.get("update_id"), e)
+            finally:
+                lane.task_done()
+
+    lane_tasks = [asyncio.create_task(lane_loop(lane)) for lane in lanes]
+    logger.info("Обработчик %s из %s запущен, база %s", index, count, memory.db_path)
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        try:
+            while True:
+                data = await loop.run_in_executor(reader, updates.get)
+                if data is None:
+                    break
+                # Шард уже выбран по chat_hash % count, очередь берём из оставшихся битов
+                lane = chat_hash(update_chat_id(data) or 0) // count % SHARD_LANES
+                await lanes[lane].put(data)
+        finally:
+            for lane in lanes:
+                await lane.join()
+            for task in lane_tasks:
+                task.cancel()
+            await asyncio.gather(*lane_tasks, return_exceptions=True)
+            await pipeline.drain()
+            await sender.stop()
+            await memory.close_db()  # Сбрасывает очередь записи на диск
+            await bot.session.close()
+            await metrics.stop()
+    logger.info("Обработчик %s остановлен", index)
+
+
+# --- Входной процесс ---
+
+class ShardRouter:
+    """Процессы-обработчики и раскладка апдейтов по ним.
+
+    Входной процесс получает апдейты (polling или webhook) и раскладывает их
+    по обработчикам по хэшу chat_id. У каждого обработчика свой BotMemory и
+    свой файл SQLite, так что чат целиком живёт в одном процессе. Внутри
+    обработчика чат закреплён за одной из SHARD_LANES очередей, поэтому
+    апдейты одного чата обрабатываются строго по порядку.
+    """
+
+    def __init__(self, count: int, log_level: int = logging.INFO):
+        context = multiprocessing.get_context("spawn")
+        self.count = count
+        self.queues = [context.Queue(maxsize=SHARD_QUEUE_SIZE) for _ in range(count)]
+        self.processes = [
+            context.Process(target=worker_main, args=(index, count, self.queues[index], log_level),
+                            name=f"shard-{index}")
+            for index in range(count)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        logger.info("Запущено обработчиков: %s", self.count)
+
+    async def route(self, data: Dict[str, Any]):
+        target = self.queues[shard_for(update_chat_id(data), self.count)]
+        try:
+            target.put_nowait(data)
+        except queue.Full:
+            # Обработчик не успевает: ждём места, не блокируя цикл событий
+            await asyncio.get_running_loop().run_in_executor(None, target.put, data)
+
+    async def stop(self):
+        """Обработчики дорабатывают свои очереди, сбрасывают базы и завершаются."""
+        loop = asyncio.get_running_loop()
+        for target in self.queues:
+            await loop.run_in_executor(None, target.put, None)
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join)
+        logger.info("Все обработчики остановлены")
+
+
+async def poll_updates(bot: Bot, router: ShardRouter, allowed_updates: List[str]):
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error("Ошибка получения апдейтов: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await router.route(update.model_dump(mode="json", by_alias=True, exclude_unset=True))
+            offset = update.update_id + 1
+
+
+async def serve_webhook(bot: Bot, router: ShardRouter, allowed_updates: List[str], stop: asyncio.Event):
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            logger.warning("Webhook-запрос с неверным секретным токеном от %s", request.remote)
+            return web.Response(status=401)
+        try:
+            data = json.loads(await request.read())
+        except ValueError as e:
+            logger.error("Некорректный апдейт в webhook-запросе: %s", e)
+            return web.Response(status=400)
+        await router.route(data)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info("Webhook-сервер слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None, allowed_updates=allowed_updates)
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_sharded(count: int, use_webhook: bool, log_level: int = logging.INFO):
+    """Входной процесс: приём апдейтов и раскладка по count обработчикам до сигнала остановки."""
+    router = ShardRouter(count, log_level)
+    router.start()
+    bot = Bot(token=BOT_TOKEN)
+    metrics = MetricsServer()
+    if METRICS_ENABLED:
+        bot.session.middleware(ApiMetricsMiddleware())
+        await metrics.start(METRICS_HOST, METRICS_PORT)
+    allowed_updates = resolve_update_types()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        if use_webhook:
+            await serve_webhook(bot, router, allowed_updates, stop)
+        else:
+            await bot.delete_webhook()
+            receiver = asyncio.create_task(poll_updates(bot, router, allowed_updates))
+            await stop.wait()
+            receiver.cancel()
+            await asyncio.gather(receiver, return_exceptions=True)
+    finally:
+        await router.stop()
+        await bot.session.close()
+        await metrics.stop()
@@ -0,0 +1,84 @@
+import asyncio
+import hmac
+import json
+import logging
+from typing import List, Optional
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Приём апдейтов Telegram через webhook на локальном aiohttp-сервере.
+
+    Запрос проверяется по секретному токену, апдейт кладётся в очередь, и
+    Telegram сразу получает 200. Очередь разбирают workers обработчиков через
+    dp.feed_update. Заполненная очередь задерживает ответ на запрос, и Telegram
+    сам снижает темп доставки.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str, secret: str, workers: int, queue_size: int):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.runner: Optional[web.AppRunner] = None
+        self.worker_tasks: List[asyncio.Task] = []
+
+    @property
+    def port(self) -> Optional[int]:
+        """Фактический порт сервера (полезно, если запущен на порту 0)."""
+        if not self.runner or not self.runner.addresses:
+            return None
+        return self.runner.addresses[0][1]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            logger.warning("Webhook-запрос с неверным секретным токеном от %s", request.remote)
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(json.loads(await request.read()), context={"bot": self.bot})
+        except ValueError as e:
+            logger.error("Некорректный апдейт в webhook-запросе: %s", e)
+            return web.Response(status=400)
+        await self.queue.put(update)
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error("Ошибка обработки апдейта %s: %s", update.update_id, e)
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host: str, port: int):
+        """Запуск обработчиков и HTTP-сервера."""
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        self.worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        await web.TCPSite(self.runner, host, port).start()
+        logger.info("Webhook-сервер слушает %s:%s%s, обработчиков: %s", host, self.port, self.path, self.workers)
+
+    async def stop(self):
+        """Плавная остановка: новые запросы не принимаются, очередь дорабатывается до конца."""
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+        if self.worker_tasks:
+            await self.queue.join()
+            for task in self.worker_tasks:
+                task.cancel()
+            await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+            self.worker_tasks = []
+        logger.info("Webhook-сервер остановлен, очередь апдейтов обработана")